@@ -6,6 +6,7 @@ class APIClient {
     
     // 通用请求方法
     async request(endpoint, options = {}) {
+        const startTime = performance.now();
         try {
             const url = `${this.baseURL}/api${endpoint}`;
             const response = await fetch(url, {
@@ -21,6 +22,10 @@ class APIClient {
             }
             
             const data = await response.json();
+            // 遥测上报本身不计入 API 响应时间
+            if (endpoint !== '/telemetry') {
+                window.performanceMonitor?.recordAPIResponseTime(endpoint, performance.now() - startTime);
+            }
             return data;
         } catch (error) {
             console.error(`API请求失败 [${endpoint}]:`, error);
@@ -28,6 +33,18 @@ class APIClient {
         }
     }
     
+    // 拼接查询字符串，忽略空值
+    buildQuery(params = {}) {
+        const query = new URLSearchParams();
+        Object.entries(params).forEach(([key, value]) => {
+            if (value !== undefined && value !== null && value !== '') {
+                query.append(key, value);
+            }
+        });
+        const text = query.toString();
+        return text ? `?${text}` : '';
+    }
+    
     // 获取通用配置
     async getConfig() {
         return await this.request('/config');
@@ -59,6 +76,52 @@ class APIClient {
         });
     }
     
+    // 一次生成整场植物防御战役（传入 seed 可复现）
+    async generateDefenseCampaign(difficulty, seed = null) {
+        return await this.request('/defense/campaign', {
+            method: 'POST',
+            body: JSON.stringify({
+                difficulty: difficulty,
+                seed: seed
+            })
+        });
+    }
+    
+    // 流式生成战役：每收到一波即回调 onWave(wave)，返回战役信息
+    async streamDefenseCampaign(difficulty, onWave, seed = null) {
+        const response = await fetch(`${this.baseURL}/api/defense/campaign/stream`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ difficulty: difficulty, seed: seed })
+        });
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+        }
+        
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let header = null;
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let newline;
+            while ((newline = buffer.indexOf('\n')) >= 0) {
+                const line = buffer.slice(0, newline).trim();
+                buffer = buffer.slice(newline + 1);
+                if (!line) continue;
+                const item = JSON.parse(line);
+                if (header === null) {
+                    header = item;
+                } else {
+                    onWave(item);
+                }
+            }
+        }
+        return header;
+    }
+    
     // 获取植物防御配置
     async getDefenseConfig() {
         return await this.request('/defense/config');
@@ -77,6 +140,22 @@ class APIClient {
         });
     }
     
+    // 批量保存游戏统计（每条可带 idempotency_key，重试不会重复写入）
+    async saveGameStatsBatch(items) {
+        return await this.request('/stats/batch', {
+            method: 'POST',
+            body: JSON.stringify(items)
+        });
+    }
+    
+    // 批量保存植物防御统计
+    async saveDefenseStatsBatch(items) {
+        return await this.request('/defense/stats/batch', {
+            method: 'POST',
+            body: JSON.stringify(items)
+        });
+    }
+    
     // 保存植物防御统计
     async saveDefenseStats(stats) {
         return await this.request('/defense/stats', {
@@ -85,29 +164,205 @@ class APIClient {
         });
     }
     
-    // 获取游戏统计
-    async getGameStats() {
-        return await this.request('/stats');
+    // 获取游戏统计（可选 limit / cursor / since / until / mode / player_id / fields / order）
+    async getGameStats(params = {}) {
+        return await this.request(`/stats${this.buildQuery(params)}`);
+    }
+    
+    // 获取植物防御统计（可选 limit / cursor / since / until / difficulty / player_id / fields / order）
+    async getDefenseStats(params = {}) {
+        return await this.request(`/defense/stats${this.buildQuery(params)}`);
     }
     
-    // 获取植物防御统计
-    async getDefenseStats() {
-        return await this.request('/defense/stats');
+    // 获取排行榜（可选 limit / offset / mode / since / until）
+    async getLeaderboard(params = {}) {
+        return await this.request(`/leaderboard${this.buildQuery(params)}`);
     }
     
-    // 获取排行榜
-    async getLeaderboard() {
-        return await this.request('/leaderboard');
+    // 获取植物防御排行榜（可选 limit / offset / difficulty / since / until）
+    async getDefenseLeaderboard(params = {}) {
+        return await this.request(`/defense/leaderboard${this.buildQuery(params)}`);
     }
     
-    // 获取植物防御排行榜
-    async getDefenseLeaderboard() {
-        return await this.request('/defense/leaderboard');
+    // 获取玩家的个人最佳与名次（默认为本机玩家）
+    async getPlayerProfile(playerId = Utils.getPlayerId()) {
+        return await this.request(`/players/${encodeURIComponent(playerId)}`);
     }
     
-    // 获取游戏分析数据
-    async getAnalytics() {
-        return await this.request('/analytics');
+    // 订阅排行榜实时更新（WebSocket）：先收到快照，之后只收到差异；断线后自动重连
+    // path 为 '/leaderboard/live' 或 '/defense/leaderboard/live'，onUpdate(entries) 在榜单变化时回调
+    subscribeLeaderboard(path, params = {}, onUpdate = () => {}) {
+        const protocol = location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const url = `${protocol}//${location.host}${this.baseURL}/api${path}${this.buildQuery(params)}`;
+        let entries = [];
+        let version = -1;
+        let socket = null;
+        let closed = false;
+
+        const connect = () => {
+            socket = new WebSocket(url);
+            socket.onmessage = (event) => {
+                const message = JSON.parse(event.data);
+                if (message.type === 'snapshot') {
+                    entries = message.entries;
+                } else if (message.type === 'diff' && message.version === version + 1) {
+                    message.inserts.forEach(({ rank, entry }) => entries.splice(rank, 0, entry));
+                    entries.length = Math.min(entries.length, message.size);
+                } else {
+                    // 漏掉了版本，重连以取得新快照
+                    socket.close();
+                    return;
+                }
+                version = message.version;
+                onUpdate(entries.slice());
+            };
+            socket.onclose = () => {
+                version = -1;
+                if (!closed) {
+                    setTimeout(connect, 2000);
+                }
+            };
+        };
+        connect();
+
+        return {
+            close: () => {
+                closed = true;
+                socket.close();
+            }
+        };
+    }
+
+    // 加入多人竞速房间：onState(view) 在房间状态或任何玩家位置变化时回调
+    // 返回 { report(progress, errors), start(), close() }；进度上报按 tick 节流，只发送最新值
+    async joinRaceRoom(roomId, name, onState = () => {}) {
+        const located = await this.request(`/racing/rooms/${encodeURIComponent(roomId)}`);
+        let url = located.data.url;
+        if (url.startsWith('/')) {
+            const protocol = location.protocol === 'https:' ? 'wss:' : 'ws:';
+            url = `${protocol}//${location.host}${url}`;
+        }
+        const socket = new WebSocket(`${url}${this.buildQuery({ name })}`);
+        const view = { slot: null, state: 'connecting', players: [] };
+        let pending = null;
+        let timer = null;
+
+        const send = (message) => {
+            if (socket.readyState === WebSocket.OPEN) {
+                socket.send(JSON.stringify(message));
+            }
+        };
+
+        socket.onmessage = (event) => {
+            const message = JSON.parse(event.data);
+            if (message.type === 'joined') {
+                view.slot = message.slot;
+                return;
+            }
+            if (message.type === 'error') {
+                view.state = 'error';
+                view.error = message.message;
+            } else if (message.type === 'snapshot') {
+                Object.assign(view, message);
+            } else if (message.type === 'tick') {
+                view.elapsed_ms = message.elapsed_ms;
+                message.d.forEach(([slot, progress]) => {
+                    const player = view.players.find(p => p.slot === slot);
+                    if (player) player.progress = progress;
+                });
+                (message.f || []).forEach(([slot, rank, timeMs]) => {
+                    const player = view.players.find(p => p.slot === slot);
+                    if (player) Object.assign(player, { rank, time_ms: timeMs });
+                });
+            }
+            onState(view);
+        };
+        socket.onclose = () => {
+            clearTimeout(timer);
+            if (view.state !== 'finished' && view.state !== 'error') {
+                view.state = 'disconnected';
+                onState(view);
+            }
+        };
+
+        return {
+            report: (progress, errors = 0) => {
+                pending = { p: progress, e: errors };
+                if (!timer) {
+                    timer = setTimeout(() => {
+                        timer = null;
+                        send(pending);
+                    }, 1000 / (view.tick_rate || 20));
+                }
+            },
+            start: () => send({ t: 'start' }),
+            close: () => socket.close()
+        };
+    }
+
+    // 保存一局的按键时间线（keys 与 intervals 逐键对应，退格为 '\b'）
+    async saveTimeline(timeline) {
+        return await this.request('/timelines', {
+            method: 'POST',
+            body: JSON.stringify(timeline)
+        });
+    }
+
+    // 获取最佳成绩的时间线信息（可按模式），作为幽灵对手
+    async getBestTimeline(mode = null) {
+        return await this.request(`/timelines/best${this.buildQuery({ mode })}`);
+    }
+
+    // 按原节奏回放时间线：首行信息交给 onInfo，之后每次按键调用 onKey(elapsedMs, key, correct)
+    async streamGhost(timelineId, onKey, onInfo = () => {}, speed = 1) {
+        const response = await fetch(`${this.baseURL}/api/timelines/${encodeURIComponent(timelineId)}/replay${this.buildQuery({ speed })}`);
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+        }
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let first = true;
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            for (const line of lines) {
+                if (!line) continue;
+                const data = JSON.parse(line);
+                if (first) {
+                    first = false;
+                    onInfo(data);
+                } else {
+                    onKey(data[0], data[1], data[2] === 1);
+                }
+            }
+        }
+    }
+
+    // 获取按键热力图：kind 为 'keys'（逐键）或 'bigrams'（上一个键 × 当前键），可只看某个玩家
+    async getKeyHeatmap(kind = 'keys', playerId = null) {
+        return await this.request(`/analytics/heatmap${this.buildQuery({ kind, player_id: playerId })}`);
+    }
+
+    // 获取游戏分析数据（可选 percentiles / since / until）
+    async getAnalytics(params = {}) {
+        return await this.request(`/analytics${this.buildQuery(params)}`);
+    }
+
+    // 上报一批客户端性能样本
+    async sendTelemetry(batch) {
+        return await this.request('/telemetry', {
+            method: 'POST',
+            body: JSON.stringify(batch)
+        });
+    }
+
+    // 获取客户端性能分位数（可选 metrics / mode / client / since / until / by）
+    async getPerformanceAnalytics(params = {}) {
+        return await this.request(`/analytics/performance${this.buildQuery(params)}`);
     }
 }
 
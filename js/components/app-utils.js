@@ -288,10 +288,13 @@ const AppUtils = {
             };
         };
 
-        // 版本号来自后端（唯一真源 pyproject.toml），无条件拉取填入页脚
+        // 版本号来自后端（唯一真源 pyproject.toml），无条件拉取填入页脚；顺带按下发的抽样率开启性能遥测
         const loadVersion = async () => {
             try {
                 const response = await window.apiClient?.getConfig();
+                if (response?.data?.telemetry) {
+                    window.performanceMonitor?.configureTelemetry(response.data.telemetry);
+                }
                 const version = response?.data?.version;
                 if (version) {
                     const el = document.getElementById('appVersion');
@@ -991,7 +991,8 @@ class DefenseEngine extends EventEmitter {
                     plant_health: results.plantHealth,
                     difficulty: results.difficulty,
                     victory: results.victory,
-                    play_time: results.playTime
+                    play_time: results.playTime,
+                    player_id: Utils.getPlayerId()
                 };
                 
                 const response = await window.apiClient.saveDefenseStats(stats);
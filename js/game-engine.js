@@ -147,6 +147,7 @@ class GameEngine extends Utils.EventEmitter {
         }
         
         this.gameStore.actions.setText(text);
+        this.recordTimelineText(text);
         
         console.log(`生成${gameState.mode}模式文本:`, text.substring(0, 50) + '...');
     }
@@ -236,6 +237,7 @@ class GameEngine extends Utils.EventEmitter {
 
             // 重置游戏状态（通过统一状态管理）
             this.gameStore.actions.resetGame();
+            this.timeline = { texts: [], keys: [], intervals: [], lastTime: performance.now() };
 
             // 防御模式没有打字文本，由 defenseEngine 驱动自己的模拟
             if (gameState.mode !== 'defense') {
@@ -293,6 +295,9 @@ class GameEngine extends Utils.EventEmitter {
                 this.gameStore.updateState('game.startTime', gameState.startTime + pauseDuration);
             }
             this.gameStore.updateState('game.pauseStartTime', null);
+            if (this.timeline && pauseStartTime) {
+                this.timeline.lastTime += Date.now() - pauseStartTime;  // 暂停时长不计入按键间隔
+            }
             this.startUpdateLoop();
             if (window.audioManager) {
                 const audioStatus = window.audioManager.getStatus();
@@ -376,6 +381,8 @@ class GameEngine extends Utils.EventEmitter {
                 finalStats = window.statsManager.endGame(true, extraResults);
             }
 
+            this.uploadTimeline(gameState.mode);
+
             // 更新UI - 通过事件系统
             if (finalStats) {
                 this.emit('resultsUpdated', finalStats);
@@ -406,9 +413,19 @@ class GameEngine extends Utils.EventEmitter {
 
         const key = e.key;
         
+        // 输入延迟：从按键事件发生到处理后的下一帧
+        if (window.performanceMonitor?.isMonitoring) {
+            requestAnimationFrame(() => window.performanceMonitor.recordInputLatency(e.timeStamp));
+        }
+        
         // 记录按键
         this.gameStore.actions.recordKeystroke();
         
+        // 记录按键时间线（退格记为 \b）
+        if (key === 'Backspace' || key.length === 1) {
+            this.recordTimelineKey(key === 'Backspace' ? '\b' : key);
+        }
+
         // 处理退格键
         if (key === 'Backspace') {
             e.preventDefault();
@@ -429,6 +446,34 @@ class GameEngine extends Utils.EventEmitter {
         }
     }
     
+    // 按键时间线：依次出现的文本、逐键字符与间隔（毫秒），结束时上传供回放 / 幽灵对手
+    recordTimelineText(text) {
+        if (this.timeline) {
+            this.timeline.texts.push(text);
+        }
+    }
+
+    recordTimelineKey(key) {
+        if (!this.timeline) return;
+        const now = performance.now();
+        this.timeline.keys.push(key);
+        this.timeline.intervals.push(Math.round(now - this.timeline.lastTime));
+        this.timeline.lastTime = now;
+    }
+
+    uploadTimeline(mode) {
+        const timeline = this.timeline;
+        this.timeline = null;
+        if (!timeline || !timeline.keys.length || !timeline.texts.length || !window.apiClient) return;
+        window.apiClient.saveTimeline({
+            mode: mode,
+            player_id: Utils.getPlayerId(),
+            texts: timeline.texts,
+            keys: timeline.keys.join(''),
+            intervals: timeline.intervals
+        }).catch(error => console.warn('按键时间线上传失败:', error));
+    }
+
     // 处理输入逻辑（只处理业务逻辑：音效、错误记录、完成检查）
     handleInputLogic(input) {
         return this.errorHandler.wrapSync(() => {
@@ -467,7 +512,9 @@ class GameEngine extends Utils.EventEmitter {
                 } else if (gameState.mode === 'racing') {
                     // 赛车模式打完一段：先把本段统计入账（累积模式），再续下一段
                     this.bankCurrentTextStats();
-                    this.gameStore.actions.setText(this.generateRacingText());
+                    const nextText = this.generateRacingText();
+                    this.gameStore.actions.setText(nextText);
+                    this.recordTimelineText(nextText);
                     this.gameStore.actions.setUserInput('');
                 } else {
                     this.completeGame();
@@ -517,6 +564,7 @@ class GameEngine extends Utils.EventEmitter {
             // 显示下一个单词
             const nextWord = wordsState.wordsList[newCurrentWordIndex];
             this.gameStore.actions.setText(nextWord);
+            this.recordTimelineText(nextWord);
             this.gameStore.actions.setUserInput('');
             
             console.log(`单词完成: ${newWordsCompleted}/${wordsState.totalWords}`);
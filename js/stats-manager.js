@@ -116,17 +116,34 @@ class StatsManager extends Utils.EventEmitter {
         }
     }
     
-    // 同步到服务器
+    // 同步到服务器：先进入本地待上报队列，再批量提交（离线时保留到下次同步）
     async syncToServer(gameRecord) {
+        const pending = Utils.Storage.get('pendingStats', []);
+        pending.push({
+            wpm: gameRecord.wpm,
+            accuracy: gameRecord.accuracy,
+            time_taken: gameRecord.timeElapsed,
+            errors: gameRecord.errors,
+            mode: gameRecord.mode,
+            player_id: Utils.getPlayerId(),
+            timestamp: gameRecord.date,
+            idempotency_key: `${gameRecord.id}-${Math.random().toString(36).slice(2, 10)}`
+        });
+        Utils.Storage.set('pendingStats', pending.slice(-1000));
+        await this.flushPendingStats();
+    }
+    
+    // 批量提交待上报队列；服务端按幂等键去重，重试不会产生重复记录
+    async flushPendingStats() {
+        const pending = Utils.Storage.get('pendingStats', []);
+        if (pending.length === 0) return;
         try {
-            await Utils.API.post('/api/stats', {
-                wpm: gameRecord.wpm,
-                accuracy: gameRecord.accuracy,
-                time_taken: gameRecord.timeElapsed,
-                errors: gameRecord.errors,
-                mode: gameRecord.mode
-            });
-            console.log('📊 统计数据已同步');
+            const result = await Utils.API.post('/api/stats/batch', pending);
+            // 已写入、重复与校验失败的都不再重试
+            const done = new Set(result.data.results.map(r => pending[r.index].idempotency_key));
+            const remaining = Utils.Storage.get('pendingStats', []).filter(item => !done.has(item.idempotency_key));
+            Utils.Storage.set('pendingStats', remaining);
+            console.log(`📊 统计数据已同步 (${result.data.created} 条)`);
         } catch (error) {
             this.errorHandler.handleError(
                 this.errorHandler.createError('api', '同步统计数据失败', { error: error.message }), 
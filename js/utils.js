@@ -101,6 +101,18 @@ const Storage = {
     }
 };
 
+// 匿名玩家标识：首次使用时生成并保存在本地存储，随成绩上报，用于个人历史、最佳成绩与名次
+function getPlayerId() {
+    let playerId = Storage.get('playerId');
+    if (!playerId) {
+        playerId = window.crypto?.randomUUID
+            ? window.crypto.randomUUID()
+            : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
+        Storage.set('playerId', playerId);
+    }
+    return playerId;
+}
+
 // API请求工具
 const API = {
     async request(url, options = {}) {
@@ -314,6 +326,7 @@ window.Utils = {
     randomChoice,
     shuffleArray,
     Storage,
+    getPlayerId,
     API,
     EventEmitter,
     Animation,
@@ -30,6 +30,15 @@ class PerformanceMonitor {
         // 性能观察器
         this.observers = {};
         
+        // 遥测：按会话抽样，被抽中时把各指标样本攒批上报到 /api/telemetry
+        this.telemetry = {
+            enabled: false,
+            sampleRate: 0,
+            maxSamples: 600,
+            timer: null,
+            buffers: {}
+        };
+        
         this.init();
         console.log('📊 PerformanceMonitor 初始化完成');
     }
@@ -45,10 +54,61 @@ class PerformanceMonitor {
         document.addEventListener('visibilitychange', () => {
             if (document.hidden) {
                 this.pauseMonitoring();
+                this.flushTelemetry(true);
             } else {
                 this.resumeMonitoring();
             }
         });
+        
+        // 页面关闭前用 sendBeacon 送出最后一批
+        window.addEventListener('pagehide', () => this.flushTelemetry(true));
+    }
+    
+    /**
+     * 按后端下发的配置开启遥测（sampleRate 为会话抽样比例，flushInterval 为上报间隔毫秒）
+     */
+    configureTelemetry(config = {}) {
+        const sampleRate = Number(config.sampleRate) || 0;
+        if (this.telemetry.enabled || sampleRate <= 0 || Math.random() >= sampleRate) return;
+        
+        this.telemetry.enabled = true;
+        this.telemetry.sampleRate = Math.min(sampleRate, 1);
+        this.telemetry.timer = setInterval(() => this.flushTelemetry(), config.flushInterval || 30000);
+        this.startMonitoring();
+        console.log('📊 本会话已被抽中上报性能遥测');
+    }
+    
+    /**
+     * 记入遥测样本缓冲（未被抽中或缓冲已满时丢弃）
+     */
+    addTelemetrySample(metric, value) {
+        if (!this.telemetry.enabled || !Number.isFinite(value)) return;
+        const buffer = this.telemetry.buffers[metric] || (this.telemetry.buffers[metric] = []);
+        if (buffer.length < this.telemetry.maxSamples) {
+            buffer.push(Math.round(value * 10) / 10);
+        }
+    }
+    
+    /**
+     * 上报已攒的样本；beacon 为 true 时用 sendBeacon（页面隐藏或关闭时仍能送达）
+     */
+    flushTelemetry(beacon = false) {
+        const buffers = this.telemetry.buffers;
+        if (!this.telemetry.enabled || !Object.keys(buffers).length) return;
+        this.telemetry.buffers = {};
+        
+        const batch = {
+            mode: window.gameStore?.getState('game')?.mode || null,
+            sample_rate: this.telemetry.sampleRate,
+            cores: navigator.hardwareConcurrency || null,
+            memory: navigator.deviceMemory || null,
+            samples: buffers
+        };
+        if (beacon && navigator.sendBeacon) {
+            navigator.sendBeacon('/api/telemetry', new Blob([JSON.stringify(batch)], { type: 'application/json' }));
+        } else if (window.apiClient) {
+            window.apiClient.sendTelemetry(batch).catch(error => console.warn('性能遥测上报失败:', error));
+        }
     }
     
     /**
@@ -212,6 +272,7 @@ class PerformanceMonitor {
             if (elapsed > 0 && frameCount > 0) {
                 // 计算平均FPS
                 const fps = (frameCount / elapsed) * 1000;
+                this.addTelemetrySample('fps', fps);
                 
                 // 只在FPS明显变化或过低时记录，减少不必要的数据存储和警告
                 if (this.metrics.fps.length === 0 || 
@@ -365,6 +426,7 @@ class PerformanceMonitor {
             };
             
             this.metrics.memory.push(memoryInfo);
+            this.addTelemetrySample('memory', memory.usedJSHeapSize / 1024 / 1024);
             
             // 保持最近 60 个记录（1分钟）
             if (this.metrics.memory.length > 60) {
@@ -385,6 +447,7 @@ class PerformanceMonitor {
      * 记录渲染时间
      */
     recordRenderTime(renderTime) {
+        this.addTelemetrySample('renderTime', renderTime);
         this.metrics.renderTime.push({
             value: renderTime,
             timestamp: Date.now()
@@ -409,6 +472,7 @@ class PerformanceMonitor {
      */
     recordInputLatency(startTime) {
         const latency = performance.now() - startTime;
+        this.addTelemetrySample('inputLatency', latency);
         
         this.metrics.inputLatency.push({
             value: latency,
@@ -435,6 +499,7 @@ class PerformanceMonitor {
      * 记录 API 响应时间
      */
     recordAPIResponseTime(url, responseTime) {
+        this.addTelemetrySample('apiResponseTime', responseTime);
         this.metrics.apiResponseTime.push({
             url,
             value: responseTime,
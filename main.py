@@ -3,16 +3,47 @@
 TypeQuest · 打字大冒险 - FastAPI后端
 """
 
-from fastapi import FastAPI, HTTPException
-from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-from typing import Optional
-import json
+from fastapi import Body, Depends, FastAPI, Header, HTTPException, Path, Query, Request, Response, WebSocket
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import Annotated, Optional
+import asyncio
+import functools
+import ipaddress
+import logging
 import os
 import random
+import secrets
+import threading
 import tomllib
+from contextlib import asynccontextmanager
 from datetime import datetime
 
+from server.analytics import AGGREGATE_KINDS, AggregatesIndex, finite
+from server.assets import AssetServer
+from server.columnar import ColumnarIndex, parse_timestamp
+from server.compaction import Archive, Rollups, compact, retention_cutoff
+from server.async_io import BatchWriter, run_io
+from server.content_cache import ContentCache, dump_json, negotiate_encoding
+from server.heatmap import KEYS, HeatmapIndex
+from server.history import HistoryIndex, decode_cursor, encode_cursor
+from server.idempotency import IdempotencyIndex
+from server.leaderboard import LeaderboardIndex
+from server.players import PlayerIndex
+from server.live import LiveLeaderboard
+from server.metrics import MetricsMiddleware, MetricsRegistry
+from server.profiling import PROFILE_MODES, ProfilingMiddleware, RequestProfiler
+from server.racing import RaceEngine, all_engines, get_engine, shard_for
+from server.storage import StatsTable, open_stats_store
+from server.telemetry import METRICS, TelemetryIndex, classify_client, normalize_mode
+from server.timeline import MAX_INTERVAL_MS, TimelineIndex, append_timeline, decode_timeline, encode_timeline, get_timeline, read_timeline
+from server.waves import WaveSampler, generate_campaign, generate_wave, new_seed, wave_rng
+from server.word_index import WordIndex, WordQuery
+
+logger = logging.getLogger("typequest")
+
 # 版本号唯一来源：pyproject.toml，避免多处硬编码漂移
 def _read_version() -> str:
     try:
@@ -23,69 +54,508 @@ def _read_version() -> str:
 
 APP_VERSION = _read_version()
 
+# 统计存储后端：jsonl（默认）或 sqlite
+STATS_BACKEND = os.environ.get("TYPEQUEST_STATS_BACKEND", "jsonl")
+
+# 各统计表的排行字段与分组字段；columns 表示历史记录以列式索引保存在内存中，
+# retention 表示超出保留期的记录会被归档并汇总（见 STATS_RETENTION_DAYS），
+# players 为个人名次的分数精度与上限（精度内同分并列，更高的分数计入最高档）
+STATS_TABLES = {
+    "userdata/game_stats.json": {"rank_key": "wpm", "group_by": "mode", "aggregates": "game", "columns": "game",
+                                 "retention": True, "players": (0.01, 1000)},
+    "userdata/defense_stats.json": {"rank_key": "score", "group_by": "difficulty", "aggregates": "defense",
+                                    "columns": "defense", "retention": True, "players": (1, 1_000_000)},
+    # 按键时间线的索引（按键数据在同名 .bin 文件中）；按 WPM 排行即可取各模式最佳的幽灵
+    "userdata/timelines.json": {"rank_key": "wpm", "group_by": "mode", "timelines": True},
+    # 客户端性能遥测批次，只维护分维度直方图
+    "userdata/telemetry.json": {"telemetry": True},
+}
+LEADERBOARD_CAPACITY = 1000
+
+# 原始记录保留天数：设置后后台定期把更早的记录归档到 STATS_ARCHIVE_DIR 并汇总为逐日聚合（默认不归档）
+STATS_RETENTION_DAYS = float(os.environ["TYPEQUEST_STATS_RETENTION_DAYS"]) if os.environ.get("TYPEQUEST_STATS_RETENTION_DAYS") else None
+STATS_COMPACTION_INTERVAL = float(os.environ.get("TYPEQUEST_STATS_COMPACTION_INTERVAL", "3600"))
+STATS_ARCHIVE_DIR = "userdata/archive"
+
+# 历史查询单页上限与流式读取批大小
+STATS_PAGE_MAX = 1000
+STATS_STREAM_CHUNK = 500
+
+# 批量上报单次最多条数
+STATS_BATCH_MAX = 1000
+
+# 单条按键时间线最多按键数
+TIMELINE_MAX_KEYS = 20000
+
+# 客户端性能遥测：按会话抽样的比例（下发给浏览器）、上报间隔与单批每个指标的样本上限
+TELEMETRY_SAMPLE_RATE = float(os.environ.get("TYPEQUEST_TELEMETRY_SAMPLE_RATE", "0.1"))
+TELEMETRY_FLUSH_INTERVAL_MS = 30000
+TELEMETRY_MAX_SAMPLES = 600
+
+# 多人竞速分片：多个单 worker 实例各自承载一部分房间，按房间号固定分配
+# TYPEQUEST_RACE_SHARDS 为各实例的 WebSocket 地址（逗号分隔），TYPEQUEST_RACE_SHARD_INDEX 为本实例序号
+RACE_SHARDS = [url.strip().rstrip("/") for url in os.environ.get("TYPEQUEST_RACE_SHARDS", "").split(",") if url.strip()]
+RACE_SHARD_INDEX = int(os.environ["TYPEQUEST_RACE_SHARD_INDEX"]) if "TYPEQUEST_RACE_SHARD_INDEX" in os.environ else None
+
+# 本实例的 worker 数：run.sh prod 与 main.py --prod 启动时写入 TYPEQUEST_WORKERS，
+# 其他方式（如 gunicorn -w）启动多 worker 时需自行设置；也识别 uvicorn 的 WEB_CONCURRENCY。
+# 比赛房间只在进程内存中，多 worker 实例不承载比赛
+SERVER_WORKERS = int(os.environ.get("TYPEQUEST_WORKERS") or os.environ.get("WEB_CONCURRENCY") or "1")
+
+# 前端静态资源：存在 dist/（python -m server.assets build）时使用构建结果，否则从源码构建
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+asset_server = AssetServer(
+    root=PROJECT_ROOT,
+    dist=os.path.join(PROJECT_ROOT, "dist"),
+    bundle=os.environ.get("TYPEQUEST_ASSET_BUNDLE") == "1",
+    minify=os.environ.get("TYPEQUEST_ASSET_MINIFY") == "1"
+)
+
+# 管理接口令牌：设置后 /api/admin/* 需携带 X-Admin-Token 请求头
+ADMIN_TOKEN = os.environ.get("TYPEQUEST_ADMIN_TOKEN")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    compaction = asyncio.create_task(compaction_loop()) if STATS_RETENTION_DAYS else None
+    yield
+    if compaction is not None:
+        compaction.cancel()
+    # 退出前把各统计表的聚合检查点落盘
+    for table in list(_stats_tables.values()):
+        table.flush()
+
 # 创建 FastAPI 应用
 app = FastAPI(
     title="TypeQuest · 打字大冒险",
     description="一款现代化的Web键盘打字练习游戏",
-    version=APP_VERSION
+    version=APP_VERSION,
+    lifespan=lifespan
 )
 
+# 运行指标：/metrics 以 Prometheus 文本格式输出
+metrics = MetricsRegistry()
+app.add_middleware(MetricsMiddleware, registry=metrics)
+stats_saves = metrics.counter("typequest_stats_saves_total", "save_stats 调用次数", ("table", "result"))
+
+# 按需请求剖析：默认关闭，通过 /api/admin/profiling 开启
+profiler = RequestProfiler(app.routes, capacity=int(os.environ.get("TYPEQUEST_PROFILE_BUFFER", "32")))
+app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+@app.exception_handler(RequestValidationError)
+async def validation_error_handler(request: Request, exc: RequestValidationError):
+    """校验错误不回显输入：输入中可能有 NaN / Infinity，无法编码为 JSON"""
+    errors = [{key: value for key, value in error.items() if key != "input"} for error in exc.errors()]
+    return JSONResponse(status_code=422, content={"detail": jsonable_encoder(errors)})
+
 # 数据模型
+# 数值字段拒绝 NaN / Infinity（JSON 解析器接受它们，写入后会污染聚合与排行）；
+# 整数字段限定在列式索引的 int32 列可表示的范围内
+STAT_INT_MAX = 2**31 - 1
+
 class GameStats(BaseModel):
-    wpm: float
-    accuracy: float
-    time_taken: int
-    errors: int
+    wpm: float = Field(..., ge=0, allow_inf_nan=False)
+    accuracy: float = Field(..., ge=0, allow_inf_nan=False)
+    time_taken: int = Field(..., ge=0, le=STAT_INT_MAX)
+    errors: int = Field(..., ge=0, le=STAT_INT_MAX)
     mode: str
+    player_id: Optional[str] = Field(None, min_length=1, max_length=64)
     timestamp: Optional[str] = None
 
 class DefenseGameStats(BaseModel):
-    score: int
-    wave: int
-    total_waves: int
-    zombies_killed: int
-    plant_health: int
+    score: int = Field(..., ge=0, le=STAT_INT_MAX)
+    wave: int = Field(..., ge=0, le=STAT_INT_MAX)
+    total_waves: int = Field(..., ge=0, le=STAT_INT_MAX)
+    zombies_killed: int = Field(..., ge=0, le=STAT_INT_MAX)
+    plant_health: int = Field(..., ge=0, le=STAT_INT_MAX)
     difficulty: str
     victory: bool
-    play_time: float
+    play_time: float = Field(..., ge=0, allow_inf_nan=False)
+    player_id: Optional[str] = Field(None, min_length=1, max_length=64)
     timestamp: Optional[str] = None
 
-class DefenseWaveConfig(BaseModel):
+class GameStatsItem(GameStats):
+    """批量上报中的一条游戏统计（可带幂等键；离线队列可带原始时间戳）"""
+    idempotency_key: Optional[str] = Field(None, max_length=128)
+
+class DefenseGameStatsItem(DefenseGameStats):
+    """批量上报中的一条植物防御统计"""
+    idempotency_key: Optional[str] = Field(None, max_length=128)
+
+class KeystrokeTimeline(BaseModel):
+    """一局的按键时间线：texts 为依次出现的目标文本，keys 与 intervals 逐键对应（退格为 \\b）"""
+    mode: str = Field(..., max_length=32)
+    player_id: Optional[str] = Field(None, min_length=1, max_length=64)
+    texts: list[str] = Field(..., min_length=1, max_length=1000)
+    keys: str = Field(..., min_length=1, max_length=TIMELINE_MAX_KEYS)
+    intervals: list[Annotated[int, Field(ge=0, le=MAX_INTERVAL_MS)]] = Field(..., min_length=1, max_length=TIMELINE_MAX_KEYS)
+
+class TelemetryBatch(BaseModel):
+    """一批客户端性能样本：samples 为 指标 -> 样本列表，sample_rate 为该会话被抽中的比例"""
+    mode: Optional[str] = Field(None, max_length=32)
+    sample_rate: float = Field(..., gt=0, le=1)
+    cores: Optional[int] = Field(None, ge=1, le=1024)
+    memory: Optional[float] = Field(None, gt=0, le=1024)  # navigator.deviceMemory，GB
+    samples: dict[str, list[Annotated[float, Field(allow_inf_nan=False)]]] = Field(..., max_length=len(METRICS))
+
+class ProfilingRule(BaseModel):
+    """请求剖析规则：rate 为抽样比例，0 表示关闭该路由"""
+    route: str
+    rate: float = Field(0.1, ge=0, le=1)
+    mode: str = Field("sampling", pattern=f"^({'|'.join(PROFILE_MODES)})$")
+    interval_ms: float = Field(1.0, gt=0, le=1000)
+
+class WordConstraints(BaseModel):
+    """植物防御抽词约束（均为可选）"""
+    min_word_length: Optional[int] = None
+    max_word_length: Optional[int] = None
+    avoid_letters: Optional[str] = None
+    max_word_difficulty: Optional[float] = None  # 0~1，综合二元组稀有度与换手率
+
+    def word_query(self) -> WordQuery:
+        return WordQuery(
+            min_length=self.min_word_length,
+            max_length=self.max_word_length,
+            avoid_letters="".join(sorted(set((self.avoid_letters or "").lower()))),
+            max_difficulty=self.max_word_difficulty
+        )
+
+class DefenseWaveConfig(WordConstraints):
     """植物防御波次配置"""
     difficulty: str
     wave: int
+    seed: Optional[int] = None
+
+class DefenseCampaignConfig(WordConstraints):
+    """植物防御整场战役配置"""
+    difficulty: str
+    seed: Optional[int] = None
 
 # 工具函数
-def load_json_file(filename: str, default_data):
+content_cache = ContentCache()
+
+def _render_content(filename: str, default_data, transform, accept_encoding: Optional[str]):
+    """读取（或命中缓存）并序列化、按需压缩；在 I/O 线程池中执行"""
+    entry = content_cache.get(filename, default_data)
+    rendered = entry.render("response", lambda data: {
+        "status": "success",
+        "data": transform(data) if transform else data
+    })
+    encoding = negotiate_encoding(accept_encoding, len(rendered.body))
+    body = rendered.encoded(encoding) if encoding else rendered.body
+    return rendered, encoding, body
+
+async def content_response(request: Request, filename: str, default_data, transform=None) -> Response:
+    """
+    直接返回缓存中序列化好的 {"status": "success", "data": ...} 响应体。
+    支持 If-None-Match 条件请求（304）与预压缩的 gzip / brotli 响应。
+    """
+    rendered, encoding, body = await run_io(
+        _render_content, filename, default_data, transform, request.headers.get("accept-encoding")
+    )
+    headers = {
+        "ETag": rendered.etag(encoding),
+        "Cache-Control": "no-cache",  # 允许缓存，但每次使用前用 ETag 重新验证
+        "Vary": "Accept-Encoding"
+    }
+    if rendered.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def get_wave_sampler() -> WaveSampler:
+    """按 defense.json 编译的波次抽样表，配置变化时随缓存条目一起重建"""
+    entry = content_cache.get("data/config/defense.json", {})
+    return entry.derive("wave_sampler", WaveSampler.from_config)
+
+def get_word_index() -> WordIndex:
+    """按 defense_words.json 预计算的单词索引，词库变化时重建"""
+    entry = content_cache.get("data/content/defense_words.json", {})
+    return entry.derive("word_index", WordIndex)
+
+def get_wave_generators() -> tuple[WordIndex, WaveSampler]:
+    return get_word_index(), get_wave_sampler()
+
+def _is_loopback(host: Optional[str]) -> bool:
     try:
-        with open(filename, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return default_data
+        return host is not None and ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def require_admin(request: Request, x_admin_token: Optional[str] = Header(None)):
+    """配置了管理员令牌时校验令牌；未配置时只允许本机访问（经反向代理时按转发头中的客户端地址判断）"""
+    if ADMIN_TOKEN:
+        if x_admin_token is None or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+            raise HTTPException(status_code=403, detail="需要管理员令牌")
+    elif not _is_loopback(request.client.host if request.client else None):
+        raise HTTPException(status_code=403, detail="未配置 TYPEQUEST_ADMIN_TOKEN，管理接口仅允许本机访问")
+
+_stats_tables = {}
+_stats_tables_lock = threading.Lock()
+
+def _open_stats_table(filename: str) -> StatsTable:
+    spec = STATS_TABLES.get(filename, {})
+    indexes = {}
+    path = os.path.abspath(filename)
+    if spec.get("telemetry"):
+        # 遥测批次不分页查询也不去重，只需直方图
+        indexes["telemetry"] = TelemetryIndex(os.path.splitext(path)[0] + ".histograms.json")
+        return StatsTable(open_stats_store(path, STATS_BACKEND), indexes)
+    if spec.get("retention"):
+        # 排在最前：存储被压缩重写后先重新读取汇总，排行榜再以归档中的上榜记录为种子重建
+        name = _table_label(path)
+        indexes["rollups"] = Rollups(
+            os.path.join(os.path.abspath(STATS_ARCHIVE_DIR), f"{name}.rollups.json"),
+            Archive(os.path.abspath(STATS_ARCHIVE_DIR), name),
+            spec["aggregates"], spec["rank_key"], spec.get("group_by"), capacity=LEADERBOARD_CAPACITY
+        )
+    rollups = indexes.get("rollups")
+    if "rank_key" in spec:
+        indexes["leaderboard"] = LeaderboardIndex(
+            spec["rank_key"], spec.get("group_by"), capacity=LEADERBOARD_CAPACITY,
+            seed=rollups.leaders if rollups is not None else None
+        )
+        # 排在排行榜索引之后，收到新记录时榜单已更新
+        indexes["live"] = LiveLeaderboard(indexes["leaderboard"])
+    if "players" in spec:
+        resolution, ceiling = spec["players"]
+        indexes["players"] = PlayerIndex(
+            spec["rank_key"], spec.get("group_by"), resolution, ceiling,
+            seed=rollups.bests if rollups is not None else None
+        )
+    if spec.get("timelines"):
+        indexes["timelines"] = TimelineIndex()
+        base = os.path.splitext(path)[0]
+        indexes["heatmap"] = HeatmapIndex(base + ".bin", base + ".heatmap.bin")
+    if "columns" in spec:
+        indexes["history"] = ColumnarIndex(spec["columns"], spec.get("group_by"))
+    else:
+        indexes["history"] = HistoryIndex(spec.get("group_by"))
+    indexes["idempotency"] = IdempotencyIndex()
+    if "aggregates" in spec:
+        checkpoint = os.path.splitext(path)[0] + ".analytics.json"
+        indexes["aggregates"] = AggregatesIndex(spec["aggregates"], checkpoint)
+    store = open_stats_store(path, STATS_BACKEND)
+    return StatsTable(store, indexes)
+
+def get_stats_table(filename: str) -> StatsTable:
+    """按文件路径获取统计表（首次访问时打开存储、迁移旧数据并构建索引）"""
+    path = os.path.abspath(filename)
+    table = _stats_tables.get(path)
+    if table is None:
+        with _stats_tables_lock:
+            table = _stats_tables.get(path)
+            if table is None:
+                table = _stats_tables[path] = _open_stats_table(filename)
+    else:
+        # 多进程部署时追上其他 worker 的写入，保证排行榜/分析数据一致
+        table.sync()
+    return table
+
+_stats_writers = {}
 
-def save_stats(filename: str, stats):
+def get_stats_writer(table: StatsTable) -> BatchWriter:
+    writer = _stats_writers.get(table.store.path)
+    if writer is None:
+        writer = _stats_writers.setdefault(table.store.path, BatchWriter(table.store))
+    return writer
+
+async def save_stats(filename: str, stats):
+    """保存一条统计：经合并写入器落盘，不阻塞事件循环"""
+    label = _table_label(filename)
     try:
         stats.timestamp = datetime.now().isoformat()
-        
-        if os.path.exists(filename):
-            with open(filename, "r", encoding="utf-8") as f:
-                all_stats = json.load(f)
-        else:
-            all_stats = []
-        
-        all_stats.append(stats.dict())
-        
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(all_stats, f, ensure_ascii=False, indent=2)
-        
+        table = await run_io(get_stats_table, filename)
+        await get_stats_writer(table).submit(stats.dict(exclude_none=True))
+        stats_saves.inc((label, "success"))
         return True
     except Exception:
+        stats_saves.inc((label, "error"))
         return False
 
+def _table_label(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+def compact_stats(days: float) -> dict:
+    """把各统计表中早于保留期的记录归档、汇总并移出热存储，返回各表新写出的段"""
+    cutoff = retention_cutoff(days)
+    segments = {}
+    for filename, spec in STATS_TABLES.items():
+        if spec.get("retention"):
+            table = get_stats_table(filename)
+            rollups = table.indexes["rollups"]
+            segments[_table_label(filename)] = compact(table, rollups.archive, cutoff)
+    return {"cutoff": cutoff, "segments": segments}
+
+async def compaction_loop():
+    """后台定期压缩：在线程池中进行，不阻塞事件循环；出错时下一轮重试"""
+    while True:
+        try:
+            await run_io(compact_stats, STATS_RETENTION_DAYS)
+        except Exception:
+            logger.exception("统计数据压缩失败")
+        await asyncio.sleep(STATS_COMPACTION_INTERVAL)
+
+def collect_internal_metrics():
+    """抓取时读取内容缓存、统计存储与合并写入器的计数"""
+    cache = content_cache.stats()
+    yield "typequest_content_cache_hits_total", "counter", "内容缓存命中次数", {}, cache["hits"]
+    yield "typequest_content_cache_misses_total", "counter", "内容缓存未命中次数", {}, cache["misses"]
+    yield "typequest_json_loads_total", "counter", "从磁盘解析 JSON 内容文件的次数", {}, cache["loads"]
+    for table in list(_stats_tables.values()):
+        store = table.store
+        labels = {"table": _table_label(store.path)}
+        yield "typequest_stats_writes_total", "counter", "统计存储写入次数（一次写入可含多条）", labels, store.writes
+        yield "typequest_stats_records_written_total", "counter", "写入的统计记录数", labels, store.records_written
+        yield "typequest_stats_bytes_written_total", "counter", "写入统计存储的字节数", labels, store.bytes_written
+        yield "typequest_stats_file_size_bytes", "gauge", "统计存储文件大小", labels, store.size_bytes()
+        history = table.indexes.get("history")
+        if isinstance(history, ColumnarIndex):
+            yield "typequest_stats_index_bytes", "gauge", "列式统计索引占用的内存", labels, history.memory_bytes()
+        live = table.indexes.get("live")
+        if live is not None:
+            yield "typequest_live_subscribers", "gauge", "排行榜实时推送订阅数", labels, live.subscribers
+            yield "typequest_live_pushes_total", "counter", "排行榜变化推送次数（每次变化只序列化一次）", labels, live.pushes
+            yield "typequest_live_dropped_total", "counter", "因发送超时被断开的慢消费者数", labels, live.dropped
+    race = {"rooms": 0, "players": 0, "ticks": 0, "overruns": 0, "busy_seconds": 0.0}
+    for engine in all_engines():
+        for key, value in engine.stats().items():
+            race[key] += value
+    yield "typequest_race_rooms", "gauge", "进行中的比赛房间数", {}, race["rooms"]
+    yield "typequest_race_players", "gauge", "比赛房间内的玩家数", {}, race["players"]
+    yield "typequest_race_ticks_total", "counter", "比赛 tick 次数", {}, race["ticks"]
+    yield "typequest_race_tick_overruns_total", "counter", "处理超出 tick 间隔的次数", {}, race["overruns"]
+    yield "typequest_race_tick_busy_seconds_total", "counter", "tick 处理累计耗时", {}, race["busy_seconds"]
+    for path, writer in list(_stats_writers.items()):
+        labels = {"table": _table_label(path)}
+        yield "typequest_stats_batch_flushes_total", "counter", "合并写入器落盘次数", labels, writer.flushes
+
+metrics.add_collector(collect_internal_metrics)
+
+def ingest_stats(filename: str, model, items: list[dict]) -> dict:
+    """逐条校验后把合法记录在一次写入（一个事务）中落盘，返回逐条结果"""
+    now = datetime.now().isoformat()
+    results = [None] * len(items)
+    accepted = []
+    for i, item in enumerate(items):
+        try:
+            stats = model.model_validate(item)
+        except ValidationError as e:
+            results[i] = {"index": i, "status": "invalid",
+                          "errors": e.errors(include_url=False, include_context=False, include_input=False)}
+            continue
+        record = stats.dict()
+        for optional in ("idempotency_key", "player_id"):
+            if record[optional] is None:
+                del record[optional]
+        if record["timestamp"]:
+            # 客户端时间统一换算为服务器本地时间，与服务端生成的时间戳同格式、可排序
+            try:
+                record["timestamp"] = datetime.fromisoformat(record["timestamp"]).astimezone().replace(tzinfo=None).isoformat()
+            except ValueError:
+                results[i] = {"index": i, "status": "invalid",
+                              "errors": [{"loc": ["timestamp"], "msg": "时间戳格式无效", "type": "value_error"}]}
+                continue
+        else:
+            record["timestamp"] = now
+        accepted.append((i, record))
+
+    table = get_stats_table(filename)
+    written = {id(record) for record in table.append_many([record for _, record in accepted])}
+    for i, record in accepted:
+        results[i] = {"index": i, "status": "created" if id(record) in written else "duplicate"}
+
+    summary = {"created": 0, "duplicate": 0, "invalid": 0}
+    for result in results:
+        summary[result["status"]] += 1
+    return {**summary, "results": results}
+
+def validate_time_range(since: Optional[str], until: Optional[str]):
+    """since / until 须为 ISO 8601 日期或时间，否则抛出 ValueError"""
+    for value in (since, until):
+        if value:
+            try:
+                parse_timestamp(value)
+            except ValueError:
+                raise ValueError(f"无效的时间: {value}") from None
+
+def validate_leaderboard_page(limit: int, offset: int):
+    """排行榜只维护前 LEADERBOARD_CAPACITY 名，超出部分的分页抛出 ValueError（而不是静默返回空）"""
+    if offset + limit > LEADERBOARD_CAPACITY:
+        raise ValueError(f"offset + limit 不能超过 {LEADERBOARD_CAPACITY}")
+
+class StatsQuery:
+    """统计历史查询参数：游标分页、时间范围、分组与玩家筛选、字段投影"""
+
+    def __init__(
+        self,
+        limit: Optional[int] = Query(None, ge=1, le=STATS_PAGE_MAX),
+        player_id: Optional[str] = Query(None, min_length=1, max_length=64),
+        cursor: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        fields: Optional[str] = None,
+        order: str = Query("asc", pattern="^(asc|desc)$")
+    ):
+        self.limit = limit
+        self.player_id = player_id
+        self.since = since
+        self.until = until
+        self.descending = order == "desc"
+        self.fields = [f for f in (fields or "").split(",") if f] or None
+        try:
+            self.cursor = decode_cursor(cursor) if cursor else None
+            validate_time_range(since, until)
+            if self.cursor and self.cursor[0]:
+                parse_timestamp(self.cursor[0])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    def is_full_scan(self, group: Optional[str]) -> bool:
+        return (self.limit is None and self.cursor is None and not self.since and not self.until
+                and group is None and self.player_id is None and not self.descending)
+
+    def selector(self, table: StatsTable):
+        """指定玩家时走玩家索引，否则走历史索引；两者的 select 参数一致（玩家索引多一个玩家参数）"""
+        if self.player_id is None:
+            return table.indexes["history"].select
+        return functools.partial(table.indexes["players"].select, self.player_id)
+
+    def project(self, records: list[dict]) -> list[dict]:
+        if self.fields is None:
+            return records
+        return [{f: r[f] for f in self.fields if f in r} for r in records]
+
+def query_stats(table: StatsTable, query: StatsQuery, group: Optional[str]) -> dict:
+    """按历史索引取一页记录；不带任何参数时直接顺序读取全部（兼容旧接口）"""
+    if query.is_full_scan(group):
+        return {"data": query.project(table.store.load_all()), "next_cursor": None}
+    spans, next_key = query.selector(table)(
+        query.since, query.until, group, query.cursor, query.limit, query.descending
+    )
+    records = table.store.read_spans(spans)
+    return {
+        "data": query.project(records),
+        "next_cursor": encode_cursor(next_key) if next_key else None
+    }
+
+def stream_stats(table: StatsTable, query: StatsQuery, group: Optional[str]):
+    """逐批从存储读取并输出 NDJSON，内存占用只与批大小有关"""
+    select = query.selector(table)
+    cursor, remaining = query.cursor, query.limit
+    while remaining is None or remaining > 0:
+        batch = STATS_STREAM_CHUNK if remaining is None else min(remaining, STATS_STREAM_CHUNK)
+        spans, cursor = select(query.since, query.until, group, cursor, batch, query.descending)
+        for record in query.project(table.store.read_spans(spans)):
+            yield dump_json(record) + b"\n"
+        if remaining is not None:
+            remaining -= len(spans)
+        if cursor is None:
+            break
+
 # 注册路由
 @app.get("/api/config")
-async def get_general_config():
+async def get_general_config(request: Request):
     """获取通用配置"""
     default_config = {
         "defaultMode": "classic",
@@ -93,12 +563,16 @@ async def get_general_config():
         "enableKeyboardSound": True,
         "enableBackgroundMusic": True
     }
-    config = load_json_file("data/config/general.json", default_config)
-    config["version"] = APP_VERSION  # 版本号统一来自 pyproject.toml
-    return {"status": "success", "data": config}
+    # 版本号统一来自 pyproject.toml
+    return await content_response(
+        request, "data/config/general.json", default_config,
+        lambda config: {**config, "version": APP_VERSION, "telemetry": {
+            "sampleRate": TELEMETRY_SAMPLE_RATE, "flushInterval": TELEMETRY_FLUSH_INTERVAL_MS
+        }}
+    )
 
 @app.get("/api/texts")
-async def get_practice_texts():
+async def get_practice_texts(request: Request):
     """获取练习文本"""
     default_texts = [
         "The quick brown fox jumps over the lazy dog.",
@@ -106,21 +580,19 @@ async def get_practice_texts():
         "FastAPI makes building APIs fast and easy.",
         "Practice makes perfect in typing speed."
     ]
-    texts = load_json_file("data/content/texts.json", default_texts)
-    return {"status": "success", "data": texts}
+    return await content_response(request, "data/content/texts.json", default_texts)
 
 @app.get("/api/words")
-async def get_practice_words():
+async def get_practice_words(request: Request):
     """获取练习单词"""
     default_words = [
         "hello", "world", "python", "javascript", "typing", "speed",
         "keyboard", "practice", "game", "fast", "accurate", "skill"
     ]
-    words = load_json_file("data/content/words.json", default_words)
-    return {"status": "success", "data": words}
+    return await content_response(request, "data/content/words.json", default_words)
 
 @app.get("/api/defense/words")
-async def get_defense_words():
+async def get_defense_words(request: Request):
     """获取植物防御模式单词"""
     default_words = {
         "basic": ["cat", "dog", "run", "sun", "car", "hat", "bat", "rat"],
@@ -128,22 +600,20 @@ async def get_defense_words():
         "strong": ["computer", "keyboard", "beautiful", "wonderful"],
         "boss": ["extraordinary", "incomprehensible", "unbelievable"]
     }
-    words = load_json_file("data/content/defense_words.json", default_words)
-    return {"status": "success", "data": words}
+    return await content_response(request, "data/content/defense_words.json", default_words)
 
 @app.get("/api/defense/config")
-async def get_defense_config():
+async def get_defense_config(request: Request):
     """获取植物防御模式配置"""
     default_config = {
         "difficulty": {},
         "zombieTypes": {},
         "bossWordCombos": []
     }
-    config = load_json_file("data/config/defense.json", default_config)
-    return {"status": "success", "data": config}
+    return await content_response(request, "data/config/defense.json", default_config)
 
 @app.get("/api/racing/config")
-async def get_racing_config():
+async def get_racing_config(request: Request):
     """获取赛车模式配置"""
     default_config = {
         "trackLength": 100,
@@ -151,59 +621,109 @@ async def get_racing_config():
         "cars": {},
         "gameplay": {}
     }
-    config = load_json_file("data/config/racing.json", default_config)
-    return {"status": "success", "data": config}
+    return await content_response(request, "data/config/racing.json", default_config)
+
+def load_race_setup() -> tuple[dict, str]:
+    """多人竞速的引擎参数与随机抽取的比赛文本"""
+    config = content_cache.get("data/config/racing.json", {}).data.get("multiplayer", {})
+    texts = content_cache.get("data/content/texts.json", []).data or ["The quick brown fox jumps over the lazy dog."]
+    engine_config = {
+        "tick_rate": config.get("tickRate", 20),
+        "capacity": config.get("maxPlayers", 8),
+        "countdown": config.get("countdown", 3),
+        "time_limit": config.get("timeLimit", 120),
+    }
+    return engine_config, random.choice(texts)
+
+@app.get("/api/racing/rooms")
+async def list_race_rooms():
+    """列出本实例上的比赛房间"""
+    rooms = [room.summary() for engine in all_engines() for room in engine.rooms.values()]
+    return {"status": "success", "data": rooms}
+
+@app.get("/api/racing/rooms/{room_id}")
+async def locate_race_room(room_id: str = Path(..., min_length=1, max_length=64)):
+    """房间所在的分片及其 WebSocket 地址（未配置分片时就在本实例）"""
+    path = f"/api/racing/rooms/{room_id}/ws"
+    if not RACE_SHARDS and SERVER_WORKERS > 1:
+        raise HTTPException(status_code=503, detail="多 worker 部署需配置 TYPEQUEST_RACE_SHARDS（单 worker 的比赛实例）")
+    if not RACE_SHARDS:
+        return {"status": "success", "data": {"room": room_id, "shard": 0, "url": path}}
+    shard = shard_for(room_id, len(RACE_SHARDS))
+    return {"status": "success", "data": {"room": room_id, "shard": shard, "url": RACE_SHARDS[shard] + path}}
+
+@app.websocket("/api/racing/rooms/{room_id}/ws")
+async def race_room(
+    websocket: WebSocket,
+    room_id: str = Path(..., min_length=1, max_length=64),
+    name: str = Query("玩家", min_length=1, max_length=32)
+):
+    """加入比赛房间：上报进度，按 tick 接收全场位置差异"""
+    await websocket.accept()
+    if SERVER_WORKERS > 1:
+        # 同一房间的玩家可能落到不同 worker，各自在互不相通的房间里比赛
+        await websocket.close(code=1013, reason="多 worker 实例不承载比赛，请连接 TYPEQUEST_RACE_SHARDS 中的实例")
+        return
+    if RACE_SHARDS and RACE_SHARD_INDEX is not None and shard_for(room_id, len(RACE_SHARDS)) != RACE_SHARD_INDEX:
+        await websocket.close(code=1008, reason="房间不在本实例")
+        return
+    engine_config, text = await run_io(load_race_setup)
+    engine = get_engine(lambda: RaceEngine(**engine_config))
+    await engine.serve(websocket, room_id, name, text)
 
 @app.post("/api/defense/wave")
 async def generate_defense_wave(config: DefenseWaveConfig):
     """生成植物防御波次"""
     try:
-        all_words = load_json_file("data/content/defense_words.json", {})
-        
-        configs = {
-            "easy": {"waves": 4, "zombies": [3, 4, 5, 6], "types": {"basic": 0.7, "medium": 0.3}},
-            "medium": {"waves": 7, "zombies": [4, 5, 6, 7, 8, 9, 10], "types": {"basic": 0.5, "medium": 0.35, "strong": 0.15}},
-            "hard": {"waves": 10, "zombies": [5, 6, 8, 10, 12, 14, 16, 18, 20, 25], "types": {"basic": 0.3, "medium": 0.4, "strong": 0.25, "boss": 0.05}}
-        }
-        
-        difficulty_config = configs.get(config.difficulty, configs["easy"])
-        wave_index = min(config.wave - 1, len(difficulty_config["zombies"]) - 1)
-        zombie_count = difficulty_config["zombies"][wave_index]
-        
-        zombies = []
-        for i in range(zombie_count):
-            # 根据概率选择僵尸类型
-            rand = random.random()
-            cumulative = 0
-            zombie_type = "basic"
-            
-            for ztype, probability in difficulty_config["types"].items():
-                cumulative += probability
-                if rand <= cumulative:
-                    zombie_type = ztype
-                    break
-            
-            type_words = all_words.get(zombie_type, all_words.get("basic", ["test"]))
-            word = random.choice(type_words) if type_words else "test"
-            
-            zombies.append({"type": zombie_type, "word": word, "id": i + 1})
-        
+        words, sampler = await run_io(get_wave_generators)
+        rng = wave_rng(config.seed, config.difficulty, config.wave)
+        data = generate_wave(words, sampler, config.difficulty, config.wave, rng, config.word_query())
+        if config.seed is not None:
+            data["seed"] = config.seed
+        return {"status": "success", "data": data}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"生成波次失败: {str(e)}")
+
+@app.post("/api/defense/campaign")
+async def generate_defense_campaign(config: DefenseCampaignConfig):
+    """一次生成某难度的全部波次"""
+    try:
+        words, sampler = await run_io(get_wave_generators)
+        seed = config.seed if config.seed is not None else new_seed()
+        waves = await run_io(
+            lambda: list(generate_campaign(words, sampler, config.difficulty, seed, config.word_query()))
+        )
         return {
             "status": "success",
             "data": {
-                "wave": config.wave,
                 "difficulty": config.difficulty,
-                "zombie_count": zombie_count,
-                "zombies": zombies
+                "seed": seed,
+                "total_waves": len(waves),
+                "waves": waves
             }
         }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"生成波次失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"生成战役失败: {str(e)}")
+
+@app.post("/api/defense/campaign/stream")
+async def stream_defense_campaign(config: DefenseCampaignConfig):
+    """流式生成战役（NDJSON）：首行为战役信息，之后每行一波"""
+    words, sampler = await run_io(get_wave_generators)
+    query = config.word_query()
+    seed = config.seed if config.seed is not None else new_seed()
+
+    def lines():
+        header = {"difficulty": config.difficulty, "seed": seed, "total_waves": sampler.total_waves(config.difficulty)}
+        yield dump_json(header) + b"\n"
+        for wave in generate_campaign(words, sampler, config.difficulty, seed, query):
+            yield dump_json(wave) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 @app.post("/api/stats")
 async def save_game_stats(stats: GameStats):
     """保存游戏统计"""
-    success = save_stats("userdata/game_stats.json", stats)
+    success = await save_stats("userdata/game_stats.json", stats)
     if success:
         return {"status": "success", "message": "统计数据已保存"}
     else:
@@ -212,95 +732,304 @@ async def save_game_stats(stats: GameStats):
 @app.post("/api/defense/stats")
 async def save_defense_stats(stats: DefenseGameStats):
     """保存植物防御模式统计"""
-    success = save_stats("userdata/defense_stats.json", stats)
+    success = await save_stats("userdata/defense_stats.json", stats)
     if success:
         return {"status": "success", "message": "植物防御统计数据已保存"}
     else:
         raise HTTPException(status_code=500, detail="保存植物防御统计失败")
 
+@app.post("/api/stats/batch")
+async def save_game_stats_batch(items: list[dict] = Body(..., max_length=STATS_BATCH_MAX)):
+    """批量保存游戏统计：一次事务写入，按幂等键去重，返回逐条结果"""
+    try:
+        result = await run_io(ingest_stats, "userdata/game_stats.json", GameStatsItem, items)
+        return {"status": "success", "data": result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量保存统计数据失败: {str(e)}")
+
+@app.post("/api/defense/stats/batch")
+async def save_defense_stats_batch(items: list[dict] = Body(..., max_length=STATS_BATCH_MAX)):
+    """批量保存植物防御统计"""
+    try:
+        result = await run_io(ingest_stats, "userdata/defense_stats.json", DefenseGameStatsItem, items)
+        return {"status": "success", "data": result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量保存植物防御统计失败: {str(e)}")
+
 @app.get("/api/stats")
-async def get_game_stats():
-    """获取游戏统计"""
+async def get_game_stats(query: StatsQuery = Depends(), mode: Optional[str] = None):
+    """获取游戏统计（支持游标分页、时间范围、模式与玩家筛选、字段投影）"""
     try:
-        stats = load_json_file("userdata/game_stats.json", [])
-        return {"status": "success", "data": stats}
+        table = await run_io(get_stats_table, "userdata/game_stats.json")
+        page = await run_io(query_stats, table, query, mode)
+        return {"status": "success", **page}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取统计数据失败: {str(e)}")
 
+@app.get("/api/stats/stream")
+async def stream_game_stats(query: StatsQuery = Depends(), mode: Optional[str] = None):
+    """流式获取游戏统计（NDJSON，每行一条记录）"""
+    table = await run_io(get_stats_table, "userdata/game_stats.json")
+    return StreamingResponse(stream_stats(table, query, mode), media_type="application/x-ndjson")
+
 @app.get("/api/defense/stats")
-async def get_defense_stats():
+async def get_defense_stats(query: StatsQuery = Depends(), difficulty: Optional[str] = None):
     try:
-        stats = load_json_file("userdata/defense_stats.json", [])
-        return {"status": "success", "data": stats}
+        table = await run_io(get_stats_table, "userdata/defense_stats.json")
+        page = await run_io(query_stats, table, query, difficulty)
+        return {"status": "success", **page}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取植物防御统计失败: {str(e)}")
 
+@app.get("/api/defense/stats/stream")
+async def stream_defense_stats(query: StatsQuery = Depends(), difficulty: Optional[str] = None):
+    """流式获取植物防御统计（NDJSON，每行一条记录）"""
+    table = await run_io(get_stats_table, "userdata/defense_stats.json")
+    return StreamingResponse(stream_stats(table, query, difficulty), media_type="application/x-ndjson")
+
+def read_leaderboard(filename: str, limit: int, offset: int, group: Optional[str],
+                     since: Optional[str], until: Optional[str]) -> list[dict]:
+    """
+    不限时间时读取增量维护的前 N 名（含已归档的上榜记录）；
+    限定时间范围时在列式索引上排序后按位置读取，再与范围内的归档上榜记录合并
+    """
+    table = get_stats_table(filename)
+    if not since and not until:
+        return table.indexes["leaderboard"].top(limit, offset, group=group)
+    rank_key = STATS_TABLES[filename]["rank_key"]
+    rollups = table.indexes.get("rollups")
+    if rollups is None or not rollups.segments:
+        spans = table.indexes["history"].top(rank_key, limit, offset, group, since, until)
+        return table.store.read_spans(spans)
+    spans = table.indexes["history"].top(rank_key, offset + limit, 0, group, since, until)
+    # 归档记录都早于热数据，同分时排在前面；sorted 是稳定的
+    merged = sorted(rollups.ranked_leaders(group, since, until) + table.store.read_spans(spans),
+                    key=lambda record: -finite(record.get(rank_key)))
+    return merged[offset:offset + limit]
+
 @app.get("/api/leaderboard")
-async def get_leaderboard():
-    """获取排行榜"""
+async def get_leaderboard(
+    limit: int = Query(10, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    mode: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None
+):
+    """获取排行榜（可按模式、时间范围筛选，如当日榜）"""
+    try:
+        validate_time_range(since, until)
+        validate_leaderboard_page(limit, offset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
-        all_stats = load_json_file("userdata/game_stats.json", [])
-        leaderboard = sorted(all_stats, key=lambda x: x['wpm'], reverse=True)[:10]
+        leaderboard = await run_io(read_leaderboard, "userdata/game_stats.json", limit, offset, mode, since, until)
         return {"status": "success", "data": leaderboard}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取排行榜失败: {str(e)}")
 
 @app.get("/api/defense/leaderboard")
-async def get_defense_leaderboard():
-    """获取植物防御排行榜"""
+async def get_defense_leaderboard(
+    limit: int = Query(10, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    difficulty: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None
+):
+    """获取植物防御排行榜（可按难度、时间范围筛选）"""
     try:
-        all_stats = load_json_file("userdata/defense_stats.json", [])
-        leaderboard = sorted(all_stats, key=lambda x: x['score'], reverse=True)[:10]
+        validate_time_range(since, until)
+        validate_leaderboard_page(limit, offset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        leaderboard = await run_io(read_leaderboard, "userdata/defense_stats.json", limit, offset,
+                                   difficulty, since, until)
         return {"status": "success", "data": leaderboard}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取植物防御排行榜失败: {str(e)}")
 
+def read_player_profile(player_id: str) -> dict:
+    return {
+        "game": get_stats_table("userdata/game_stats.json").indexes["players"].profile(player_id),
+        "defense": get_stats_table("userdata/defense_stats.json").indexes["players"].profile(player_id)
+    }
+
+@app.get("/api/players/{player_id}")
+async def get_player_profile(player_id: str = Path(..., min_length=1, max_length=64)):
+    """
+    玩家的个人最佳与名次：game / defense 各含全局与各模式（难度）分组的
+    最佳记录、名次（1 起，同分并列）与该榜玩家数；个人历史见 /api/stats?player_id=
+    """
+    profile = await run_io(read_player_profile, player_id)
+    if profile["game"] is None and profile["defense"] is None:
+        raise HTTPException(status_code=404, detail="该玩家暂无成绩")
+    return {"status": "success", "data": {"player_id": player_id, **profile}}
+
+async def serve_live_leaderboard(websocket: WebSocket, filename: str, group: Optional[str], limit: int):
+    table = await run_io(get_stats_table, filename)
+    await websocket.accept()
+    await table.indexes["live"].serve(websocket, group, limit, lambda: run_io(table.sync))
+
+@app.websocket("/api/leaderboard/live")
+async def live_leaderboard(
+    websocket: WebSocket,
+    limit: int = Query(10, ge=1, le=100),
+    mode: Optional[str] = None
+):
+    """实时排行榜：先推送快照，之后仅在榜单变化时推送差异"""
+    await serve_live_leaderboard(websocket, "userdata/game_stats.json", mode, limit)
+
+@app.websocket("/api/defense/leaderboard/live")
+async def live_defense_leaderboard(
+    websocket: WebSocket,
+    limit: int = Query(10, ge=1, le=100),
+    difficulty: Optional[str] = None
+):
+    """实时植物防御排行榜"""
+    await serve_live_leaderboard(websocket, "userdata/defense_stats.json", difficulty, limit)
+
+def record_timeline(timeline: KeystrokeTimeline) -> dict:
+    blob = encode_timeline(timeline.texts, timeline.keys, timeline.intervals)
+    summary = decode_timeline(blob, timeline.texts).summary()
+    record = {"id": secrets.token_hex(8), "mode": timeline.mode, "texts": timeline.texts, **summary,
+              "timestamp": datetime.now().isoformat()}
+    if timeline.player_id:
+        record["player_id"] = timeline.player_id
+    table = get_stats_table("userdata/timelines.json")
+    return append_timeline(table, record, blob)
+
+def load_timeline(timeline_id: str) -> tuple[dict, bytes]:
+    table = get_stats_table("userdata/timelines.json")
+    record = get_timeline(table, timeline_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="时间线不存在")
+    return record, read_timeline(table, record)
+
+def _timeline_info(record: dict) -> dict:
+    return {k: v for k, v in record.items() if k not in ("offset", "length")}
+
+@app.post("/api/timelines")
+async def save_timeline(timeline: KeystrokeTimeline):
+    """保存一局的按键时间线（服务器按时间线重新计算 WPM / 准确率）"""
+    try:
+        record = await run_io(record_timeline, timeline)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "success", "data": {**_timeline_info(record), "bytes": record["length"]}}
+
+@app.get("/api/timelines/best")
+async def get_best_timeline(mode: Optional[str] = None):
+    """最佳成绩的时间线（可按模式），作为幽灵对手"""
+    table = await run_io(get_stats_table, "userdata/timelines.json")
+    best = table.indexes["leaderboard"].top(1, group=mode)
+    if not best:
+        raise HTTPException(status_code=404, detail="暂无时间线")
+    return {"status": "success", "data": _timeline_info(best[0])}
+
+@app.get("/api/timelines/{timeline_id}")
+async def get_timeline_detail(timeline_id: str, format: str = Query("json", pattern="^(json|binary)$")):
+    """获取时间线：json 为列式解码结果，binary 为原始编码（需配合 texts 解码）"""
+    record, blob = await run_io(load_timeline, timeline_id)
+    if format == "binary":
+        return Response(content=blob, media_type="application/octet-stream",
+                        headers={"Cache-Control": "public, max-age=31536000, immutable"})
+    keystrokes = await run_io(decode_timeline, blob, record["texts"])
+    return {"status": "success", "data": {
+        **_timeline_info(record),
+        "keys": keystrokes.keys,
+        "intervals": keystrokes.intervals.tolist(),
+        "correct": list(keystrokes.correct),
+    }}
+
+@app.get("/api/timelines/{timeline_id}/replay")
+async def replay_timeline(
+    timeline_id: str,
+    speed: float = Query(1.0, gt=0, le=10),
+    paced: bool = True
+):
+    """
+    幽灵回放（NDJSON）：首行为时间线信息，之后每行一次按键 [距开局毫秒, 按键, 是否按对]。
+    paced=true 时按原节奏（除以 speed）推送，客户端收到即可移动幽灵。
+    """
+    record, blob = await run_io(load_timeline, timeline_id)
+    keystrokes = await run_io(decode_timeline, blob, record["texts"])
+
+    async def lines():
+        yield dump_json(_timeline_info(record)) + b"\n"
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        batch = []
+        for elapsed, key, correct in keystrokes.events():
+            due = started + elapsed / 1000 / speed
+            if paced and due > loop.time():
+                if batch:
+                    yield b"".join(batch)
+                    batch = []
+                await asyncio.sleep(due - loop.time())
+            batch.append(dump_json([elapsed, key, int(correct)]) + b"\n")
+        if batch:
+            yield b"".join(batch)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+def combine_aggregates(filename: str, since: Optional[str], until: Optional[str]):
+    """热数据聚合 + 归档汇总（归档部分按整天计入时间范围）"""
+    table = get_stats_table(filename)
+    rollups = table.indexes["rollups"]
+    result = AGGREGATE_KINDS[STATS_TABLES[filename]["aggregates"]]()
+    if since or until:
+        result.merge(table.indexes["history"].aggregate(since=since, until=until))
+        result.merge(rollups.aggregate(since, until))
+    else:
+        result.merge(table.indexes["aggregates"].aggregates)
+        result.merge(rollups.totals())
+    return result
+
+def summarize_games(since: Optional[str], until: Optional[str], percentiles: bool) -> tuple[dict, dict]:
+    """
+    传统模式与植物防御的汇总：不限时间时读取运行聚合（O(1)），
+    限定时间范围时在列式索引上向量化计算；两者都再合并已归档部分的逐日汇总
+    """
+    traditional = combine_aggregates("userdata/game_stats.json", since, until)
+    defense = combine_aggregates("userdata/defense_stats.json", since, until)
+    game = {"count": traditional.count}
+    if traditional.count:
+        game.update(traditional.summary(), mode_counts=dict(traditional.mode_counts))
+        if percentiles:
+            game["percentiles"] = traditional.percentiles()
+    return game, {"count": defense.count, **(defense.summary() if defense.count else {})}
+
 @app.get("/api/analytics")
-async def get_game_analytics():
-    """获取游戏分析数据"""
+async def get_game_analytics(percentiles: bool = False, since: Optional[str] = None, until: Optional[str] = None):
+    """获取游戏分析数据（percentiles=true 时附带 WPM 分位数；可用 since / until 限定时间范围）"""
     try:
-        traditional_stats = load_json_file("userdata/game_stats.json", [])
-        defense_stats = load_json_file("userdata/defense_stats.json", [])
+        validate_time_range(since, until)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        traditional, defense = await run_io(summarize_games, since, until, percentiles)
         
         analytics = {
-            "total_games": len(traditional_stats) + len(defense_stats),
-            "traditional_games": len(traditional_stats),
-            "defense_games": len(defense_stats),
+            "total_games": traditional["count"] + defense["count"],
+            "traditional_games": traditional["count"],
+            "defense_games": defense["count"],
             "mode_distribution": {},
             "average_performance": {}
         }
         
         # 传统模式分析
-        if traditional_stats:
-            mode_counts = {}
-            total_wpm = 0
-            total_accuracy = 0
-            
-            for stat in traditional_stats:
-                mode = stat.get('mode', 'unknown')
-                mode_counts[mode] = mode_counts.get(mode, 0) + 1
-                total_wpm += stat.get('wpm', 0)
-                total_accuracy += stat.get('accuracy', 0)
-            
-            analytics["mode_distribution"] = mode_counts
+        if traditional["count"]:
+            analytics["mode_distribution"] = traditional["mode_counts"]
             analytics["average_performance"]["traditional"] = {
-                "avg_wpm": total_wpm / len(traditional_stats),
-                "avg_accuracy": total_accuracy / len(traditional_stats)
+                "avg_wpm": traditional["avg_wpm"], "avg_accuracy": traditional["avg_accuracy"]
             }
+            if percentiles:
+                analytics["percentiles"] = {"wpm": traditional["percentiles"]}
         
         # 植物防御模式分析
-        if defense_stats:
-            total_score = 0
-            victory_count = 0
-            
-            for stat in defense_stats:
-                total_score += stat.get('score', 0)
-                if stat.get('victory', False):
-                    victory_count += 1
-            
+        if defense["count"]:
             analytics["average_performance"]["defense"] = {
-                "avg_score": total_score / len(defense_stats),
-                "victory_rate": (victory_count / len(defense_stats)) * 100
+                "avg_score": defense["avg_score"], "victory_rate": defense["victory_rate"]
             }
         
         return {"status": "success", "data": analytics}
@@ -308,9 +1037,191 @@ async def get_game_analytics():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取分析数据失败: {str(e)}")
 
-# 挂载静态文件
-app.mount("/", StaticFiles(directory=".", html=True), name="static")
+@app.get("/api/analytics/heatmap")
+async def get_key_heatmap(
+    player_id: Optional[str] = Query(None, max_length=64),
+    kind: str = Query("keys", pattern="^(keys|bigrams)$")
+):
+    """
+    按键热力图：kind=keys 为每个键的次数、错误率与平均延迟，
+    kind=bigrams 为 上一个键 × 当前键 的同名矩阵；指定 player_id 时只统计该玩家
+    """
+    table = await run_io(get_stats_table, "userdata/timelines.json")
+    heatmap = table.indexes["heatmap"].get(player_id)
+    if heatmap is None:
+        raise HTTPException(status_code=404, detail="该玩家暂无按键数据")
+    data = heatmap.keys() if kind == "keys" else heatmap.bigrams()
+    return {"status": "success", "data": {
+        "player_id": player_id,
+        "timelines": heatmap.timelines,
+        "keys": [*KEYS, "other"],
+        **data
+    }}
+
+def telemetry_weight(sample_rate: float) -> int:
+    """
+    每个样本代表的会话数。sample_rate 由客户端上报，不能低于服务器下发的抽样比例，
+    否则一批极小比例的样本就能以巨大权重压垮分布
+    """
+    floor = TELEMETRY_SAMPLE_RATE if TELEMETRY_SAMPLE_RATE > 0 else 1
+    return max(1, round(1 / max(sample_rate, floor)))
+
+@app.post("/api/telemetry")
+async def save_telemetry(batch: TelemetryBatch, user_agent: str = Header("")):
+    """接收一批客户端性能样本（按会话抽样，攒批上报；也接受 sendBeacon）"""
+    samples = {metric: values[:TELEMETRY_MAX_SAMPLES] for metric, values in batch.samples.items()
+               if metric in METRICS and values}
+    if samples:
+        record = {
+            "timestamp": datetime.now().isoformat(),
+            "mode": normalize_mode(batch.mode),
+            "client": classify_client(user_agent, batch.cores, batch.memory),
+            "weight": telemetry_weight(batch.sample_rate),
+            "samples": samples
+        }
+        table = await run_io(get_stats_table, "userdata/telemetry.json")
+        await get_stats_writer(table).submit(record)
+    return {"status": "success", "data": {"sample_rate": TELEMETRY_SAMPLE_RATE}}
+
+@app.get("/api/analytics/performance")
+async def get_performance_analytics(
+    metric_names: str = Query("fps,inputLatency", alias="metrics"),
+    mode: Optional[str] = None,
+    client: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    by: Optional[str] = Query(None, pattern="^(mode|client)$")
+):
+    """
+    客户端性能分位数（p5 / p50 / p95，按抽样权重估算）：可按模式、设备类别（如 mobile-chrome-low）
+    与日期范围（按整天）筛选，by=mode / client 时另按该维度分组
+    """
+    names = [name for name in metric_names.split(",") if name]
+    unknown = [name for name in names if name not in METRICS]
+    if unknown or not names:
+        raise HTTPException(status_code=400, detail=f"未知的性能指标: {','.join(unknown)}")
+    try:
+        validate_time_range(since, until)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    table = await run_io(get_stats_table, "userdata/telemetry.json")
+    data = table.indexes["telemetry"].query(
+        names, since[:10] if since else None, until[:10] if until else None, mode, client, by
+    )
+    return {"status": "success", "data": data}
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus 指标"""
+    body = await run_io(metrics.render)
+    return Response(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/admin/content", dependencies=[Depends(require_admin)])
+async def get_content_cache_stats():
+    """获取内容缓存命中统计"""
+    return {"status": "success", "data": content_cache.stats()}
+
+@app.post("/api/admin/content/reload", dependencies=[Depends(require_admin)])
+async def reload_content(path: Optional[str] = None):
+    """丢弃内容缓存（指定 path 或全部），下次访问时重新加载"""
+    dropped = content_cache.invalidate(path)
+    if path is None:
+        asset_server.reload()
+    return {"status": "success", "data": {"dropped": dropped}}
+
+def describe_archive() -> dict:
+    tables = {}
+    for filename, spec in STATS_TABLES.items():
+        if spec.get("retention"):
+            rollups = get_stats_table(filename).indexes["rollups"]
+            tables[_table_label(filename)] = {
+                "segments": rollups.archive.segments(),
+                "archived_records": len(rollups),
+                "days": len(rollups.days)
+            }
+    return {"retention_days": STATS_RETENTION_DAYS, "tables": tables}
+
+@app.get("/api/admin/archive", dependencies=[Depends(require_admin)])
+async def get_archive():
+    """查看各统计表的归档段与汇总规模"""
+    return {"status": "success", "data": await run_io(describe_archive)}
+
+@app.post("/api/admin/compaction", dependencies=[Depends(require_admin)])
+async def run_compaction(days: Optional[float] = Query(None, ge=1)):
+    """立即压缩一次：归档早于 days 天（默认取 TYPEQUEST_STATS_RETENTION_DAYS）的记录"""
+    days = days or STATS_RETENTION_DAYS
+    if not days:
+        raise HTTPException(status_code=400, detail="未配置保留天数，请指定 days")
+    return {"status": "success", "data": await run_io(compact_stats, days)}
+
+@app.get("/api/admin/profiling", dependencies=[Depends(require_admin)])
+async def get_profiling():
+    """查看剖析规则与最近的剖析结果"""
+    return {"status": "success", "data": profiler.state()}
+
+@app.post("/api/admin/profiling", dependencies=[Depends(require_admin)])
+async def configure_profiling(rule: ProfilingRule):
+    """为路由（路由模板，如 /api/analytics）开启、调整或关闭剖析"""
+    profiler.configure(rule.route, rule.rate, rule.mode, rule.interval_ms)
+    return {"status": "success", "data": profiler.state()}
+
+@app.delete("/api/admin/profiling", dependencies=[Depends(require_admin)])
+async def disable_profiling():
+    """关闭全部剖析（已保存的结果保留）"""
+    profiler.disable()
+    return {"status": "success", "data": profiler.state()}
+
+@app.get("/api/admin/profiling/{profile_id}", dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: int, format: str = Query("collapsed", pattern="^(pstats|collapsed|text)$")):
+    """下载剖析结果：cprofile 为 pstats / text，sampling 为 collapsed"""
+    record = profiler.get(profile_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="剖析结果不存在或已被覆盖")
+    try:
+        body = await run_io(record.export, format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    media_type = "application/octet-stream" if format == "pstats" else "text/plain; charset=utf-8"
+    filename = f"profile-{profile_id}.{'prof' if format == 'pstats' else 'txt'}"
+    return Response(body, media_type=media_type,
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+# 前端静态资源（只公开白名单内的文件，须放在所有接口路由之后）
+@app.api_route("/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def serve_asset(request: Request, path: str):
+    asset = await run_io(asset_server.lookup, path)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    rendered = asset.rendered
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"), len(rendered.body)) if asset.compressible else None
+    if encoding not in rendered.encodings:
+        encoding = None
+    headers = {
+        "ETag": rendered.etag(encoding),
+        "Cache-Control": asset.cache_control,
+        "Vary": "Accept-Encoding"
+    }
+    if rendered.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    body = rendered.encoded(encoding) if encoding else rendered.body
+    return Response(content=body, media_type=asset.content_type, headers=headers)
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
+
+    parser = argparse.ArgumentParser(description="TypeQuest 服务器")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--prod", action="store_true", help="生产模式：多 worker，关闭自动重载")
+    parser.add_argument("--workers", type=int, default=None, help="生产模式 worker 数，默认等于 CPU 核数")
+    args = parser.parse_args()
+
+    if args.prod:
+        workers = args.workers or os.cpu_count() or 1
+        os.environ["TYPEQUEST_WORKERS"] = str(workers)  # worker 进程据此判断是否承载比赛
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=workers, proxy_headers=True)
+    else:
+        uvicorn.run("main:app", host=args.host, port=args.port, reload=True)
@@ -21,8 +21,17 @@ echo "📦 安装依赖..."
 uv sync
 
 # 启动服务器
-echo "🎮 启动游戏服务器..."
-uv run uvicorn main:app --host 0.0.0.0 --port 8000 --reload
+if [ "$1" == "prod" ]; then
+    # 生产模式：多 worker，关闭自动重载
+    WORKERS=${WORKERS:-$(nproc 2>/dev/null || echo 1)}
+    echo "📦 构建静态资源..."
+    uv run python -m server.assets build --bundle --minify
+    echo "🎮 启动游戏服务器（生产模式，${WORKERS} 个 worker）..."
+    TYPEQUEST_WORKERS="$WORKERS" uv run uvicorn main:app --host 0.0.0.0 --port 8000 --workers "$WORKERS"
+else
+    echo "🎮 启动游戏服务器..."
+    uv run uvicorn main:app --host 0.0.0.0 --port 8000 --reload
+fi
 
 echo "✅ 服务器已启动！"
 echo "🌐 游戏地址: http://localhost:8000"
@@ -0,0 +1,3 @@
+"""
+TypeQuest · 打字大冒险 - 后端服务组件
+"""
@@ -0,0 +1,224 @@
+"""
+统计分析聚合
+
+以运行计数器维护 /api/analytics 所需的各项指标，每次写入增量更新，
+并定期把计数器连同已覆盖的存储位置写入检查点文件，
+重启后只需回放检查点之后的新记录。查询成本与历史规模无关。
+"""
+
+import json
+import math
+import os
+import threading
+from typing import Optional
+
+
+def finite(value, default: float = 0):
+    """数值字段取值：缺失、非数值或非有限值（NaN / Infinity，旧数据中可能存在）按 default 计"""
+    if isinstance(value, (int, float)) and math.isfinite(value):
+        return value
+    return default
+
+
+class FixedHistogram:
+    """固定分桶直方图：可合并，分位数误差不超过一个桶宽"""
+
+    def __init__(self, low: float, high: float, bucket_width: float):
+        self.low = low
+        self.high = high
+        self.bucket_width = bucket_width
+        self.counts = [0] * (int(round((high - low) / bucket_width)) + 1)  # 末桶收纳溢出值
+        self.total = 0
+
+    def add(self, value: float, count: int = 1):
+        if not math.isfinite(value):
+            return
+        i = int((value - self.low) // self.bucket_width)
+        self.counts[min(max(i, 0), len(self.counts) - 1)] += count
+        self.total += count
+
+    def merge(self, other: "FixedHistogram"):
+        if (other.low, other.high, other.bucket_width) != (self.low, self.high, self.bucket_width):
+            raise ValueError("直方图分桶不一致，无法合并")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+
+    def quantile(self, q: float) -> Optional[float]:
+        """返回近似分位数（桶内线性插值）"""
+        if self.total == 0:
+            return None
+        target = q * self.total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= target:
+                start = self.low + i * self.bucket_width
+                return start + self.bucket_width * (target - seen) / count
+            seen += count
+        return self.high
+
+    def to_dict(self) -> dict:
+        return {"low": self.low, "high": self.high, "bucket_width": self.bucket_width, "counts": self.counts}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "FixedHistogram":
+        hist = cls(data["low"], data["high"], data["bucket_width"])
+        if len(data["counts"]) == len(hist.counts):
+            hist.counts = list(data["counts"])
+            hist.total = sum(hist.counts)
+        return hist
+
+
+class GameAggregates:
+    """传统模式：模式分布、平均 WPM / 准确率、WPM 分布"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_wpm = 0.0
+        self.total_accuracy = 0.0
+        self.mode_counts = {}
+        self.wpm_histogram = FixedHistogram(0, 300, 0.5)
+
+    def add(self, record: dict):
+        self.count += 1
+        mode = record.get("mode", "unknown")
+        self.mode_counts[mode] = self.mode_counts.get(mode, 0) + 1
+        wpm = finite(record.get("wpm"))
+        self.total_wpm += wpm
+        self.total_accuracy += finite(record.get("accuracy"))
+        self.wpm_histogram.add(wpm)
+
+    def merge(self, other: "GameAggregates"):
+        self.count += other.count
+        self.total_wpm += other.total_wpm
+        self.total_accuracy += other.total_accuracy
+        for mode, count in other.mode_counts.items():
+            self.mode_counts[mode] = self.mode_counts.get(mode, 0) + count
+        self.wpm_histogram.merge(other.wpm_histogram)
+
+    def summary(self) -> dict:
+        return {
+            "avg_wpm": self.total_wpm / self.count,
+            "avg_accuracy": self.total_accuracy / self.count
+        }
+
+    def percentiles(self) -> dict:
+        return {
+            f"p{int(q * 100)}": self.wpm_histogram.quantile(q)
+            for q in (0.5, 0.9, 0.99)
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total_wpm": self.total_wpm,
+            "total_accuracy": self.total_accuracy,
+            "mode_counts": self.mode_counts,
+            "wpm_histogram": self.wpm_histogram.to_dict()
+        }
+
+    def load_dict(self, data: dict):
+        self.count = data["count"]
+        self.total_wpm = data["total_wpm"]
+        self.total_accuracy = data["total_accuracy"]
+        self.mode_counts = dict(data["mode_counts"])
+        self.wpm_histogram = FixedHistogram.from_dict(data["wpm_histogram"])
+
+
+class DefenseAggregates:
+    """植物防御模式：平均得分、胜率"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_score = 0
+        self.victory_count = 0
+
+    def add(self, record: dict):
+        self.count += 1
+        self.total_score += finite(record.get("score"))
+        if record.get("victory", False):
+            self.victory_count += 1
+
+    def merge(self, other: "DefenseAggregates"):
+        self.count += other.count
+        self.total_score += other.total_score
+        self.victory_count += other.victory_count
+
+    def summary(self) -> dict:
+        return {
+            "avg_score": self.total_score / self.count,
+            "victory_rate": (self.victory_count / self.count) * 100
+        }
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "total_score": self.total_score, "victory_count": self.victory_count}
+
+    def load_dict(self, data: dict):
+        self.count = data["count"]
+        self.total_score = data["total_score"]
+        self.victory_count = data["victory_count"]
+
+
+AGGREGATE_KINDS = {
+    "game": GameAggregates,
+    "defense": DefenseAggregates,
+}
+
+
+class AggregatesIndex:
+    """挂在统计表上的运行聚合，带检查点"""
+
+    def __init__(self, kind: str, checkpoint_path: Optional[str] = None, checkpoint_every: int = 100):
+        self.kind = kind
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.aggregates = AGGREGATE_KINDS[kind]()
+        self.position = 0
+        self.generation = None  # 检查点对应的存储代号（存储被压缩重写后作废）
+        self._dirty = 0
+        self._lock = threading.Lock()
+        self._load_checkpoint()
+
+    def _load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("kind") == self.kind:
+                self.aggregates.load_dict(data["aggregates"])
+                self.position = data["position"]
+                self.generation = data.get("generation")
+        except (ValueError, KeyError, TypeError):
+            self.reset()  # 检查点损坏时从头回放
+
+    def reset(self):
+        self.aggregates = AGGREGATE_KINDS[self.kind]()
+        self.position = 0
+
+    def add_many(self, records: list[dict], positions: list[int]):
+        if not records:
+            return
+        with self._lock:
+            for record in records:
+                self.aggregates.add(record)
+            self.position = positions[-1]
+            self._dirty += len(records)
+            due = self._dirty >= self.checkpoint_every
+        if due:
+            self.flush()
+
+    def flush(self):
+        """把计数器与已覆盖位置原子写入检查点文件"""
+        if not self.checkpoint_path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {"kind": self.kind, "position": self.position, "generation": self.generation,
+                    "aggregates": self.aggregates.to_dict()}
+            payload = json.dumps(data, ensure_ascii=False)
+            self._dirty = 0
+        tmp_path = f"{self.checkpoint_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp_path, self.checkpoint_path)
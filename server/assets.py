@@ -0,0 +1,486 @@
+"""
+静态资源构建与服务
+
+只公开白名单内的前端文件（index.html、favicon、css/、js/、assets/），
+不再把整个项目根目录（main.py、uv.lock、userdata/ 等）暴露出去。
+
+构建步骤：
+- 按内容哈希给每个文件生成带指纹的文件名（js/utils.3f9a1c2b4d5e.js），
+  并改写 index.html 中的引用；带指纹的 URL 内容永不变化，可使用 immutable 长缓存
+- 可选：把 index.html 引用的本地 js / css 按顺序合并为一个文件，并做保守压缩
+- 预先生成 gzip / brotli 压缩变体
+
+运行时所有资源都在内存中。存在 dist/manifest.json（由 python -m server.assets build 生成）
+且与源码一致时直接加载构建结果；否则启动后首次请求时从源码目录构建。
+页面请求（index.html 等非指纹路径）会检查源码 mtime，源码变化后自动重建。
+"""
+
+import argparse
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import threading
+import time
+from typing import Optional
+
+from .content_cache import MIN_COMPRESS_SIZE, RenderedBody, brotli
+
+# 允许公开的文件与目录（相对项目根目录）
+PUBLIC_FILES = ("index.html", "favicon.ico", "favicon.png")
+PUBLIC_DIRS = ("css", "js", "assets")
+_PUBLIC_PREFIXES = tuple(f"{directory}/" for directory in PUBLIC_DIRS)
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+MANIFEST_NAME = "manifest.json"
+
+COMPRESSIBLE_TYPES = ("application/javascript", "application/json", "image/svg+xml",
+                      "image/x-icon", "image/vnd.microsoft.icon")
+
+_REF_PATTERN = re.compile(r'(src|href)="([^"#?]+)"')
+_SCRIPT_TAG = re.compile(r'[ \t]*<script src="([^"]+)"></script>\n?')
+_STYLESHEET_TAG = re.compile(r'[ \t]*<link rel="stylesheet" href="([^"]+)">\n?')
+
+# 其后出现的 / 视为正则字面量的起始（否则为除号）
+_REGEX_PRECEDERS = set("(,=:[!&|?{};+-*%<>~^")
+
+
+def content_type(path: str) -> str:
+    if path.endswith(".js"):
+        return "application/javascript"
+    guessed, _ = mimetypes.guess_type(path)
+    return guessed or "application/octet-stream"
+
+
+def is_compressible(media_type: str) -> bool:
+    return media_type.startswith("text/") or media_type in COMPRESSIBLE_TYPES
+
+
+def fingerprint(path: str, body: bytes) -> str:
+    """js/utils.js -> js/utils.<内容哈希>.js"""
+    base, ext = os.path.splitext(path)
+    return f"{base}.{hashlib.sha256(body).hexdigest()[:12]}{ext}"
+
+
+def _normalize_ref(ref: str) -> Optional[str]:
+    """页面中的本地引用转换为相对根目录的路径；外部链接返回 None"""
+    if "://" in ref or ref.startswith(("//", "data:", "mailto:")):
+        return None
+    return ref.lstrip("./").lstrip("/") or None
+
+
+def _scan_quoted(source: str, i: int, quote: str) -> int:
+    j = i + 1
+    while j < len(source):
+        c = source[j]
+        if c == "\\":
+            j += 2
+            continue
+        if c == quote:
+            return j + 1
+        if c == "\n":
+            break
+        j += 1
+    raise ValueError("未闭合的字符串")
+
+
+def _scan_regex(source: str, i: int) -> int:
+    j, in_class = i + 1, False
+    while j < len(source):
+        c = source[j]
+        if c == "\\":
+            j += 2
+            continue
+        if c == "\n":
+            break
+        if c == "[":
+            in_class = True
+        elif c == "]":
+            in_class = False
+        elif c == "/" and not in_class:
+            j += 1
+            while j < len(source) and source[j].isalpha():
+                j += 1
+            return j
+        j += 1
+    raise ValueError("未闭合的正则字面量")
+
+
+def minify_js(source: str) -> str:
+    """
+    保守压缩：去掉注释、行首缩进与空行，保留换行（不依赖自动分号插入的改写），
+    字符串、模板字符串与正则字面量原样保留。无法确定结构时返回原文。
+    """
+    out = []
+    templates = []  # 每层 ${ } 内尚未闭合的 { 数量
+    in_template = False
+    line_start = True
+    last = ""
+    i, n = 0, len(source)
+    try:
+        while i < n:
+            c = source[i]
+            if in_template:
+                if c == "\\":
+                    out.append(source[i:i + 2])
+                    i += 2
+                elif c == "`":
+                    out.append(c)
+                    in_template, last = False, "`"
+                    i += 1
+                elif source.startswith("${", i):
+                    out.append("${")
+                    templates.append(0)
+                    in_template, last = False, "{"
+                    i += 2
+                else:
+                    out.append(c)
+                    i += 1
+                continue
+
+            if c == "\n":
+                if out and out[-1] != "\n":
+                    out.append("\n")
+                line_start = True
+                i += 1
+            elif c in " \t\r":
+                if not line_start and out and out[-1] != " ":
+                    out.append(" ")
+                i += 1
+            elif source.startswith("//", i):
+                end = source.find("\n", i)
+                i = n if end < 0 else end
+            elif source.startswith("/*", i):
+                end = source.find("*/", i + 2)
+                if end < 0:
+                    raise ValueError("未闭合的注释")
+                if "\n" in source[i:end]:
+                    if out and out[-1] != "\n":
+                        out.append("\n")
+                    line_start = True
+                elif not line_start and out and out[-1] != " ":
+                    out.append(" ")
+                i = end + 2
+            else:
+                line_start = False
+                if c in "'\"":
+                    end = _scan_quoted(source, i, c)
+                elif c == "`":
+                    end, in_template = i + 1, True
+                elif c == "/" and (not last or last in _REGEX_PRECEDERS):
+                    end = _scan_regex(source, i)
+                else:
+                    end = i + 1
+                    if templates and c == "{":
+                        templates[-1] += 1
+                    elif templates and c == "}":
+                        if templates[-1] == 0:
+                            templates.pop()
+                            in_template = True
+                        else:
+                            templates[-1] -= 1
+                out.append(source[i:end])
+                last = c
+                i = end
+    except ValueError:
+        return source
+    if in_template or templates:
+        return source
+    return "".join(out).strip() + "\n"
+
+
+def minify_css(source: str) -> str:
+    """去掉注释与多余空白；字符串原样保留"""
+    out = []
+    i, n = 0, len(source)
+    try:
+        while i < n:
+            c = source[i]
+            if source.startswith("/*", i):
+                end = source.find("*/", i + 2)
+                i = n if end < 0 else end + 2
+            elif c in "'\"":
+                end = _scan_quoted(source, i, c)
+                out.append(source[i:end])
+                i = end
+            elif c.isspace():
+                if out and out[-1] != " ":
+                    out.append(" ")
+                i += 1
+            else:
+                if c in "{};,":
+                    if out and out[-1] == " ":
+                        out.pop()
+                    if c == "}" and out and out[-1] == ";":
+                        out.pop()
+                    out.append(c)
+                    i += 1
+                    while i < n and source[i].isspace():
+                        i += 1
+                    continue
+                out.append(c)
+                i += 1
+    except ValueError:
+        return source
+    return "".join(out).strip() + "\n"
+
+
+class Asset:
+    __slots__ = ("path", "content_type", "rendered", "immutable")
+
+    def __init__(self, path: str, media_type: str, rendered: RenderedBody, immutable: bool):
+        self.path = path
+        self.content_type = media_type
+        self.rendered = rendered
+        self.immutable = immutable
+
+    @property
+    def cache_control(self) -> str:
+        return IMMUTABLE_CACHE if self.immutable else REVALIDATE_CACHE
+
+    @property
+    def compressible(self) -> bool:
+        return is_compressible(self.content_type) and len(self.rendered.body) >= MIN_COMPRESS_SIZE
+
+    def precompress(self):
+        if self.compressible:
+            for encoding in ("gzip", "br") if brotli is not None else ("gzip",):
+                self.rendered.encoded(encoding)
+
+
+class AssetBundle:
+    """一次构建得到的全部资源：URL 路径（不含开头的 /）-> Asset"""
+
+    def __init__(self, assets: dict, root: str, sources: dict):
+        self.assets = assets
+        self.root = root
+        self.sources = sources  # 构建时各源文件 / 目录的 mtime，用于判断是否过期
+
+    def get(self, path: str) -> Optional[Asset]:
+        return self.assets.get(path or "index.html")
+
+    def is_stale(self) -> bool:
+        return _snapshot_sources(list(self.sources)) != self.sources
+
+    @classmethod
+    def build(cls, root: str, bundle: bool = False, minify: bool = False) -> "AssetBundle":
+        root = os.path.abspath(root)
+        files = {}
+        for rel in _public_files(root):
+            with open(os.path.join(root, rel), "rb") as f:
+                body = f.read()
+            if minify and rel.endswith(".js"):
+                body = minify_js(body.decode("utf-8")).encode("utf-8")
+            elif minify and rel.endswith(".css"):
+                body = minify_css(body.decode("utf-8")).encode("utf-8")
+            files[rel] = body
+
+        html = files.pop("index.html", b"").decode("utf-8")
+        if bundle:
+            html = _bundle_tags(html, _SCRIPT_TAG, files, "js/bundle.js", "\n;\n")
+            html = _bundle_tags(html, _STYLESHEET_TAG, files, "css/bundle.css", "\n")
+
+        assets = {}
+        hashed = {}
+        for rel, body in files.items():
+            media_type = content_type(rel)
+            rendered = RenderedBody(body)
+            hashed[rel] = fingerprint(rel, body)
+            assets[hashed[rel]] = Asset(hashed[rel], media_type, rendered, immutable=True)
+            if not rel.endswith(("/bundle.js", "/bundle.css")):
+                # 原始路径仍可访问（供脚本中动态引用），但需要每次验证
+                assets[rel] = Asset(rel, media_type, rendered, immutable=False)
+
+        def rewrite(match):
+            ref = _normalize_ref(match.group(2))
+            if ref in hashed:
+                return f'{match.group(1)}="/{hashed[ref]}"'
+            return match.group(0)
+
+        index = Asset("index.html", "text/html; charset=utf-8",
+                      RenderedBody(_REF_PATTERN.sub(rewrite, html).encode("utf-8")), immutable=False)
+        assets["index.html"] = index
+        for asset in assets.values():
+            asset.precompress()
+        return cls(assets, root, _snapshot_sources(_source_paths(root)))
+
+    def write(self, out_dir: str) -> dict:
+        """写出构建结果（含压缩变体）与清单，返回清单"""
+        manifest = {}
+        sources = {os.path.relpath(path, self.root).replace(os.sep, "/"): mtime
+                   for path, mtime in self.sources.items()}
+        written = set()
+        for path, asset in self.assets.items():
+            file = asset.path if asset.immutable or path == "index.html" else None
+            if file is None:
+                # 未带指纹的别名指向同内容的带指纹文件
+                file = next(a.path for a in self.assets.values()
+                            if a.immutable and a.rendered is asset.rendered)
+            encodings = asset.rendered.encodings
+            manifest[path] = {"file": file, "content_type": asset.content_type,
+                              "immutable": asset.immutable, "encodings": encodings}
+            if file in written:
+                continue
+            written.add(file)
+            target = os.path.join(out_dir, file)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as f:
+                f.write(asset.rendered.body)
+            for encoding in encodings:
+                with open(target + _ENCODING_SUFFIX[encoding], "wb") as f:
+                    f.write(asset.rendered.encoded(encoding))
+        with open(os.path.join(out_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+            json.dump({"sources": sources, "assets": manifest}, f, ensure_ascii=False, indent=2)
+        return manifest
+
+    @classmethod
+    def load(cls, out_dir: str, root: str) -> "AssetBundle":
+        with open(os.path.join(out_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        root = os.path.abspath(root)
+        sources = {os.path.normpath(os.path.join(root, rel)): mtime for rel, mtime in manifest["sources"].items()}
+        rendered_by_file = {}
+        assets = {}
+        for path, entry in manifest["assets"].items():
+            rendered = rendered_by_file.get(entry["file"])
+            if rendered is None:
+                target = os.path.join(out_dir, entry["file"])
+                with open(target, "rb") as f:
+                    rendered = RenderedBody(f.read())
+                for encoding in entry["encodings"]:
+                    if encoding == "br" and brotli is None:
+                        continue
+                    with open(target + _ENCODING_SUFFIX[encoding], "rb") as f:
+                        rendered.set_encoded(encoding, f.read())
+                rendered_by_file[entry["file"]] = rendered
+            assets[path] = Asset(entry["file"], entry["content_type"], rendered, entry["immutable"])
+        return cls(assets, root, sources)
+
+
+_ENCODING_SUFFIX = {"gzip": ".gz", "br": ".br"}
+
+
+def _public_files(root: str) -> list[str]:
+    files = [name for name in PUBLIC_FILES if os.path.isfile(os.path.join(root, name))]
+    for directory in PUBLIC_DIRS:
+        for dirpath, dirnames, filenames in os.walk(os.path.join(root, directory)):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+            for name in sorted(filenames):
+                if not name.startswith("."):
+                    files.append(os.path.relpath(os.path.join(dirpath, name), root).replace(os.sep, "/"))
+    return files
+
+
+def _source_paths(root: str) -> list[str]:
+    paths = [os.path.join(root, rel) for rel in _public_files(root)]
+    for directory in PUBLIC_DIRS:
+        for dirpath, dirnames, _ in os.walk(os.path.join(root, directory)):
+            paths.append(dirpath)
+    return paths
+
+
+def _snapshot_sources(paths: list[str]) -> dict:
+    snapshot = {}
+    for path in paths:
+        try:
+            snapshot[path] = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            snapshot[path] = None
+    return snapshot
+
+
+def _bundle_tags(html: str, tag: re.Pattern, files: dict, bundle_path: str, separator: str) -> str:
+    """把页面引用的本地文件按顺序合并：第一个标签替换为合并文件，其余删除"""
+    refs = [_normalize_ref(m.group(1)) for m in tag.finditer(html)]
+    refs = [ref for ref in refs if ref in files]
+    if len(refs) < 2:
+        return html
+    files[bundle_path] = separator.join(files[ref].decode("utf-8").rstrip() for ref in refs).encode("utf-8") + b"\n"
+    first = [True]
+
+    def replace(match):
+        if _normalize_ref(match.group(1)) not in refs:
+            return match.group(0)
+        if first[0]:
+            first[0] = False
+            return match.group(0).replace(match.group(1), bundle_path)
+        return ""
+
+    return tag.sub(replace, html)
+
+
+class AssetServer:
+    """
+    按需构建 / 加载资源包；页面请求会检查源码是否变化。
+    检查要 stat 整个 public 目录树，每 check_interval 秒最多一次（兜底路由上的 404 也走这里）
+    """
+
+    def __init__(self, root: str = ".", dist: str = "dist", bundle: bool = False, minify: bool = False,
+                 check_interval: float = 1.0):
+        self.root = root
+        self.dist = dist
+        self.bundle = bundle
+        self.minify = minify
+        self.check_interval = check_interval
+        self._current = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _due(self) -> bool:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+        return True
+
+    def _load(self) -> AssetBundle:
+        dist = os.path.abspath(self.dist)
+        if os.path.exists(os.path.join(dist, MANIFEST_NAME)):
+            bundle = AssetBundle.load(dist, self.root)
+            if not bundle.is_stale():
+                return bundle
+            # 构建产物落后于源码（如开发时改了 js），改为从源码构建
+        return AssetBundle.build(self.root, self.bundle, self.minify)
+
+    def lookup(self, path: str) -> Optional[Asset]:
+        current = self._current
+        if current is None or (not path.startswith(_PUBLIC_PREFIXES) and self._due() and current.is_stale()):
+            with self._lock:
+                if self._current is None or self._current is current:
+                    self._current = self._load()
+                    self._checked_at = time.monotonic()
+                current = self._current
+        return current.get(path)
+
+    def reload(self):
+        with self._lock:
+            self._current = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="构建带指纹、预压缩的静态资源")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build")
+    build.add_argument("--root", default=".", help="项目根目录")
+    build.add_argument("--out", default="dist", help="输出目录")
+    build.add_argument("--bundle", action="store_true", help="合并 index.html 引用的 js / css")
+    build.add_argument("--minify", action="store_true", help="压缩 js / css")
+    args = parser.parse_args()
+
+    bundle = AssetBundle.build(args.root, bundle=args.bundle, minify=args.minify)
+    if os.path.isdir(args.out):
+        for dirpath, _, filenames in os.walk(args.out, topdown=False):
+            for name in filenames:
+                os.remove(os.path.join(dirpath, name))
+    manifest = bundle.write(args.out)
+    total = sum(len(a.rendered.body) for p, a in bundle.assets.items() if a.immutable or p == "index.html")
+    gzipped = sum(len(a.rendered.encoded("gzip") if "gzip" in a.rendered.encodings else a.rendered.body)
+                  for p, a in bundle.assets.items() if a.immutable or p == "index.html")
+    print(f"✅ 已构建 {len(manifest)} 个资源到 {args.out}（原始 {total / 1024:.1f} KB，gzip 后 {gzipped / 1024:.1f} KB）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+异步 I/O 辅助
+
+FastAPI 处理函数都运行在事件循环上，文件读写必须移出循环，
+否则一次慢写会拖住所有并发请求（包括静态文件）。这里提供：
+- run_io: 在有界线程池中执行阻塞调用
+- BatchWriter: 把几毫秒内到达的插入合并成一次 append_many 落盘
+"""
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .profiling import current_session
+
+# 有界 I/O 线程池，避免突发请求创建过多线程
+IO_WORKERS = int(os.environ.get("TYPEQUEST_IO_WORKERS", "8"))
+_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="typequest-io")
+
+
+async def run_io(func, *args, **kwargs):
+    """在 I/O 线程池中执行阻塞函数"""
+    loop = asyncio.get_running_loop()
+    session = current_session()
+    if session is not None:  # 当前请求正在被剖析
+        func = session.wrap(func)
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+class BatchWriter:
+    """
+    合并写入：第一条记录到达后等待 window 秒，
+    期间到达的所有记录一起写入（每批最多 max_batch 条）。
+    每个提交者都会等到自己的记录真正落盘后才返回。
+    """
+
+    def __init__(self, store, window: float = 0.005, max_batch: int = 500):
+        self.store = store
+        self.window = window
+        self.max_batch = max_batch
+        self.flushes = 0
+        self.records = 0
+        self._pending = []
+        self._flusher = None
+
+    async def submit(self, record: dict) -> dict:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((record, future))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = loop.create_task(self._flush_soon())
+        return await future
+
+    async def _flush_soon(self):
+        await asyncio.sleep(self.window)
+        while self._pending:
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            try:
+                await run_io(self.store.append_many, [record for record, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.flushes += 1
+            self.records += len(batch)
+            for record, future in batch:
+                if not future.done():
+                    future.set_result(record)
@@ -0,0 +1,339 @@
+"""
+列式统计索引
+
+游戏统计与植物防御统计的每条记录只以定长类型数组的形式留在内存中：
+- 数值字段为 float64（wpm、accuracy、play_time，与 JSON 中的值完全一致）/ int32（score、time_taken 等）列
+- mode、difficulty 等分组字段按字典编码为小整数（0 表示缺失），victory 为 0/1 字节
+- 时间戳解析为 int64 微秒，记录在存储中的末尾位置为 int64（起始位置即上一条的末尾位置）
+
+一条游戏记录约 50 字节，而 dict 加上历史索引的 (时间戳字符串, 位置) 元组约 800 字节。
+
+同时兼任历史索引（与 HistoryIndex 的 select 接口一致）：按 (时间戳, 末尾位置) 有序的行号数组，
+全局一份、每个分组一份，时间范围与游标二分定位。
+按时间范围、分组的聚合（结果与运行聚合同型，可直接合并）与排序
+在安装了 NumPy 时直接在列上向量化执行，否则逐行计算。
+"""
+
+import bisect
+import threading
+from array import array
+from datetime import datetime, timedelta
+from typing import Optional
+
+from .analytics import DefenseAggregates, GameAggregates, finite
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 为可选依赖
+    np = None
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+MISSING_TIMESTAMP = -(1 << 63)  # 没有时间戳的记录排在最前
+# 一批新记录超过该条数且时间戳乱序时，整体重排顺序数组
+REBUILD_MIN_BATCH = 1000
+
+# 各表的列：字段 -> 类型码；"dict" 为字典编码的字符串列
+SCHEMAS = {
+    "game": {"wpm": "d", "accuracy": "d", "time_taken": "i", "errors": "i", "mode": "dict"},
+    "defense": {"score": "i", "wave": "i", "total_waves": "i", "zombies_killed": "i", "plant_health": "i",
+                "difficulty": "dict", "victory": "B", "play_time": "d"},
+}
+
+
+def parse_timestamp(value) -> int:
+    """ISO 8601 时间戳 -> 本地时间的 int64 微秒；格式无效时抛出 ValueError"""
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone().replace(tzinfo=None)
+    return (dt - _EPOCH) // _MICROSECOND
+
+
+def format_timestamp(value: int) -> str:
+    return "" if value == MISSING_TIMESTAMP else (_EPOCH + value * _MICROSECOND).isoformat()
+
+
+def _record_timestamp(record: dict) -> int:
+    try:
+        return parse_timestamp(record.get("timestamp"))
+    except (TypeError, ValueError):
+        return MISSING_TIMESTAMP
+
+
+class Dictionary:
+    """字符串列的字典编码：编码 0 保留给缺失值，超过 65535 个取值时自动改用 32 位编码"""
+
+    def __init__(self):
+        self.values = [None]
+        self.codes = {}
+        self.column = array("H")
+
+    def encode(self, value) -> int:
+        if value is None:
+            return 0
+        value = str(value)
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+            if code > 0xFFFF and self.column.typecode == "H":
+                self.column = array("I", self.column)
+        return code
+
+    def code(self, value: str) -> Optional[int]:
+        return self.codes.get(value)
+
+
+# 整数列的取值范围：超出的值（如接口加上界之前写入的记录）截断到边界，
+# 否则 array 会抛出 OverflowError，一次写入或回放就让各列长度不一致
+_INT_RANGES = {code: (-(1 << (8 * array(code).itemsize - 1)), (1 << (8 * array(code).itemsize - 1)) - 1)
+               for code in "bhilq"}
+_INT_RANGES.update({code: (0, (1 << (8 * array(code).itemsize)) - 1) for code in "BHILQ"})
+
+
+def _number(value, typecode: str):
+    value = finite(value)
+    if typecode == "d":
+        return float(value)
+    low, high = _INT_RANGES[typecode]
+    return min(max(int(value), low), high)
+
+
+class ColumnarIndex:
+    """一张统计表的全部记录（列式）及其时间顺序"""
+
+    def __init__(self, schema: str, partition_by: Optional[str] = None):
+        self.schema = schema
+        self.partition_by = partition_by
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.columns = {}
+            for name, typecode in SCHEMAS[self.schema].items():
+                self.columns[name] = Dictionary() if typecode == "dict" else array(typecode)
+            self.timestamps = array("q")
+            self.ends = array("q")
+            self._first_start = None
+            self._order = array("I")  # 按 (时间戳, 末尾位置) 升序的行号
+            self._groups = {}         # 分组编码 -> 该分组的有序行号
+            self._last_end = 0
+
+    def add_many(self, records: list[dict], positions: list[int]):
+        with self._lock:
+            if self._first_start is None and records:
+                self._first_start = self._last_end
+            first_row = len(self.ends)
+            timestamps, ends = self.timestamps, self.ends
+            for name, column in self.columns.items():
+                if isinstance(column, Dictionary):
+                    codes = [column.encode(record.get(name)) for record in records]
+                    column.column.extend(codes)  # 编码过程中可能换成 32 位列，取完编码再写入
+                else:
+                    typecode = column.typecode
+                    column.extend(_number(record.get(name, 0), typecode) for record in records)
+            timestamps.extend(_record_timestamp(record) for record in records)
+            ends.extend(positions)
+            if positions:
+                self._last_end = positions[-1]
+            rows = range(first_row, len(ends))
+            if len(rows) > REBUILD_MIN_BATCH and not self._in_order(rows):
+                # 大批乱序（如启动回放客户端补传的记录）：整体重排一次，而不是逐条插入
+                self._rebuild_order()
+                return
+            groups = self.columns[self.partition_by].column if self.partition_by else None
+            for row in rows:
+                self._insert(self._order, row)
+                if groups is not None and groups[row]:
+                    series = self._groups.get(groups[row])
+                    if series is None:
+                        series = self._groups[groups[row]] = array("I")
+                    self._insert(series, row)
+
+    def _in_order(self, rows: range) -> bool:
+        previous = self._key(self._order[-1]) if self._order else None
+        for row in rows:
+            key = self._key(row)
+            if previous is not None and key < previous:
+                return False
+            previous = key
+        return True
+
+    def _rebuild_order(self):
+        rows = len(self.ends)
+        if np is not None:
+            order = np.lexsort((np.frombuffer(self.ends, dtype=np.int64),
+                                np.frombuffer(self.timestamps, dtype=np.int64))).astype(np.uint32)
+            self._order = array("I", order.tobytes())
+        else:
+            self._order = array("I", sorted(range(rows), key=self._key))
+        self._groups = {}
+        if self.partition_by:
+            codes = self.columns[self.partition_by].column
+            if np is not None:
+                ordered = np.frombuffer(codes, dtype=codes.typecode)[order]
+                for code in np.flatnonzero(np.bincount(ordered)):
+                    if code:
+                        self._groups[int(code)] = array("I", order[ordered == code].tobytes())
+            else:
+                for row in self._order:
+                    if codes[row]:
+                        self._groups.setdefault(codes[row], array("I")).append(row)
+
+    def _key(self, row: int) -> tuple[int, int]:
+        return self.timestamps[row], self.ends[row]
+
+    def _insert(self, series: array, row: int):
+        # 新记录的时间戳通常最大，插入点在末尾，均摊 O(1)
+        if not series or self._key(row) > self._key(series[-1]):
+            series.append(row)
+        else:
+            series.insert(bisect.bisect_right(series, self._key(row), key=self._key), row)
+
+    def __len__(self) -> int:
+        return len(self.ends)
+
+    def _start(self, row: int) -> int:
+        return self.ends[row - 1] if row else self._first_start
+
+    def _series(self, group: Optional[str]) -> Optional[array]:
+        if group is None:
+            return self._order
+        code = self.columns[self.partition_by].code(group) if self.partition_by else None
+        return self._groups.get(code) if code else None
+
+    def _range(self, series: array, since: Optional[str], until: Optional[str]) -> tuple[int, int]:
+        key = self.timestamps.__getitem__
+        lo = bisect.bisect_left(series, parse_timestamp(since), key=key) if since else 0
+        hi = bisect.bisect_left(series, parse_timestamp(until), key=key) if until else len(series)
+        return lo, hi
+
+    def select(self, since: Optional[str] = None, until: Optional[str] = None,
+               group: Optional[str] = None, cursor: Optional[tuple[str, int]] = None,
+               limit: Optional[int] = None, descending: bool = False
+               ) -> tuple[list[tuple[int, int]], Optional[tuple[str, int]]]:
+        """与 HistoryIndex.select 相同：返回 ([(起始位置, 末尾位置)], 下一页游标)"""
+        with self._lock:
+            series = self._series(group)
+            if series is None:
+                return [], None
+            lo, hi = self._range(series, since, until)
+            if cursor is not None:
+                timestamp, position = cursor
+                key = (parse_timestamp(timestamp) if timestamp else MISSING_TIMESTAMP, position)
+                if descending:
+                    hi = min(hi, bisect.bisect_left(series, key, key=self._key))
+                else:
+                    lo = max(lo, bisect.bisect_right(series, key, key=self._key))
+            if hi <= lo:
+                return [], None
+            if descending:
+                first = hi - limit if limit is not None else lo
+                rows = [series[i] for i in range(hi - 1, max(lo, first) - 1, -1)]
+                more = limit is not None and first > lo
+            else:
+                last = lo + limit if limit is not None else hi
+                rows = series[lo:min(hi, last)]
+                more = limit is not None and last < hi
+            spans = [(self._start(row), self.ends[row]) for row in rows]
+            next_cursor = (format_timestamp(self.timestamps[rows[-1]]), self.ends[rows[-1]]) if more else None
+        return spans, next_cursor
+
+    def _rows(self, group: Optional[str], since: Optional[str], until: Optional[str]):
+        """筛选出的行号（NumPy 数组或列表）；不筛选时返回 None 表示全部行"""
+        if group is None and not since and not until:
+            return None
+        series = self._series(group)
+        if series is None:
+            return np.zeros(0, dtype=np.int64) if np is not None else []
+        lo, hi = self._range(series, since, until)
+        if np is not None:
+            return np.frombuffer(series, dtype=np.uint32)[lo:hi].astype(np.int64)
+        return series[lo:hi]
+
+    def _values(self, name: str, rows):
+        """取一列（NumPy 时为拷贝出的数组，不持有对底层缓冲区的引用）"""
+        column = self.columns[name]
+        if isinstance(column, Dictionary):
+            column = column.column
+        if np is None:
+            return list(column) if rows is None else [column[row] for row in rows]
+        values = np.frombuffer(column, dtype=column.typecode) if len(column) else np.zeros(0, dtype=column.typecode)
+        return values.copy() if rows is None else values[rows]
+
+    def aggregate(self, group: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None):
+        """
+        按分组、时间范围（since 含、until 不含）筛选后的聚合，
+        返回与运行聚合相同的 GameAggregates / DefenseAggregates，可与归档汇总合并
+        """
+        with self._lock:
+            rows = self._rows(group, since, until)
+            if self.schema == "game":
+                return self._game_aggregates(rows)
+            return self._defense_aggregates(rows)
+
+    def _game_aggregates(self, rows) -> GameAggregates:
+        wpm, accuracy, modes = (self._values(name, rows) for name in ("wpm", "accuracy", "mode"))
+        dictionary = ["unknown", *self.columns["mode"].values[1:]]
+        result = GameAggregates()
+        result.count = len(wpm)
+        if not len(wpm):
+            return result
+        histogram = result.wpm_histogram
+        if np is not None:
+            counts = np.bincount(modes, minlength=len(dictionary))
+            result.mode_counts = {dictionary[code]: int(counts[code]) for code in np.flatnonzero(counts)}
+            wpm = wpm.astype(np.float64)
+            result.total_wpm = float(wpm.sum())
+            result.total_accuracy = float(accuracy.astype(np.float64).sum())
+            buckets = np.clip((wpm - histogram.low) // histogram.bucket_width, 0, len(histogram.counts) - 1)
+            histogram.counts = np.bincount(buckets.astype(np.int64), minlength=len(histogram.counts)).tolist()
+            histogram.total = result.count
+            return result
+        for code in modes:
+            result.mode_counts[dictionary[code]] = result.mode_counts.get(dictionary[code], 0) + 1
+        result.total_wpm = sum(wpm)
+        result.total_accuracy = sum(accuracy)
+        for value in wpm:
+            histogram.add(value)
+        return result
+
+    def _defense_aggregates(self, rows) -> DefenseAggregates:
+        score, victory = self._values("score", rows), self._values("victory", rows)
+        result = DefenseAggregates()
+        result.count = len(score)
+        if np is not None:
+            result.total_score = int(score.astype(np.int64).sum())
+            result.victory_count = int(np.count_nonzero(victory))
+        else:
+            result.total_score = sum(score)
+            result.victory_count = sum(1 for v in victory if v)
+        return result
+
+    def top(self, rank_key: str, limit: int = 10, offset: int = 0, group: Optional[str] = None,
+            since: Optional[str] = None, until: Optional[str] = None) -> list[tuple[int, int]]:
+        """
+        按 rank_key 降序（同分先提交者在前，与 LeaderboardIndex 一致）排出筛选范围内的一页，
+        返回各记录的 (起始位置, 末尾位置)，由调用方从存储读取
+        """
+        with self._lock:
+            rows = self._rows(group, since, until)
+            scores = self._values(rank_key, rows)
+            if np is not None:
+                if rows is None:
+                    rows = np.arange(len(scores))
+                ranked = rows[np.lexsort((rows, -scores.astype(np.float64)))][offset:offset + limit].tolist()
+            else:
+                if rows is None:
+                    rows = range(len(scores))
+                ranked = [row for _, row in sorted(zip(scores, rows), key=lambda item: (-item[0], item[1]))]
+                ranked = ranked[offset:offset + limit]
+            return [(self._start(row), self.ends[row]) for row in ranked]
+
+    def memory_bytes(self) -> int:
+        """列与顺序数组占用的字节数"""
+        arrays = [self.timestamps, self.ends, self._order, *self._groups.values()]
+        for column in self.columns.values():
+            arrays.append(column.column if isinstance(column, Dictionary) else column)
+        return sum(a.itemsize * len(a) for a in arrays)
@@ -0,0 +1,348 @@
+"""
+统计数据保留、汇总与压缩
+
+热数据（存储中的原始记录）只保留最近 N 天，更早的记录定期：
+1. 原样写入 gzip 压缩的只读归档段 userdata/archive/<表>-<序号>.jsonl.gz
+   （首行为段信息：序号、截止时间、条数、时间范围），并登记到 <表>.index.json
+2. 按 天 × 分组（模式 / 难度）汇总为与运行聚合同型的计数器，写入 <表>.rollups.json；
+   同时保留归档记录中仍能进入排行榜（全局或任一分组前 N 名）的那些记录，以及各玩家的个人最佳
+3. 从热存储中删除（jsonl 重写文件，sqlite 删除行），存储代号随之变化，
+   各 worker 在下次追读时从头重建索引，排行榜先放入归档的上榜记录，玩家索引先计入归档的个人最佳
+
+分析接口把汇总与热数据的聚合合并后返回，压缩前后结果一致；
+按时间范围查询时，归档部分按整天计入（截止时间总在整天边界上）。
+
+压缩在后台线程中进行：扫描热数据、写归档段只持有压缩锁（同一张表同时只有一个压缩），
+读写都不受影响；只有最后删除热数据、登记段与合并汇总时持有存储的写锁，期间写入与追读等待。
+各步骤的中断都可恢复：未登记的段在下次压缩时按热数据中是否仍有旧记录决定登记或删除，
+汇总文件与段目录不一致时从归档段重新计算。
+"""
+
+import gzip
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Iterator, Optional
+
+from .analytics import AGGREGATE_KINDS, FixedHistogram, finite
+from .columnar import parse_timestamp
+from .leaderboard import LeaderboardIndex
+from .players import personal_bests
+from .storage import StatsTable, decode_record
+
+try:
+    import fcntl
+except ImportError:  # Windows：只保证单进程内安全
+    fcntl = None
+
+
+def _timestamp(record: dict) -> Optional[int]:
+    try:
+        return parse_timestamp(record.get("timestamp"))
+    except (TypeError, ValueError):
+        return None  # 没有有效时间戳的记录无法归到某一天，始终留在热数据中
+
+
+def retention_cutoff(days: float, today: Optional[date] = None) -> str:
+    """保留最近 days 天（含今天）：返回最早保留的那一天的零点"""
+    today = today or date.today()
+    return datetime.combine(today - timedelta(days=max(int(days) - 1, 0)), datetime.min.time()).isoformat()
+
+
+class Archive:
+    """一张表的归档段与段目录"""
+
+    def __init__(self, directory: str, name: str):
+        self.directory = directory
+        self.name = name
+        self.index_path = os.path.join(directory, f"{name}.index.json")
+        self._pattern = re.compile(rf"^{re.escape(name)}-(\d+)\.jsonl\.gz$")
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def lock(self):
+        """压缩锁：同一张表的压缩在本进程的线程之间与各进程之间互斥（锁文件 + flock）"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            fd = os.open(os.path.join(self.directory, f"{self.name}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+    def segments(self) -> list[dict]:
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def _files(self) -> dict[int, str]:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return {}
+        return {int(m.group(1)): name for name in names if (m := self._pattern.match(name))}
+
+    def orphans(self) -> list[dict]:
+        """已写出但未登记的段（压缩中途退出）的段信息"""
+        registered = {entry["id"] for entry in self.segments()}
+        orphans = []
+        for segment_id, name in sorted(self._files().items()):
+            if segment_id not in registered:
+                with gzip.open(os.path.join(self.directory, name), "rt", encoding="utf-8") as f:
+                    orphans.append(json.loads(f.readline()))
+        return orphans
+
+    def write_segment(self, records: list[dict], cutoff: str) -> dict:
+        """写出一个只读段（尚未登记），返回段信息"""
+        os.makedirs(self.directory, exist_ok=True)
+        segment_id = max([*self._files(), *(entry["id"] for entry in self.segments()), 0]) + 1
+        timestamps = [r["timestamp"] for r in records if r.get("timestamp")]
+        entry = {"id": segment_id, "file": f"{self.name}-{segment_id:06d}.jsonl.gz", "cutoff": cutoff,
+                 "records": len(records), "first": min(timestamps, default=None), "last": max(timestamps, default=None)}
+        path = os.path.join(self.directory, entry["file"])
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as f:
+                f.write((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8"))
+                for record in records:
+                    f.write((json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8"))
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.chmod(tmp_path, 0o444)
+        os.replace(tmp_path, path)
+        entry["bytes"] = os.path.getsize(path)
+        return entry
+
+    def register(self, entry: dict):
+        segments = [s for s in self.segments() if s["id"] != entry["id"]] + [entry]
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(sorted(segments, key=lambda s: s["id"]), f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    def discard(self, entry: dict):
+        os.remove(os.path.join(self.directory, entry["file"]))
+
+    def read_segment(self, entry: dict) -> Iterator[dict]:
+        with gzip.open(os.path.join(self.directory, entry["file"]), "rt", encoding="utf-8") as f:
+            f.readline()  # 段信息
+            for line in f:
+                yield decode_record(line)
+
+
+def _pack(aggregates) -> dict:
+    data = aggregates.to_dict()
+    histogram = data.get("wpm_histogram")
+    if histogram is not None:  # 直方图大多为空桶，按稀疏形式保存
+        histogram["counts"] = {str(i): c for i, c in enumerate(histogram["counts"]) if c}
+    return data
+
+
+def _unpack(kind: str, data: dict):
+    histogram = data.get("wpm_histogram")
+    if histogram is not None:
+        counts = [0] * len(FixedHistogram(histogram["low"], histogram["high"], histogram["bucket_width"]).counts)
+        for i, c in histogram["counts"].items():
+            counts[int(i)] = c
+        data = {**data, "wpm_histogram": {**histogram, "counts": counts}}
+    aggregates = AGGREGATE_KINDS[kind]()
+    aggregates.load_dict(data)
+    return aggregates
+
+
+class Rollups:
+    """
+    已归档记录的逐日、逐分组汇总与上榜记录。
+    作为统计表的索引挂在排行榜之前：存储被压缩重写后 reset() 重新读取汇总文件，
+    排行榜与玩家索引随后分别以 leaders()、bests() 为种子重建。
+    """
+
+    def __init__(self, path: str, archive: Archive, kind: str, rank_key: str,
+                 group_by: Optional[str] = None, capacity: int = 1000):
+        self.path = path
+        self.archive = archive
+        self.kind = kind
+        self.rank_key = rank_key
+        self.group_by = group_by
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._load()
+
+    def add_many(self, records: list[dict], positions: list[int]):
+        pass  # 只在压缩时由 fold() 更新
+
+    def _load(self):
+        self.segments, self.days, self._leaders, self._bests = [], {}, [], []
+        self._totals = None
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("kind") == self.kind:
+                self.segments = data["segments"]
+                self.days = {day: {group: _unpack(self.kind, cell) for group, cell in groups.items()}
+                             for day, groups in data["days"].items()}
+                self._leaders = data["leaders"]
+                self._bests = data["bests"]
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError):
+            self.segments = None  # 文件损坏，下面从归档段重算
+        registered = [entry["id"] for entry in self.archive.segments()]
+        if self.segments != registered:
+            self._rebuild(registered)
+
+    def _rebuild(self, registered: list[int]):
+        """从全部已登记的归档段重新计算（汇总文件缺失、损坏或落后于段目录时）"""
+        self.segments, self.days, self._leaders, self._bests = [], {}, [], []
+        for entry in self.archive.segments():
+            self._fold(list(self.archive.read_segment(entry)), entry["id"])
+        self._save()
+
+    def fold(self, records: list[dict], segment_id: int):
+        """并入一个新归档段的记录并落盘"""
+        with self._lock:
+            self._fold(records, segment_id)
+            self._save()
+
+    def _fold(self, records: list[dict], segment_id: int):
+        factory = AGGREGATE_KINDS[self.kind]
+        for record in records:
+            day = record["timestamp"][:10]
+            group = str(record.get(self.group_by) or "") if self.group_by else ""
+            cells = self.days.setdefault(day, {})
+            cell = cells.get(group)
+            if cell is None:
+                cell = cells[group] = factory()
+            cell.add(record)
+        # 归档记录中只保留仍可能上榜的：旧的上榜记录 + 新归档记录里各榜的前 N 名
+        board = LeaderboardIndex(self.rank_key, self.group_by, self.capacity)
+        candidates = self._leaders + records
+        board.add_many(candidates)
+        members = {id(r) for r in board.members()}
+        self._leaders = [r for r in candidates if id(r) in members]
+        self._bests = personal_bests(self._bests + records, self.rank_key, self.group_by)
+        self.segments.append(segment_id)
+        self._totals = None
+
+    def _save(self):
+        data = {
+            "kind": self.kind,
+            "segments": self.segments,
+            "days": {day: {group: _pack(cell) for group, cell in groups.items()} for day, groups in self.days.items()},
+            "leaders": self._leaders,
+            "bests": self._bests,
+        }
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def leaders(self) -> list[dict]:
+        """归档中的上榜记录（按归档顺序），作为排行榜的种子"""
+        return list(self._leaders)
+
+    def bests(self) -> list[dict]:
+        """归档中各玩家的个人最佳记录（按归档顺序），作为玩家索引的种子"""
+        return list(self._bests)
+
+    def ranked_leaders(self, group: Optional[str] = None, since: Optional[str] = None,
+                       until: Optional[str] = None) -> list[dict]:
+        """时间范围内的归档上榜记录，按排行字段降序"""
+        low = parse_timestamp(since) if since else None
+        high = parse_timestamp(until) if until else None
+        selected = []
+        for record in self._leaders:
+            if group is not None and record.get(self.group_by) != group:
+                continue
+            ts = _timestamp(record)
+            if (low is None or ts >= low) and (high is None or ts < high):
+                selected.append(record)
+        return sorted(selected, key=lambda r: -finite(r.get(self.rank_key)))
+
+    def totals(self):
+        """全部归档记录的聚合（缓存到下次并入新段）"""
+        totals = self._totals
+        if totals is None:
+            totals = AGGREGATE_KINDS[self.kind]()
+            for groups in self.days.values():
+                for cell in groups.values():
+                    totals.merge(cell)
+            self._totals = totals
+        return totals
+
+    def aggregate(self, since: Optional[str] = None, until: Optional[str] = None, group: Optional[str] = None):
+        """按整天筛选（当天零点落在 [since, until) 内）的归档聚合"""
+        low = parse_timestamp(since) if since else None
+        high = parse_timestamp(until) if until else None
+        result = AGGREGATE_KINDS[self.kind]()
+        for day, groups in self.days.items():
+            start = parse_timestamp(day)
+            if (low is not None and start < low) or (high is not None and start >= high):
+                continue
+            for name, cell in groups.items():
+                if group is None or name == group:
+                    result.merge(cell)
+        return result
+
+    def __len__(self) -> int:
+        return sum(cell.count for groups in self.days.values() for cell in groups.values())
+
+
+def compact(table: StatsTable, archive: Archive, cutoff: str) -> Optional[dict]:
+    """
+    把时间戳早于 cutoff 的记录归档、汇总并移出热存储，返回新段信息（没有可归档的记录时返回 None）。
+    扫描与写段只持有压缩锁：存储只会在末尾追加，扫到的位置在删除时仍然有效；
+    删除热数据、登记与合并汇总在存储的写锁内进行，退出时本进程的索引随存储代号变化从头重建。
+    """
+    store = table.store
+    rollups = table.indexes["rollups"]
+    limit = parse_timestamp(cutoff)
+    with archive.lock():
+        generation = store._read_generation()
+        cold, positions = [], set()
+        oldest = None
+        for position, record in store.iter_entries(0):
+            ts = _timestamp(record)
+            if ts is not None and ts < limit:
+                cold.append(record)
+                positions.add(position)
+            if ts is not None and (oldest is None or ts < oldest):
+                oldest = ts
+        _recover(archive, rollups, oldest)
+        if not cold:
+            return None
+        entry = archive.write_segment(cold, cutoff)
+        with store.exclusive():
+            if store.generation != generation:
+                # 扫描期间存储被重写（如手工清理），位置已失效：丢弃本段，下一轮重来
+                archive.discard(entry)
+                return None
+            store.remove_entries(positions)
+            archive.register(entry)
+            rollups.fold(cold, entry["id"])
+    return entry
+
+
+def _recover(archive: Archive, rollups: Rollups, oldest: Optional[int]):
+    """处理上次中断留下的未登记段：热数据里已没有其截止时间之前的记录，说明删除已完成"""
+    for entry in archive.orphans():
+        if oldest is not None and oldest < parse_timestamp(entry["cutoff"]):
+            archive.discard(entry)
+        else:
+            entry["bytes"] = os.path.getsize(os.path.join(archive.directory, entry["file"]))
+            archive.register(entry)
+            rollups.fold(list(archive.read_segment(entry)), entry["id"])
@@ -0,0 +1,180 @@
+"""
+内容/配置缓存
+
+data/ 下的内容与配置文件极少变化：首次访问时加载一次并缓存解析结果与
+序列化好的响应体，之后每次访问只做一次 stat，mtime / inode / 大小变化时才重新加载。
+
+响应体附带由内容哈希得到的强 ETag，gzip / brotli 压缩结果同样按内容版本缓存，
+每个版本只压缩一次。
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Callable, Optional
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖
+    brotli = None
+
+# 小于该大小的响应体不压缩
+MIN_COMPRESS_SIZE = 256
+
+
+def dump_json(data: Any) -> bytes:
+    """与 FastAPI JSONResponse 一致的紧凑序列化"""
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class RenderedBody:
+    """序列化好的响应体及其 ETag、压缩变体"""
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.digest = hashlib.sha256(body).hexdigest()[:32]
+        self._encoded = {}
+
+    def etag(self, encoding: Optional[str] = None) -> str:
+        # 不同编码是不同的字节序列，强 ETag 需区分
+        return f'"{self.digest}-{encoding}"' if encoding else f'"{self.digest}"'
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """If-None-Match 中任一 ETag（忽略编码后缀）与当前内容一致即命中"""
+        if not if_none_match:
+            return False
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*":
+                return True
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if tag.strip('"').split("-", 1)[0] == self.digest:
+                return True
+        return False
+
+    @property
+    def encodings(self) -> list[str]:
+        """已生成的压缩变体"""
+        return list(self._encoded)
+
+    def set_encoded(self, encoding: str, body: bytes):
+        """使用预先生成的压缩结果（如构建产物）"""
+        self._encoded[encoding] = body
+
+    def encoded(self, encoding: str) -> bytes:
+        body = self._encoded.get(encoding)
+        if body is None:
+            if encoding == "br":
+                body = brotli.compress(self.body)
+            else:
+                body = gzip.compress(self.body, compresslevel=9, mtime=0)
+            self._encoded[encoding] = body
+        return body
+
+
+def negotiate_encoding(accept_encoding: Optional[str], size: int) -> Optional[str]:
+    """根据 Accept-Encoding 选择 br / gzip；不支持或响应体太小时返回 None"""
+    if not accept_encoding or size < MIN_COMPRESS_SIZE:
+        return None
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+class ContentEntry:
+    """某一版本的文件内容；版本变化时整体替换，不会原地修改"""
+
+    def __init__(self, data: Any, version: Optional[tuple]):
+        self.data = data
+        self.version = version  # (mtime_ns, inode, size)，文件不存在时为 None
+        self._derived = {}
+
+    def derive(self, key: str, build: Callable[[Any], Any]) -> Any:
+        """按 key 缓存由 data 派生出的对象（如编译后的采样表），随内容版本一起失效"""
+        value = self._derived.get(key)
+        if value is None:
+            value = self._derived[key] = build(self.data)
+        return value
+
+    def render(self, key: str, build: Callable[[Any], Any]) -> RenderedBody:
+        """按 key 缓存由 data 构造出的响应体"""
+        return self.derive(f"render:{key}", lambda data: RenderedBody(dump_json(build(data))))
+
+
+class ContentCache:
+    """按绝对路径缓存 JSON 文件，stat 校验新鲜度"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+
+    @staticmethod
+    def _version(path: str) -> Optional[tuple]:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+    def get(self, filename: str, default_data: Any) -> ContentEntry:
+        path = os.path.abspath(filename)
+        version = self._version(path)
+        if version is None:
+            # 文件不存在：默认值因调用方而异，不缓存
+            self.misses += 1
+            return ContentEntry(default_data, None)
+        entry = self._entries.get(path)
+        if entry is not None and entry.version == version:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry.version != version:
+                entry = self._entries[path] = self._load(path, version, default_data)
+        return entry
+
+    def _load(self, path: str, version: tuple, default_data: Any) -> ContentEntry:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return ContentEntry(default_data, None)
+        self.loads += 1
+        return ContentEntry(data, version)
+
+    def invalidate(self, filename: Optional[str] = None) -> int:
+        """丢弃缓存（指定文件或全部），返回丢弃的条目数"""
+        with self._lock:
+            if filename is None:
+                count = len(self._entries)
+                self._entries.clear()
+                return count
+            return 1 if self._entries.pop(os.path.abspath(filename), None) is not None else 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "loads": self.loads
+        }
@@ -0,0 +1,377 @@
+"""
+按键热力图
+
+按按键时间线累计每个键、每个二元组（上一个键 -> 当前键）的次数、错误数与按键延迟，
+全体玩家一份、每个玩家（带 player_id 的时间线）一份。
+
+- 键表固定（大小写折叠后的字母、数字、空格与常用标点，其余归入「其他」），键 K 项、二元组 K × K 项，每项 4 个计数器
+- 全体热力图存放在固定大小的 int64 矩阵中；新时间线写入时增量累计，安装了 NumPy 时用 bincount 向量化，否则逐键累加
+- 单个玩家只会按到其中很少的二元组，玩家热力图只保存出现过的项（稀疏计数器）；
+  内存中最多保留 max_players 个最近用到的玩家，其余按需从各自的检查点文件载入
+- 查询直接读取计数并按固定大小计算比率，成本与历史按键数无关，不回放原始事件
+- 与 AggregatesIndex 一样定期写检查点（二进制）：全体矩阵一个文件，玩家各一个文件，只重写有变化的玩家；
+  重启后只需回放检查点之后的时间线
+
+延迟为按对的键与上一次按键的间隔；二元组只统计上一次按键也按对的转移，
+超过 LATENCY_CAP_MS 的间隔（停顿、切换窗口）不计入延迟，但仍计入次数与错误。
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Optional
+
+from .timeline import BACKSPACE, Keystrokes, decode_timeline
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 为可选依赖
+    np = None
+
+KEYS = "abcdefghijklmnopqrstuvwxyz0123456789 ,.;:'\"!?-()"
+OTHER = len(KEYS)           # 「其他」键的下标
+KEY_COUNT = len(KEYS) + 1
+LATENCY_CAP_MS = 2000
+
+# 每项的计数器：次数、错误数、计入延迟的次数、延迟总和（毫秒）
+FIELDS = ("count", "errors", "latency_count", "latency_sum")
+CHECKPOINT_FORMAT = 2
+
+_KEY_INDEX = {key: i for i, key in enumerate(KEYS)}
+# 字符码 -> 键下标（ASCII 范围内查表，大写折叠为小写）
+_LOOKUP = array("q", (_KEY_INDEX.get(chr(code).lower(), OTHER) for code in range(128)))
+
+
+def key_index(char: str) -> int:
+    return _LOOKUP[ord(char)] if ord(char) < 128 else OTHER
+
+
+def _cells(keystrokes: Keystrokes):
+    """
+    逐键产出 (项, 是否按对, 是否计入延迟, 间隔)：项 k < KEY_COUNT 为键，
+    KEY_COUNT + 上一个键 × KEY_COUNT + k 为二元组
+    """
+    previous = None  # 上一次按对的输入字符的键下标
+    for i, (expected, interval, correct) in enumerate(
+            zip(keystrokes.expected, keystrokes.intervals, keystrokes.correct)):
+        if expected == BACKSPACE or expected == "\0":
+            previous = None
+            continue
+        k = key_index(expected)
+        timed = correct and i > 0 and interval <= LATENCY_CAP_MS
+        yield k, correct, timed, interval
+        if previous is not None:
+            yield KEY_COUNT + previous * KEY_COUNT + k, correct, timed, interval
+        previous = k if correct else None
+
+
+class Heatmap:
+    """一组键 / 二元组计数矩阵，存放在一块连续的 int64 缓冲区中"""
+
+    KEYS_SIZE = len(FIELDS) * KEY_COUNT
+    SIZE = KEYS_SIZE + len(FIELDS) * KEY_COUNT * KEY_COUNT
+
+    def __init__(self, data: Optional[array] = None):
+        self.data = data if data is not None else array("q", bytes(8 * self.SIZE))
+        self.timelines = 0
+
+    def add(self, keystrokes: Keystrokes):
+        self.timelines += 1
+        if np is not None:
+            self._add_numpy(keystrokes)
+        else:
+            self._add_python(keystrokes)
+
+    def _add_numpy(self, keystrokes: Keystrokes):
+        n = len(keystrokes)
+        if not n:
+            return
+        codes = np.frombuffer(keystrokes.expected.encode("utf-32-le"), dtype=np.uint32)
+        idx = np.where(codes < 128, np.frombuffer(_LOOKUP, dtype=np.int64)[np.minimum(codes, 127)], OTHER)
+        intervals = np.asarray(keystrokes.intervals, dtype=np.int64)
+        correct = np.frombuffer(keystrokes.correct, dtype=np.uint8).astype(bool)
+        typed = (codes != ord(BACKSPACE)) & (codes != 0)
+        timed = correct & (intervals <= LATENCY_CAP_MS)
+        timed[0] = False  # 第一次按键的间隔是距开局的时间
+
+        view = np.frombuffer(self.data, dtype=np.int64)
+        keys = view[:self.KEYS_SIZE].reshape(len(FIELDS), KEY_COUNT)
+        pairs = view[self.KEYS_SIZE:].reshape(len(FIELDS), KEY_COUNT * KEY_COUNT)
+        self._accumulate(keys, idx[typed], ~correct[typed], timed[typed], intervals[typed], KEY_COUNT)
+
+        # 转移 i-1 -> i：两次都是输入字符且上一次按对
+        pair = typed[1:] & typed[:-1] & correct[:-1]
+        flat = idx[:-1] * KEY_COUNT + idx[1:]
+        self._accumulate(pairs, flat[pair], ~correct[1:][pair], timed[1:][pair], intervals[1:][pair],
+                         KEY_COUNT * KEY_COUNT)
+
+    @staticmethod
+    def _accumulate(target, idx, errors, timed, intervals, size: int):
+        target[0] += np.bincount(idx, minlength=size)
+        target[1] += np.bincount(idx[errors], minlength=size)
+        target[2] += np.bincount(idx[timed], minlength=size)
+        target[3] += np.bincount(idx[timed], weights=intervals[timed], minlength=size).astype(np.int64)
+
+    def _add_python(self, keystrokes: Keystrokes):
+        data = self.data
+        # 键区 K 项一组、二元组区 K × K 项一组，各组依次为 FIELDS 中的计数器
+        offset = self.KEYS_SIZE - KEY_COUNT
+        pair_stride = KEY_COUNT * KEY_COUNT
+        for cell, correct, timed, interval in _cells(keystrokes):
+            if cell < KEY_COUNT:
+                stride = KEY_COUNT
+            else:
+                cell += offset
+                stride = pair_stride
+            data[cell] += 1
+            if not correct:
+                data[cell + stride] += 1
+            if timed:
+                data[cell + 2 * stride] += 1
+                data[cell + 3 * stride] += interval
+
+    def _fields(self, start: int, size: int) -> dict:
+        return {name: self.data[start + i * size:start + (i + 1) * size] for i, name in enumerate(FIELDS)}
+
+    def keys(self) -> dict:
+        """每个键：次数、错误率（%）、平均延迟（毫秒，无数据为 None）"""
+        return _rates(self._fields(0, KEY_COUNT))
+
+    def bigrams(self) -> dict:
+        """K × K 矩阵，行为上一个键、列为当前键"""
+        rates = _rates(self._fields(self.KEYS_SIZE, KEY_COUNT * KEY_COUNT))
+        return {name: [values[row:row + KEY_COUNT] for row in range(0, len(values), KEY_COUNT)]
+                for name, values in rates.items()}
+
+
+class PlayerHeatmap:
+    """
+    单个玩家的稀疏热力图：项 -> 4 个计数器（项的编号见 _cells），只保存出现过的项。
+    position 为已计入的最后一条时间线的存储位置，回放时跳过检查点中已计入的时间线。
+    """
+
+    def __init__(self):
+        self.cells = {}
+        self.timelines = 0
+        self.position = 0
+
+    def add(self, keystrokes: Keystrokes, position: int = 0):
+        self.timelines += 1
+        self.position = position
+        cells = self.cells
+        for cell, correct, timed, interval in _cells(keystrokes):
+            counters = cells.get(cell)
+            if counters is None:
+                counters = cells[cell] = [0, 0, 0, 0]
+            counters[0] += 1
+            if not correct:
+                counters[1] += 1
+            if timed:
+                counters[2] += 1
+                counters[3] += interval
+
+    def _fields(self, start: int, size: int) -> dict:
+        fields = [array("q", bytes(8 * size)) for _ in FIELDS]
+        for cell, counters in self.cells.items():
+            if start <= cell < start + size:
+                for values, value in zip(fields, counters):
+                    values[cell - start] = value
+        return dict(zip(FIELDS, fields))
+
+    def keys(self) -> dict:
+        return _rates(self._fields(0, KEY_COUNT))
+
+    def bigrams(self) -> dict:
+        rates = _rates(self._fields(KEY_COUNT, KEY_COUNT * KEY_COUNT))
+        return {name: [values[row:row + KEY_COUNT] for row in range(0, len(values), KEY_COUNT)]
+                for name, values in rates.items()}
+
+    def to_bytes(self, player_id: str) -> bytes:
+        """一行 JSON 头 + 各项的 (项, 4 个计数器) int64"""
+        header = {"player_id": player_id, "timelines": self.timelines, "position": self.position}
+        body = array("q")
+        for cell, counters in self.cells.items():
+            body.append(cell)
+            body.extend(counters)
+        return json.dumps(header, ensure_ascii=False).encode("utf-8") + b"\n" + body.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> tuple[str, "PlayerHeatmap"]:
+        head, _, raw = data.partition(b"\n")
+        header = json.loads(head)
+        body = array("q")
+        body.frombytes(raw)
+        heatmap = cls()
+        heatmap.timelines = header["timelines"]
+        heatmap.position = header["position"]
+        width = 1 + len(FIELDS)
+        for i in range(0, len(body), width):
+            heatmap.cells[body[i]] = body[i + 1:i + width].tolist()
+        return header["player_id"], heatmap
+
+
+def _rates(fields: dict) -> dict:
+    counts, errors, timed, total = fields["count"], fields["errors"], fields["latency_count"], fields["latency_sum"]
+    if np is not None:
+        counts, errors, timed, total = (np.frombuffer(a, dtype=np.int64) for a in (counts, errors, timed, total))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            error_rate = np.round(errors / counts * 100, 2)
+            latency = np.round(total / timed, 1)
+        return {
+            "count": counts.tolist(),
+            "error_rate": [None if v != v else v for v in error_rate.tolist()],
+            "avg_latency_ms": [None if v != v else v for v in latency.tolist()],
+        }
+    return {
+        "count": counts.tolist(),
+        "error_rate": [round(e / c * 100, 2) if c else None for e, c in zip(errors, counts)],
+        "avg_latency_ms": [round(s / n, 1) if n else None for s, n in zip(total, timed)],
+    }
+
+
+class HeatmapIndex:
+    """
+    挂在时间线表上的热力图索引：全体一份（稠密），每个玩家一份（稀疏，LRU 常驻 max_players 个），带检查点。
+    玩家检查点存放在与 checkpoint_path 同名的 .players 目录中，每个玩家一个文件；
+    未配置检查点时玩家热力图全部常驻内存。
+    """
+
+    def __init__(self, blob_path: str, checkpoint_path: Optional[str] = None, checkpoint_every: int = 100,
+                 max_players: int = 1000):
+        self.blob_path = blob_path
+        self.checkpoint_path = checkpoint_path
+        self.players_dir = os.path.splitext(checkpoint_path)[0] + ".players" if checkpoint_path else None
+        self.checkpoint_every = checkpoint_every
+        self.max_players = max_players
+        self.overall = Heatmap()
+        self.players = OrderedDict()  # 常驻内存的玩家，最近用到的在末尾
+        self.position = 0
+        self.generation = None
+        self._dirty = 0
+        self._dirty_players = set()  # 检查点之后有变化的玩家
+        self._lock = threading.Lock()
+        self._load_checkpoint()
+
+    def _load_checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        if not os.path.exists(self.checkpoint_path):
+            self.reset()  # 没有全体检查点时，残留的玩家检查点也不可信
+            return
+        try:
+            with open(self.checkpoint_path, "rb") as f:
+                header = json.loads(f.readline())
+                if header.get("keys") != KEYS or header.get("format") != CHECKPOINT_FORMAT:
+                    self.reset()  # 键表或格式变了，从头回放
+                    return
+                data = array("q")
+                data.fromfile(f, Heatmap.SIZE)
+            self.overall = Heatmap(data)
+            self.overall.timelines = header["timelines"]
+            self.position = header["position"]
+            self.generation = header.get("generation")
+        except (ValueError, KeyError, TypeError, EOFError):
+            self.reset()  # 检查点损坏时从头回放
+
+    def reset(self):
+        with self._lock:
+            self.overall = Heatmap()
+            self.players = OrderedDict()
+            self.position = 0
+            self._dirty_players = set()
+            if self.players_dir:
+                shutil.rmtree(self.players_dir, ignore_errors=True)
+
+    def _player_path(self, player_id: str) -> str:
+        return os.path.join(self.players_dir, hashlib.sha1(player_id.encode("utf-8")).hexdigest() + ".bin")
+
+    def _player(self, player_id: str, create: bool) -> Optional[PlayerHeatmap]:
+        """取玩家热力图（内存中没有则从检查点载入），并标记为最近用到；调用方需持有 _lock"""
+        heatmap = self.players.get(player_id)
+        if heatmap is not None:
+            self.players.move_to_end(player_id)
+            return heatmap
+        if self.players_dir:
+            try:
+                with open(self._player_path(player_id), "rb") as f:
+                    stored_id, heatmap = PlayerHeatmap.from_bytes(f.read())
+                if stored_id != player_id:
+                    heatmap = None
+            except FileNotFoundError:
+                pass
+            except (ValueError, KeyError, TypeError):
+                heatmap = None  # 检查点损坏：丢弃该玩家的累计
+        if heatmap is None:
+            if not create:
+                return None
+            heatmap = PlayerHeatmap()
+        self.players[player_id] = heatmap
+        if self.players_dir:
+            while len(self.players) > self.max_players:
+                evicted, evicted_map = self.players.popitem(last=False)
+                if evicted in self._dirty_players:
+                    self._write_player(evicted, evicted_map)
+        return heatmap
+
+    def _write_player(self, player_id: str, heatmap: PlayerHeatmap):
+        self._dirty_players.discard(player_id)
+        path = self._player_path(player_id)
+        os.makedirs(self.players_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(heatmap.to_bytes(player_id))
+        os.replace(tmp_path, path)
+
+    def add_many(self, records: list[dict], positions: list[int]):
+        if not records:
+            return
+        fd = os.open(self.blob_path, os.O_RDONLY)
+        try:
+            decoded = [(record.get("player_id"),
+                        decode_timeline(os.pread(fd, record["length"], record["offset"]), record["texts"]))
+                       for record in records]
+        finally:
+            os.close(fd)
+        with self._lock:
+            for (player_id, keystrokes), position in zip(decoded, positions):
+                self.overall.add(keystrokes)
+                if player_id:
+                    heatmap = self._player(player_id, create=True)
+                    if position > heatmap.position:  # 玩家检查点可能比全体检查点新
+                        heatmap.add(keystrokes, position)
+                        self._dirty_players.add(player_id)
+            self.position = positions[-1]
+            self._dirty += len(records)
+            due = self._dirty >= self.checkpoint_every
+        if due:
+            self.flush()
+
+    def get(self, player_id: Optional[str] = None):
+        if player_id is None:
+            return self.overall
+        with self._lock:
+            return self._player(player_id, create=False)
+
+    def flush(self):
+        """先写有变化的玩家，再把全体矩阵与已覆盖位置原子写入检查点文件（一行 JSON 头 + 矩阵的原始字节）"""
+        if not self.checkpoint_path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            for player_id in list(self._dirty_players):
+                heatmap = self.players.get(player_id)
+                if heatmap is not None:
+                    self._write_player(player_id, heatmap)
+            header = {"keys": KEYS, "format": CHECKPOINT_FORMAT, "position": self.position,
+                      "generation": self.generation, "timelines": self.overall.timelines}
+            payload = [json.dumps(header, ensure_ascii=False).encode("utf-8") + b"\n", self.overall.data.tobytes()]
+            self._dirty = 0
+        tmp_path = f"{self.checkpoint_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.writelines(payload)
+        os.replace(tmp_path, self.checkpoint_path)
@@ -0,0 +1,121 @@
+"""
+统计历史索引
+
+按 (timestamp, 位置) 有序保存每条记录在存储中的 (起始位置, 末尾位置)，
+并按 mode / difficulty 等字段分区各维护一份：
+- 时间范围筛选：二分定位，O(log n)，不扫描历史
+- 游标分页：游标即上一页最后一条的 (timestamp, 位置)，翻页同样 O(log n)
+- 取记录：只按位置随机读取当前页，内存占用与页大小相关而非历史大小
+"""
+
+import base64
+import bisect
+import threading
+from typing import Optional
+
+
+def encode_cursor(key: tuple[str, int]) -> str:
+    timestamp, position = key
+    return base64.urlsafe_b64encode(f"{timestamp}|{position}".encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    """解析游标；格式不正确时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        timestamp, position = raw.rsplit("|", 1)
+        return timestamp, int(position)
+    except Exception as e:
+        raise ValueError(f"无效的游标: {cursor}") from e
+
+
+class _Series:
+    """一组按 (timestamp, 末尾位置) 升序排列的记录位置"""
+
+    __slots__ = ("keys", "starts")
+
+    def __init__(self):
+        self.keys = []    # (timestamp, 末尾位置)
+        self.starts = []  # 与 keys 一一对应的起始位置
+
+    def add(self, key: tuple[str, int], start: int):
+        # 新记录的时间戳通常最大，插入点在末尾，均摊 O(1)
+        if not self.keys or key > self.keys[-1]:
+            self.keys.append(key)
+            self.starts.append(start)
+            return
+        i = bisect.bisect_right(self.keys, key)
+        self.keys.insert(i, key)
+        self.starts.insert(i, start)
+
+    def range(self, since: Optional[str], until: Optional[str]) -> tuple[int, int]:
+        lo = bisect.bisect_left(self.keys, (since,)) if since else 0
+        hi = bisect.bisect_left(self.keys, (until,)) if until else len(self.keys)
+        return lo, hi
+
+    def select(self, since: Optional[str], until: Optional[str], cursor: Optional[tuple[str, int]],
+               limit: Optional[int], descending: bool) -> tuple[list[tuple[int, int]], Optional[tuple[str, int]]]:
+        lo, hi = self.range(since, until)
+        if cursor is not None:
+            if descending:
+                hi = min(hi, bisect.bisect_left(self.keys, cursor))
+            else:
+                lo = max(lo, bisect.bisect_right(self.keys, cursor))
+        if hi <= lo:
+            return [], None
+        if descending:
+            first = hi - limit if limit is not None else lo
+            indices = range(hi - 1, max(lo, first) - 1, -1)
+            more = limit is not None and first > lo
+        else:
+            last = lo + limit if limit is not None else hi
+            indices = range(lo, min(hi, last))
+            more = limit is not None and last < hi
+        spans = [(self.starts[i], self.keys[i][1]) for i in indices]
+        return spans, self.keys[indices[-1]] if more else None
+
+
+class HistoryIndex:
+    """统计历史的时间索引（可按一个字段分区）"""
+
+    def __init__(self, partition_by: Optional[str] = None):
+        self.partition_by = partition_by
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._all = _Series()
+            self._groups = {}
+            self._last_end = 0
+
+    def add_many(self, records: list[dict], positions: list[int]):
+        with self._lock:
+            for record, end in zip(records, positions):
+                start, self._last_end = self._last_end, end
+                key = (str(record.get("timestamp") or ""), end)
+                self._all.add(key, start)
+                if self.partition_by:
+                    group = record.get(self.partition_by)
+                    if group is not None:
+                        series = self._groups.get(str(group))
+                        if series is None:
+                            series = self._groups[str(group)] = _Series()
+                        series.add(key, start)
+
+    def __len__(self) -> int:
+        return len(self._all.keys)
+
+    def select(self, since: Optional[str] = None, until: Optional[str] = None,
+               group: Optional[str] = None, cursor: Optional[tuple[str, int]] = None,
+               limit: Optional[int] = None, descending: bool = False
+               ) -> tuple[list[tuple[int, int]], Optional[tuple[str, int]]]:
+        """
+        返回 ([(起始位置, 末尾位置)], 下一页游标)。
+        since 含、until 不含；cursor 为上一页返回的游标，没有更多数据时下一页游标为 None。
+        """
+        with self._lock:
+            series = self._all if group is None else self._groups.get(group)
+            if series is None:
+                return [], None
+            return series.select(since, until, cursor, limit, descending)
@@ -0,0 +1,52 @@
+"""
+幂等键索引
+
+批量上报的每条记录可携带 idempotency_key（随记录一起落盘），
+客户端重试同一批数据时，已写入过的键会被跳过而不是重复插入。
+启动时随统计表回放重建，多进程下随存储追读保持一致。
+"""
+
+import threading
+from collections import OrderedDict
+
+IDEMPOTENCY_FIELD = "idempotency_key"
+
+
+class IdempotencyIndex:
+    """最近 capacity 个幂等键（足以覆盖离线队列的重试窗口）"""
+
+    def __init__(self, capacity: int = 100000):
+        self.capacity = capacity
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self._keys = OrderedDict()
+
+    def add_many(self, records: list[dict], positions: list[int]):
+        with self._lock:
+            for record in records:
+                key = record.get(IDEMPOTENCY_FIELD)
+                if key is not None:
+                    self._keys[key] = None
+                    self._keys.move_to_end(key)
+            while len(self._keys) > self.capacity:
+                self._keys.popitem(last=False)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._keys
+
+    def filter_new(self, records: list[dict]) -> list[dict]:
+        """去掉已写入过的键以及同一批内重复的键（作为存储写入的 dedupe 回调）"""
+        seen = set()
+        kept = []
+        with self._lock:
+            for record in records:
+                key = record.get(IDEMPOTENCY_FIELD)
+                if key is not None:
+                    if key in self._keys or key in seen:
+                        continue
+                    seen.add(key)
+                kept.append(record)
+        return kept
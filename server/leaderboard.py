@@ -0,0 +1,98 @@
+"""
+排行榜索引
+
+在内存中维护有界有序的前 N 名，启动时构建一次，之后每次写入增量更新：
+- 写入：O(log N) 定位 + 有界列表插入
+- 读取：O(k) 切片，不再对全量历史排序
+"""
+
+import bisect
+import threading
+from typing import Callable, Optional
+
+from .analytics import finite
+
+
+class Leaderboard:
+    """单个有界排行榜：按分数降序，同分时先提交者在前"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._keys = []     # (-分数, 序号)，升序
+        self._records = []  # 与 _keys 一一对应
+
+    def add(self, score: float, seq: int, record: dict) -> Optional[int]:
+        """插入记录，返回名次下标；未进入榜单返回 None"""
+        key = (-score, seq)
+        if len(self._keys) >= self.capacity and key >= self._keys[-1]:
+            return None
+        i = bisect.bisect_right(self._keys, key)
+        self._keys.insert(i, key)
+        self._records.insert(i, record)
+        if len(self._keys) > self.capacity:
+            self._keys.pop()
+            self._records.pop()
+        return i
+
+    def page(self, offset: int = 0, limit: int = 10) -> list[dict]:
+        return self._records[offset:offset + limit]
+
+    def __len__(self):
+        return len(self._records)
+
+
+class LeaderboardIndex:
+    """
+    全局榜 + 按分组字段（如模式、难度）划分的分组榜。
+    seed 返回先于存储中全部记录的上榜记录（如已归档数据的前 N 名），建榜与重建时先放入。
+    """
+
+    def __init__(self, rank_key: str, group_by: Optional[str] = None, capacity: int = 1000,
+                 seed: Optional[Callable[[], list[dict]]] = None):
+        self.rank_key = rank_key
+        self.group_by = group_by
+        self.capacity = capacity
+        self.seed = seed
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._global = Leaderboard(self.capacity)
+            self._groups = {}
+            self._seq = 0
+            for record in self.seed() if self.seed else ():
+                self._add(record)
+
+    def add_many(self, records: list[dict], positions: Optional[list[int]] = None):
+        with self._lock:
+            for record in records:
+                self._add(record)
+
+    def _add(self, record: dict):
+        score = finite(record.get(self.rank_key))
+        seq = self._seq
+        self._seq += 1
+        self._global.add(score, seq, record)
+        if self.group_by is not None:
+            group = record.get(self.group_by)
+            board = self._groups.get(group)
+            if board is None:
+                board = self._groups[group] = Leaderboard(self.capacity)
+            board.add(score, seq, record)
+
+    def members(self) -> list[dict]:
+        """所有榜单（全局与各分组）上的记录，去重"""
+        with self._lock:
+            boards = [self._global, *self._groups.values()]
+            return list({id(r): r for board in boards for r in board.page(0, board.capacity)}.values())
+
+    def top(self, limit: int = 10, offset: int = 0, group: Optional[str] = None) -> list[dict]:
+        if group is None:
+            board = self._global
+        else:
+            board = self._groups.get(group)
+            if board is None:
+                return []
+        with self._lock:
+            return board.page(offset, limit)
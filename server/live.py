@@ -0,0 +1,243 @@
+"""
+排行榜实时推送
+
+客户端通过 WebSocket 订阅某个榜单（全局或某一分组的前 N 名），
+只有新提交真正改变了该榜单时才推送，且只推送差异：
+
+    {"type": "snapshot", "version": 3, "entries": [...]}                 订阅时与落后时
+    {"type": "diff", "version": 4, "size": 10, "inserts": [{"rank": 0, "entry": {...}}]}
+
+客户端按顺序把 inserts 插入到对应名次，再截断为 size 条即可。
+
+- 每次变化只序列化一次，同一事件循环上的所有订阅者共用同一份字节
+- 写入发生在 I/O 线程（存储监听回调），通过 call_soon_threadsafe 每个事件循环只投递一次
+- 慢消费者：上一条尚未发出时，新的差异会被合并为一条最新快照；单次发送超时则断开
+- 多 worker 部署时，有订阅者期间每秒追读一次存储，其他 worker 的写入也能推送出去
+"""
+
+import asyncio
+import threading
+from typing import Optional
+
+from .content_cache import dump_json
+
+# 单次发送超时（秒），超时视为慢消费者并断开
+SEND_TIMEOUT = 10.0
+# 有订阅者时追读其他 worker 写入的间隔（秒）
+SYNC_INTERVAL = 1.0
+
+
+class LiveMessage:
+    """
+    某个版本的推送内容；差异与快照都只序列化一次。
+    state 为快照字段（dict），或在首个落后的订阅者需要快照时才调用的构造函数。
+    """
+
+    __slots__ = ("version", "state", "diff", "_snapshot")
+
+    def __init__(self, version: int, state, diff: Optional[str]):
+        self.version = version
+        self.state = state
+        self.diff = diff
+        self._snapshot = None
+
+    @property
+    def snapshot(self) -> str:
+        if self._snapshot is None:
+            state = self.state() if callable(self.state) else self.state
+            self._snapshot = dump_json({"type": "snapshot", "version": self.version, **state}).decode("utf-8")
+        return self._snapshot
+
+
+def diff_inserts(previous: list[dict], current: list[dict]) -> Optional[list[tuple[int, dict]]]:
+    """
+    榜单只会插入新记录并截断末尾，因此 current 等于在 previous 中插入若干条后截断。
+    返回 [(名次, 记录)]；不满足该形式（如索引被重建）时返回 None。
+    """
+    inserts = []
+    j = 0
+    for rank, record in enumerate(current):
+        if j < len(previous) and previous[j] is record:
+            j += 1
+        else:
+            inserts.append((rank, record))
+    # 未匹配上的旧记录只能是被挤出末尾的
+    if j < len(previous) and len(current) < len(previous):
+        return None
+    return inserts
+
+
+class Subscriber:
+    """一个连接的发送端：最多一条待发消息"""
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.version = -1
+        self.pending = None
+        self.wakeup = asyncio.Event()
+
+    def offer(self, message: LiveMessage):
+        """在事件循环线程中调用：排入一条消息，已有未发送的消息时合并为快照"""
+        if message.version <= self.version:
+            return
+        if self.pending is None and message.diff is not None and message.version == self.version + 1:
+            self.pending = message.diff
+        else:
+            self.pending = message.snapshot
+        self.version = message.version
+        self.wakeup.set()
+
+    async def run(self):
+        """发送循环：发送超时的慢消费者直接断开"""
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            payload, self.pending = self.pending, None
+            if payload is None:
+                continue
+            await asyncio.wait_for(self.websocket.send_text(payload), SEND_TIMEOUT)
+
+
+async def run_connection(subscriber: Subscriber, receive) -> bool:
+    """同时运行发送循环与接收协程，任一结束即停止另一个；返回是否因发送超时结束"""
+    sender = asyncio.create_task(subscriber.run())
+    receiver = asyncio.create_task(receive)
+    try:
+        await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (sender, receiver):
+            task.cancel()
+            task.add_done_callback(_retrieve_exception)
+    return sender.done() and not sender.cancelled() and isinstance(sender.exception(), asyncio.TimeoutError)
+
+
+def _retrieve_exception(task: asyncio.Task):
+    # 连接断开后另一端的异常（如向已关闭的连接发送）无需处理，只避免“未取回的异常”告警
+    if not task.cancelled():
+        task.exception()
+
+
+async def _wait_disconnect(websocket):
+    """客户端发来的消息一律忽略，只等待断开"""
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
+
+class _Channel:
+    """一个被订阅的榜单（分组 + 前 N 名）"""
+
+    def __init__(self, group: Optional[str], limit: int, entries: list[dict]):
+        self.group = group
+        self.limit = limit
+        self.entries = entries
+        self.version = 0
+        self.lock = threading.Lock()
+        self.loops = {}  # 事件循环 -> 该循环上的订阅者集合
+
+
+class LiveLeaderboard:
+    """
+    挂在统计表上的索引：排在 LeaderboardIndex 之后收到同一批新记录，
+    对有订阅者的榜单计算差异并投递到各事件循环。
+    """
+
+    def __init__(self, leaderboard):
+        self.leaderboard = leaderboard
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._sync_tasks = {}
+        self.pushes = 0
+        self.dropped = 0
+
+    def reset(self):
+        pass  # 榜单重建后记录对象都换了，下次变化时自然推送快照
+
+    def add_many(self, records: list[dict], positions: list[int]):
+        if not records or not self._channels:
+            return
+        with self._lock:
+            channels = list(self._channels.values())
+        for channel in channels:
+            self._refresh(channel)
+
+    def _refresh(self, channel: _Channel):
+        with channel.lock:
+            current = self.leaderboard.top(channel.limit, group=channel.group)
+            inserts = diff_inserts(channel.entries, current)
+            if inserts == []:
+                return
+            channel.version += 1
+            channel.entries = current
+            diff = None
+            if inserts is not None and len(inserts) <= max(1, channel.limit // 2):
+                diff = dump_json({
+                    "type": "diff", "version": channel.version, "size": len(current),
+                    "inserts": [{"rank": rank, "entry": entry} for rank, entry in inserts]
+                }).decode("utf-8")
+            message = LiveMessage(channel.version, {"entries": current}, diff)
+            for loop in list(channel.loops):
+                loop.call_soon_threadsafe(self._publish, channel, message)
+        self.pushes += 1
+
+    @staticmethod
+    def _publish(channel: _Channel, message: LiveMessage):
+        for subscriber in list(channel.loops.get(asyncio.get_running_loop(), ())):
+            subscriber.offer(message)
+
+    def subscribe(self, subscriber: Subscriber, group: Optional[str], limit: int) -> _Channel:
+        """在事件循环线程中调用：登记订阅并排入当前快照"""
+        key = (group, limit)
+        with self._lock:
+            channel = self._channels.get(key)
+            if channel is None:
+                channel = self._channels[key] = _Channel(group, limit, self.leaderboard.top(limit, group=group))
+        loop = asyncio.get_running_loop()
+        with channel.lock:
+            channel.loops.setdefault(loop, set()).add(subscriber)
+            subscriber.offer(LiveMessage(channel.version, {"entries": channel.entries}, None))
+        return channel
+
+    def unsubscribe(self, subscriber: Subscriber, channel: _Channel):
+        loop = asyncio.get_running_loop()
+        with self._lock, channel.lock:
+            subscribers = channel.loops.get(loop)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del channel.loops[loop]
+            if not channel.loops:
+                self._channels.pop((channel.group, channel.limit), None)
+
+    @property
+    def subscribers(self) -> int:
+        with self._lock:
+            return sum(len(s) for channel in self._channels.values() for s in channel.loops.values())
+
+    async def serve(self, websocket, group: Optional[str], limit: int, sync):
+        """处理一个已接受的 WebSocket 连接，直到客户端断开或因发送超时被断开"""
+        subscriber = Subscriber(websocket)
+        channel = self.subscribe(subscriber, group, limit)
+        self.ensure_sync(sync)
+        try:
+            timed_out = await run_connection(subscriber, _wait_disconnect(websocket))
+        finally:
+            self.unsubscribe(subscriber, channel)
+        if timed_out:
+            self.dropped += 1
+            await websocket.close(code=1013)
+
+    def ensure_sync(self, sync):
+        """有订阅者期间在当前事件循环上定时追读存储（每个循环一个任务）"""
+        loop = asyncio.get_running_loop()
+        task = self._sync_tasks.get(loop)
+        if task is None or task.done():
+            self._sync_tasks[loop] = loop.create_task(self._sync_loop(sync))
+
+    async def _sync_loop(self, sync):
+        loop = asyncio.get_running_loop()
+        while any(loop in channel.loops for channel in list(self._channels.values())):
+            await asyncio.sleep(SYNC_INTERVAL)
+            await sync()
+        self._sync_tasks.pop(loop, None)
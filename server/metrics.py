@@ -0,0 +1,232 @@
+"""
+运行指标（Prometheus 文本格式）
+
+- MetricsMiddleware: ASGI 中间件，记录各路由的请求数、延迟直方图、响应大小与进行中请求数
+- Counter / Gauge / Histogram: 每个线程写自己的分片，热路径上不加锁；
+  抓取 /metrics 时再把各线程分片汇总
+- 其他模块已有的计数（内容缓存、存储写入量、文件大小等）通过 add_collector 在抓取时读取
+
+多 worker 部署时每个进程各自统计，由 Prometheus 按实例汇总。
+"""
+
+import bisect
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+# 延迟直方图分桶（秒）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 响应大小直方图分桶（字节）
+SIZE_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """按线程分片的指标基类：每个线程只写自己的 dict，抓取时汇总"""
+
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()  # 只在线程首次写入时使用
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _snapshots(self) -> list[dict]:
+        with self._shards_lock:
+            shards = list(self._shards)
+        return [shard.copy() for shard in shards]
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def values(self) -> dict:
+        totals = {}
+        for shard in self._snapshots():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        for labels, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{format_labels(dict(zip(self.labelnames, labels)))} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """可增可减的计数（如进行中请求数），同样按线程分片后求和"""
+
+    kind = "gauge"
+
+    def dec(self, labels: tuple = (), amount: float = 1):
+        self.inc(labels, -amount)
+
+
+class Histogram(_Metric):
+    """预分桶直方图：每个标签组合一个 [各桶计数..., 总和, 次数] 列表"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, labels: tuple = ()):
+        shard = self._shard()
+        state = shard.get(labels)
+        if state is None:
+            state = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def values(self) -> dict:
+        totals = {}
+        for shard in self._snapshots():
+            for labels, state in shard.items():
+                state = list(state)
+                total = totals.get(labels)
+                if total is None:
+                    totals[labels] = state
+                else:
+                    for i, v in enumerate(state):
+                        total[i] += v
+        return totals
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        bounds = [_format_value(float(b)) for b in self.buckets] + ["+Inf"]
+        for labels, state in sorted(self.values().items()):
+            label_dict = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(bounds, state[:-2]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels({**label_dict, 'le': bound})} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(label_dict)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{format_labels(label_dict)} {state[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name: str, help_text: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[tuple[str, str, str, dict, float]]]):
+        """注册抓取时调用的采集函数，产出 (名称, 类型, 说明, 标签, 值)"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        # 同名样本必须连续输出，先按名称归并
+        families = {}
+        for collector in self._collectors:
+            for name, kind, help_text, labels, value in collector():
+                family = families.get(name)
+                if family is None:
+                    family = families[name] = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                family.append(f"{name}{format_labels(labels)} {_format_value(value)}")
+        for family in families.values():
+            lines.extend(family)
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """记录 HTTP 请求指标；路由标签取路由模板（如 /api/stats），避免按原始路径爆炸"""
+
+    def __init__(self, app, registry: MetricsRegistry):
+        self.app = app
+        self.requests = registry.counter(
+            "typequest_http_requests_total", "HTTP 请求数", ("method", "route", "status"))
+        self.latency = registry.histogram(
+            "typequest_http_request_duration_seconds", "HTTP 请求耗时（含响应体发送）", ("method", "route"))
+        self.response_size = registry.histogram(
+            "typequest_http_response_size_bytes", "HTTP 响应体大小", ("method", "route"), SIZE_BUCKETS)
+        self.in_flight = registry.gauge("typequest_http_requests_in_flight", "进行中的 HTTP 请求数")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        self.in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.in_flight.dec()
+            route = route_label(scope, status)
+            method = scope["method"]
+            self.requests.inc((method, route, str(status)))
+            self.latency.observe(elapsed, (method, route))
+            self.response_size.observe(size, (method, route))
+
+
+def route_label(scope, status: int) -> str:
+    route = scope.get("route")
+    path: Optional[str] = getattr(route, "path", None)
+    if path:
+        return path
+    # 根路径挂载的静态文件没有路由模板
+    return "static" if status < 400 else "unmatched"
@@ -0,0 +1,164 @@
+"""
+玩家索引
+
+统计记录可带 player_id（浏览器在本地存储中生成的匿名标识）。每张统计表挂一个 PlayerIndex，随写入增量维护：
+- 个人历史：按 (玩家, 分组) 分区的时间索引，时间范围与游标翻页同 HistoryIndex，O(log n)
+- 个人最佳：玩家在全局与各分组（模式 / 难度）上的最佳记录，新记录只与当前最佳比较，O(1)
+- 个人名次：每个榜单把各玩家的最佳分数记入分数值域上的树状数组，名次 = 1 + 最佳分数更高的玩家数；
+  更新最佳与查询名次都是 O(log 值域)，与玩家数无关，不需要排序
+
+分数按精度 resolution 取整后比较（精度内同分并列），高于 ceiling 的分数都计入最高档。
+"""
+
+import threading
+from typing import Callable, Optional
+
+from .analytics import finite
+from .history import _Series
+
+
+def _groups(record: dict, group_by: Optional[str]) -> list:
+    """记录所属的榜单：全局（None）与所在分组"""
+    if group_by is None or record.get(group_by) is None:
+        return [None]
+    return [None, record[group_by]]
+
+
+def personal_bests(records: list[dict], rank_key: str, group_by: Optional[str] = None) -> list[dict]:
+    """records 中各玩家在全局与各分组上的最佳记录（同分取先出现者），保持原顺序"""
+    bests = {}
+    for record in records:
+        player = record.get("player_id")
+        if not player:
+            continue
+        for group in _groups(record, group_by):
+            current = bests.get((player, group))
+            if current is None or finite(record.get(rank_key)) > finite(current.get(rank_key)):
+                bests[(player, group)] = record
+    members = {id(r) for r in bests.values()}
+    return [r for r in records if id(r) in members]
+
+
+class RankTree:
+    """分数值域上的树状数组（Fenwick tree）：每档记录最佳分数落在该档的玩家数"""
+
+    def __init__(self, resolution: float, ceiling: float, size: int = 1024):
+        self.resolution = resolution
+        self.top = int(round(ceiling / resolution))  # 最高档
+        self.total = 0
+        self._tree = [0] * (size + 1)  # size 为 2 的幂
+
+    def _slot(self, score: float) -> int:
+        return min(max(int(round(score / self.resolution)), 0), self.top)
+
+    def add(self, score: float, delta: int = 1):
+        i = self._slot(score) + 1
+        while i >= len(self._tree):
+            # 容量翻倍：新增节点只覆盖空档，其中末节点覆盖全部，值为总数
+            size = len(self._tree) - 1
+            self._tree.extend([0] * size)
+            self._tree[2 * size] = self.total
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+        self.total += delta
+
+    def count_above(self, score: float) -> int:
+        """分数（按档）严格高于 score 的玩家数"""
+        i = min(self._slot(score) + 1, len(self._tree) - 1)
+        at_most = 0
+        while i > 0:
+            at_most += self._tree[i]
+            i -= i & -i
+        return self.total - at_most
+
+
+class PlayerIndex:
+    """
+    按玩家的历史、个人最佳与名次。
+    seed 返回先于存储中全部记录的个人最佳（如已归档数据中的），建索引与重建时先计入。
+    """
+
+    def __init__(self, rank_key: str, group_by: Optional[str] = None, resolution: float = 1,
+                 ceiling: float = 1_000_000, seed: Optional[Callable[[], list[dict]]] = None):
+        self.rank_key = rank_key
+        self.group_by = group_by
+        self.resolution = resolution
+        self.ceiling = ceiling
+        self.seed = seed
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._series = {}  # (玩家, 分组或 None) -> _Series
+            self._bests = {}   # 玩家 -> {分组或 None: 最佳记录}
+            self._ranks = {}   # 分组或 None -> RankTree
+            self._last_end = 0
+            for record in self.seed() if self.seed else ():
+                if record.get("player_id"):
+                    self._update_bests(record["player_id"], record)
+
+    def add_many(self, records: list[dict], positions: list[int]):
+        with self._lock:
+            for record, end in zip(records, positions):
+                start, self._last_end = self._last_end, end
+                player = record.get("player_id")
+                if not player:
+                    continue
+                key = (str(record.get("timestamp") or ""), end)
+                for group in _groups(record, self.group_by):
+                    series = self._series.get((player, group))
+                    if series is None:
+                        series = self._series[(player, group)] = _Series()
+                    series.add(key, start)
+                self._update_bests(player, record)
+
+    def _update_bests(self, player: str, record: dict):
+        bests = self._bests.setdefault(player, {})
+        score = finite(record.get(self.rank_key))
+        for group in _groups(record, self.group_by):
+            current = bests.get(group)
+            if current is not None and score <= finite(current.get(self.rank_key)):
+                continue
+            tree = self._ranks.get(group)
+            if tree is None:
+                tree = self._ranks[group] = RankTree(self.resolution, self.ceiling)
+            if current is not None:
+                tree.add(finite(current.get(self.rank_key)), -1)
+            tree.add(score)
+            bests[group] = record
+
+    def __len__(self) -> int:
+        return len(self._bests)
+
+    def select(self, player: str, since: Optional[str] = None, until: Optional[str] = None,
+               group: Optional[str] = None, cursor: Optional[tuple[str, int]] = None,
+               limit: Optional[int] = None, descending: bool = False
+               ) -> tuple[list[tuple[int, int]], Optional[tuple[str, int]]]:
+        """该玩家的记录位置，参数与返回值同 HistoryIndex.select（只含热数据）"""
+        with self._lock:
+            series = self._series.get((player, group))
+            if series is None:
+                return [], None
+            return series.select(since, until, cursor, limit, descending)
+
+    def profile(self, player: str) -> Optional[dict]:
+        """
+        该玩家在全局与各分组上的最佳记录、名次（1 起，同分并列）与上榜玩家数；
+        没有该玩家的记录时返回 None
+        """
+        with self._lock:
+            bests = self._bests.get(player)
+            if bests is None:
+                return None
+            boards = {}
+            for group, record in bests.items():
+                tree = self._ranks[group]
+                boards[group] = {
+                    "best": record,
+                    "rank": tree.count_above(finite(record.get(self.rank_key))) + 1,
+                    "players": tree.total
+                }
+        overall = boards.pop(None)
+        return {**overall, "groups": dict(sorted(boards.items()))}
@@ -0,0 +1,288 @@
+"""
+按需请求剖析
+
+运行时通过管理接口为某个路由开启剖析，按比例抽样请求：
+- cprofile: 确定性剖析，输出 pstats（可用 snakeviz / pstats 打开）或文本摘要
+- sampling: 后台线程定时采样调用栈，开销更低，输出 collapsed stack（flamegraph.pl / speedscope）
+
+事件循环线程只在被抽中请求的协程执行期间计入（逐步驱动协程，每一步前后开关剖析），
+不会把同一时段其他并发请求的工作算进来；经 run_io 放到线程池中的工作同样被剖析
+（cprofile 在工作线程内单独计时后合并，sampling 在工作线程执行期间一并采样）。
+Python 3.12 起 cProfile 基于 sys.monitoring，同一时刻整个进程只能有一个剖析器且对所有线程生效，
+无法按线程拆分，cprofile 规则在这些版本上改用 sampling。最近的若干份结果保存在环形缓冲区中。
+
+未开启任何路由时，中间件只做一次字典判空，run_io 只多一次 ContextVar 读取。
+多 worker 部署时每个进程各自剖析、各自保存。
+"""
+
+import cProfile
+import contextvars
+import io
+import itertools
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import Optional
+
+from starlette.routing import Match
+
+PROFILE_MODES = ("cprofile", "sampling")
+
+# cProfile 是否按线程生效（3.12 起为进程级，见模块说明）
+CPROFILE_PER_THREAD = sys.version_info < (3, 12)
+
+# 当前请求的剖析会话（供 run_io 在工作线程中接续剖析）
+_current_session = contextvars.ContextVar("typequest_profile_session", default=None)
+
+
+def current_session() -> Optional["ProfileSession"]:
+    return _current_session.get()
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class _StackSampler(threading.Thread):
+    """定时读取指定线程的调用栈，累计 collapsed stack 计数"""
+
+    def __init__(self, interval: float):
+        super().__init__(name="typequest-profiler", daemon=True)
+        self.interval = interval
+        self.threads = set()
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            for ident in list(self.threads):
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                names = []
+                while frame is not None:
+                    names.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class _Stepped:
+    """逐步驱动协程：每一步执行前后调用 enter / leave，挂起期间（其他协程运行时）不计入"""
+
+    def __init__(self, coro, enter, leave):
+        self.coro = coro
+        self.enter = enter
+        self.leave = leave
+
+    def __await__(self):
+        value, error = None, None
+        while True:
+            self.enter()
+            try:
+                yielded = self.coro.throw(error) if error is not None else self.coro.send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.leave()
+            try:
+                value, error = (yield yielded), None
+            except BaseException as e:  # 取消等异常传回协程内处理
+                value, error = None, e
+
+
+class ProfileSession:
+    """一次被抽中的请求的剖析过程"""
+
+    def __init__(self, mode: str, interval: float):
+        self.mode = mode
+        self._profiles = []
+        self._sampler = _StackSampler(interval) if mode == "sampling" else None
+        self._loop_profile = None
+
+    def start(self):
+        if self._sampler is not None:
+            self._sampler.start()
+        else:
+            self._loop_profile = cProfile.Profile()
+            self._profiles.append(self._loop_profile)
+
+    def stop(self):
+        if self._sampler is not None:
+            self._sampler.stop()
+
+    def run(self, coro):
+        """在事件循环线程上剖析 coro：只计入它自己的执行步"""
+        if self._sampler is not None:
+            ident = threading.get_ident()
+            return _Stepped(coro, lambda: self._sampler.threads.add(ident),
+                            lambda: self._sampler.threads.discard(ident))
+        return _Stepped(coro, self._loop_profile.enable, self._loop_profile.disable)
+
+    def wrap(self, func):
+        """包装将在工作线程中执行的函数，使其同样被剖析"""
+        def run(*args, **kwargs):
+            if self._sampler is not None:
+                ident = threading.get_ident()
+                self._sampler.threads.add(ident)
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self._sampler.threads.discard(ident)
+            profile = cProfile.Profile()
+            self._profiles.append(profile)
+            return profile.runcall(func, *args, **kwargs)
+        return run
+
+    def result(self):
+        if self._sampler is not None:
+            return dict(self._sampler.stacks)
+        stats = pstats.Stats(self._profiles[0])
+        for profile in self._profiles[1:]:
+            stats.add(profile)
+        return stats
+
+
+class ProfileRecord:
+    def __init__(self, profile_id: int, method: str, route: str, mode: str,
+                 duration: float, status: int, data):
+        self.id = profile_id
+        self.method = method
+        self.route = route
+        self.mode = mode
+        self.duration = duration
+        self.status = status
+        self.data = data
+        self.created_at = datetime.now().isoformat()
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "route": self.route,
+            "mode": self.mode,
+            "status": self.status,
+            "duration_ms": round(self.duration * 1000, 3),
+            "created_at": self.created_at,
+            "formats": ["collapsed"] if self.mode == "sampling" else ["pstats", "text"],
+        }
+
+    def export(self, fmt: str) -> bytes:
+        """按格式导出；格式与剖析方式不匹配时抛出 ValueError"""
+        if self.mode == "sampling" and fmt == "collapsed":
+            return "".join(f"{stack} {count}\n" for stack, count in sorted(self.data.items())).encode("utf-8")
+        if self.mode == "cprofile" and fmt == "pstats":
+            return marshal.dumps(self.data.stats)
+        if self.mode == "cprofile" and fmt == "text":
+            out = io.StringIO()
+            stats = pstats.Stats(stream=out)
+            stats.add(self.data)
+            stats.sort_stats("cumulative").print_stats(50)
+            return out.getvalue().encode("utf-8")
+        raise ValueError(f"{self.mode} 剖析不支持 {fmt} 格式")
+
+
+class RequestProfiler:
+    """剖析规则与最近结果；routes 为应用的路由列表（用于按路由模板匹配请求）"""
+
+    def __init__(self, routes: list, capacity: int = 32):
+        self.routes = routes
+        self.rules = {}  # 路由模板 -> {"rate", "mode", "interval"}
+        self.profiles = deque(maxlen=capacity)
+        self.skipped = 0
+        self._ids = itertools.count(1)
+        # cProfile 在同一线程上不能嵌套，事件循环线程上同一时刻只剖析一个请求
+        self._busy = threading.Lock()
+
+    def configure(self, route: str, rate: float, mode: str = "sampling", interval_ms: float = 1.0):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"未知的剖析方式: {mode}")
+        if mode == "cprofile" and not CPROFILE_PER_THREAD:
+            mode = "sampling"
+        if rate <= 0:
+            self.rules.pop(route, None)
+        else:
+            self.rules[route] = {"rate": min(rate, 1.0), "mode": mode, "interval": interval_ms / 1000}
+
+    def disable(self):
+        self.rules.clear()
+
+    def get(self, profile_id: int) -> Optional[ProfileRecord]:
+        for record in self.profiles:
+            if record.id == profile_id:
+                return record
+        return None
+
+    def match(self, scope) -> Optional[tuple[str, dict]]:
+        for route in self.routes:
+            path = getattr(route, "path", None)
+            if path in self.rules:
+                match, _ = route.matches(scope)
+                if match == Match.FULL:
+                    return path, self.rules[path]
+        return None
+
+    def state(self) -> dict:
+        return {
+            "rules": {route: {"rate": r["rate"], "mode": r["mode"], "interval_ms": r["interval"] * 1000}
+                      for route, r in self.rules.items()},
+            "capacity": self.profiles.maxlen,
+            "skipped": self.skipped,
+            "profiles": [record.summary() for record in reversed(self.profiles)],
+        }
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, profiler: RequestProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        profiler = self.profiler
+        if not profiler.rules or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        matched = profiler.match(scope)
+        if matched is None or random.random() >= matched[1]["rate"]:
+            await self.app(scope, receive, send)
+            return
+        if not profiler._busy.acquire(blocking=False):
+            profiler.skipped += 1
+            await self.app(scope, receive, send)
+            return
+
+        route, rule = matched
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        session = ProfileSession(rule["mode"], rule["interval"])
+        token = _current_session.set(session)
+        started = time.perf_counter()
+        session.start()
+        try:
+            await session.run(self.app(scope, receive, send_wrapper))
+        finally:
+            session.stop()
+            duration = time.perf_counter() - started
+            _current_session.reset(token)
+            profiler._busy.release()
+            profiler.profiles.append(ProfileRecord(
+                next(profiler._ids), scope["method"], route, rule["mode"], duration, status, session.result()
+            ))
@@ -0,0 +1,296 @@
+"""
+多人竞速房间
+
+玩家通过 WebSocket 加入房间，只上报已正确输入的字符数；服务器在事件循环上以固定频率 tick，
+每个 tick 把本轮有变化的位置以差异形式广播给房间内所有人：
+
+    {"type": "joined", "slot": 2}                                         仅发给刚加入的玩家
+    {"type": "snapshot", "version": 5, "room": "r1", "state": "running", "text": "...", "players": [...]}
+    {"type": "tick", "version": 6, "elapsed_ms": 2150, "d": [[槽位, 进度], ...], "f": [[槽位, 名次, 用时毫秒], ...]}
+
+客户端上报 {"p": 进度, "e": 错误数}，房间等待中时发送 {"t": "start"} 开始倒计时（满员自动开始）。
+差异中的进度都是绝对值，丢弃或合并中间的 tick 不影响最终状态。
+
+- 每个事件循环一个 RaceEngine，单个 tick 任务驱动该循环上的所有房间，没有房间时任务退出
+- 每条广播只序列化一次；发送沿用 live.Subscriber：落后的玩家合并为最新快照，发送超时断开
+- 多实例部署时房间按 shard_for(room_id) 固定落在某个实例上（房间状态只在内存中）
+"""
+
+import asyncio
+import json
+import time
+import weakref
+import zlib
+from typing import Callable
+
+from .content_cache import dump_json
+from .live import LiveMessage, Subscriber, run_connection
+
+TICK_RATE = 20          # 每秒 tick 数
+ROOM_CAPACITY = 8       # 每个房间最多玩家数
+COUNTDOWN = 3.0         # 开始前倒计时（秒）
+TIME_LIMIT = 120.0      # 单场比赛时长上限（秒）
+FINISHED_LINGER = 10.0  # 比赛结束后房间保留时间（秒），供客户端展示结果
+
+
+def shard_for(room_id: str, shards: int) -> int:
+    """房间所在分片；同一房间在所有实例上算出的结果一致"""
+    return zlib.crc32(room_id.encode("utf-8")) % shards if shards > 1 else 0
+
+
+class RaceError(ValueError):
+    """无法加入房间（已满、已开始）"""
+
+
+class RacePlayer:
+    __slots__ = ("slot", "name", "subscriber", "progress", "errors", "rank", "time_ms", "left")
+
+    def __init__(self, slot: int, name: str, subscriber: Subscriber):
+        self.slot = slot
+        self.name = name
+        self.subscriber = subscriber
+        self.progress = 0
+        self.errors = 0
+        self.rank = None
+        self.time_ms = None
+        self.left = False
+
+    def summary(self) -> dict:
+        return {"slot": self.slot, "name": self.name, "progress": self.progress, "errors": self.errors,
+                "rank": self.rank, "time_ms": self.time_ms, "left": self.left}
+
+
+class RaceRoom:
+    """一个比赛房间；所有方法都在所属事件循环的线程中调用"""
+
+    def __init__(self, room_id: str, text: str, tick_rate: int = TICK_RATE, capacity: int = ROOM_CAPACITY,
+                 countdown: float = COUNTDOWN, time_limit: float = TIME_LIMIT):
+        self.id = room_id
+        self.text = text
+        self.tick_rate = tick_rate
+        self.capacity = capacity
+        self.countdown_ticks = round(countdown * tick_rate)
+        self.limit_ticks = round(time_limit * tick_rate)
+        self.state = "waiting"
+        self.players = {}
+        self.version = 0
+        self.closed = False
+        self._next_slot = 0
+        self._dirty = {}  # 本 tick 进度有变化的玩家（按上报顺序）
+        self._finished = 0
+        self._now = 0
+        self._start_tick = None
+        self._close_tick = None
+
+    @property
+    def active(self) -> list[RacePlayer]:
+        return [player for player in self.players.values() if not player.left]
+
+    def join(self, name: str, subscriber: Subscriber) -> RacePlayer:
+        if self.state != "waiting":
+            raise RaceError("比赛已结束" if self.state == "finished" else "比赛已开始")
+        if len(self.players) >= self.capacity:
+            raise RaceError("房间已满")
+        player = RacePlayer(self._next_slot, name, subscriber)
+        self._next_slot += 1
+        self.players[player.slot] = player
+        self._broadcast()
+        if len(self.players) >= self.capacity:
+            self.start()
+        return player
+
+    def leave(self, player: RacePlayer):
+        if self.state == "waiting":
+            self.players.pop(player.slot, None)
+        else:
+            # 比赛中离开的玩家保留在结果里
+            player.left = True
+            self._dirty.pop(player.slot, None)
+        self._broadcast()
+
+    def start(self):
+        if self.state == "waiting" and self.players:
+            self.state = "countdown"
+            self._start_tick = self._now + self.countdown_ticks
+            self._broadcast()
+
+    def report(self, player: RacePlayer, progress: int, errors: int = 0):
+        """记录玩家上报的进度（只增不减），在下一个 tick 广播"""
+        if self.state != "running" or player.rank is not None or player.left:
+            return
+        progress = min(max(progress, player.progress), len(self.text))
+        if progress != player.progress or errors != player.errors:
+            player.progress = progress
+            player.errors = max(errors, 0)
+            self._dirty[player.slot] = player
+
+    def tick(self, now: int):
+        self._now = now
+        if self.state == "waiting":
+            self.closed = not self.players
+        elif self.state == "countdown":
+            if now >= self._start_tick:
+                self.state = "running"
+                self._broadcast()
+        elif self.state == "running":
+            self._tick_running(now)
+        elif now >= self._close_tick or not self.active:
+            self.closed = True
+
+    def _tick_running(self, now: int):
+        elapsed_ms = self._elapsed_ms(now)
+        if self._dirty:
+            finished = []
+            for player in self._dirty.values():
+                if player.progress >= len(self.text):
+                    self._finished += 1
+                    player.rank = self._finished
+                    player.time_ms = elapsed_ms
+                    finished.append([player.slot, player.rank, player.time_ms])
+            moves = [[player.slot, player.progress] for player in self._dirty.values()]
+            self._dirty.clear()
+            self.version += 1
+            delta = {"type": "tick", "version": self.version, "elapsed_ms": elapsed_ms, "d": moves}
+            if finished:
+                delta["f"] = finished
+            self._publish(LiveMessage(self.version, self._state, dump_json(delta).decode("utf-8")))
+        active = self.active
+        if now - self._start_tick >= self.limit_ticks or all(player.rank is not None for player in active):
+            self.state = "finished"
+            self._close_tick = now + round(FINISHED_LINGER * self.tick_rate)
+            self._broadcast()
+
+    def _elapsed_ms(self, now: int) -> int:
+        return max(now - self._start_tick, 0) * 1000 // self.tick_rate
+
+    def _state(self) -> dict:
+        state = {"room": self.id, "state": self.state, "text": self.text, "tick_rate": self.tick_rate,
+                 "players": [player.summary() for player in self.players.values()]}
+        if self.state == "countdown":
+            state["starts_in_ms"] = (self._start_tick - self._now) * 1000 // self.tick_rate
+        elif self.state in ("running", "finished"):
+            state["elapsed_ms"] = self._elapsed_ms(self._now)
+        return state
+
+    def _broadcast(self):
+        """成员或状态变化：版本号加一，所有人收到快照"""
+        self.version += 1
+        self._publish(LiveMessage(self.version, self._state, None))
+
+    def _publish(self, message: LiveMessage):
+        for player in self.players.values():
+            if not player.left:
+                player.subscriber.offer(message)
+
+    def summary(self) -> dict:
+        return {"room": self.id, "state": self.state, "players": len(self.active), "capacity": self.capacity}
+
+
+class RaceEngine:
+    """一个事件循环上的全部房间与驱动它们的 tick 任务"""
+
+    def __init__(self, tick_rate: int = TICK_RATE, capacity: int = ROOM_CAPACITY,
+                 countdown: float = COUNTDOWN, time_limit: float = TIME_LIMIT):
+        self.tick_rate = tick_rate
+        self.capacity = capacity
+        self.countdown = countdown
+        self.time_limit = time_limit
+        self.rooms = {}
+        self.now = 0
+        self.ticks = 0
+        self.overruns = 0      # tick 处理超出间隔、被跳过的次数
+        self.busy_seconds = 0.0
+        self._task = None
+
+    def room(self, room_id: str, text: str) -> RaceRoom:
+        room = self.rooms.get(room_id)
+        if room is None or room.closed:
+            room = self.rooms[room_id] = RaceRoom(room_id, text, self.tick_rate, self.capacity,
+                                                  self.countdown, self.time_limit)
+        room._now = self.now
+        return room
+
+    @property
+    def players(self) -> int:
+        return sum(len(room.active) for room in self.rooms.values())
+
+    def ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.tick_rate
+        next_at = loop.time()
+        while self.rooms:
+            next_at += interval
+            delay = next_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                # 落后时不补发 tick，直接从当前时间重新对齐
+                self.overruns += 1
+                next_at = loop.time()
+                await asyncio.sleep(0)
+            started = time.perf_counter()
+            self.now += 1
+            self.ticks += 1
+            for room_id, room in list(self.rooms.items()):
+                room.tick(self.now)
+                if room.closed:
+                    del self.rooms[room_id]
+            self.busy_seconds += time.perf_counter() - started
+
+    async def serve(self, websocket, room_id: str, name: str, text: str):
+        """处理一个已接受的 WebSocket 连接，直到玩家断开"""
+        subscriber = Subscriber(websocket)
+        room = self.room(room_id, text)
+        try:
+            player = room.join(name, subscriber)
+        except RaceError as e:
+            await websocket.send_text(dump_json({"type": "error", "message": str(e)}).decode("utf-8"))
+            await websocket.close(code=1008)
+            return
+        self.ensure_running()
+        await websocket.send_text(dump_json({"type": "joined", "slot": player.slot}).decode("utf-8"))
+        try:
+            timed_out = await run_connection(subscriber, self._receive(websocket, room, player))
+        finally:
+            room.leave(player)
+        if timed_out:
+            await websocket.close(code=1013)
+
+    @staticmethod
+    async def _receive(websocket, room: RaceRoom, player: RacePlayer):
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            try:
+                data = json.loads(message.get("text") or message.get("bytes") or b"")
+                if "p" in data:
+                    room.report(player, int(data["p"]), int(data.get("e", 0)))
+                elif data.get("t") == "start":
+                    room.start()
+            except (ValueError, TypeError, AttributeError):
+                continue  # 格式错误的消息直接忽略
+
+    def stats(self) -> dict:
+        return {"rooms": len(self.rooms), "players": self.players, "ticks": self.ticks,
+                "overruns": self.overruns, "busy_seconds": self.busy_seconds}
+
+
+_engines = weakref.WeakKeyDictionary()
+
+
+def get_engine(factory: Callable[[], RaceEngine] = RaceEngine) -> RaceEngine:
+    """当前事件循环的引擎（房间与连接都绑定在创建它们的事件循环上）"""
+    loop = asyncio.get_running_loop()
+    engine = _engines.get(loop)
+    if engine is None:
+        engine = _engines[loop] = factory()
+    return engine
+
+
+def all_engines() -> list[RaceEngine]:
+    return list(_engines.values())
@@ -0,0 +1,425 @@
+"""
+植物防御难度平衡模拟
+
+按 js/defense-engine.js 的规则无界面地重放植物防御，由参数化的模拟打字者（WPM、错误率、反应时间）
+对局，批量统计各难度、各波次的胜率与得分分布，用于调整 data/config/defense.json
+（zombiesPerWave、zombieTypesByWave、spawnInterval、speedMultiplier）。
+
+规则（与前端一致）：
+- 僵尸从战场右侧出生，以 类型速度 × speedMultiplier 左移 640 像素到达植物，造成伤害后消失
+- 同一波内僵尸间隔 spawnInterval + [0, 1000) 毫秒依次出生；类型用 WaveSampler 的别名表抽样，
+  普通僵尸的单词与 /api/defense/wave 一样按类型从词库不放回抽取，Boss 依次打完 bossWordCombos 中的一组单词
+- 玩家锁定最近的僵尸，每个正确字母发射一颗子弹（飞行 0.4 秒，伤害 1），血量 = 单词长度；
+  错误按键不前进。目标死亡或到达植物后再选择最近的僵尸
+- 每波全部僵尸被击杀才算过关；前端不把到达植物的僵尸计入击杀，因此一旦有僵尸漏过，该波无法完成（记为「卡住」）。
+  forgiving=True 时改为漏过的僵尸也算结束，植物血量跨波次累计
+
+模拟按波次推进，同一难度、同一打字者的一批对局放在 NumPy 数组中逐步（每步一个目标单词）向量化计算；
+多批对局分发到进程池并行，结果（计数与固定分桶直方图）可直接合并。
+每批的随机源由 (种子, 难度, 打字者, 批序号) 派生，结果与进程数无关。
+
+用法:
+    python -m server.simulator                                  # 三个难度 × 默认打字者，每组 10 万局
+    python -m server.simulator --games 1000000 --wpm 20,40,60 --errors 0.02,0.1
+    python -m server.simulator --difficulty hard --waves --json balance.json
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from .analytics import FixedHistogram
+from .waves import WaveSampler
+from .word_index import WordIndex
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 为可选依赖，模拟器必须安装（pip install -e .[perf]）
+    np = None
+
+# 与 defense-engine.js 一致的常量
+PLANT_HEALTH = 100
+BULLET_FLIGHT_MS = 400
+SPAWN_JITTER_MS = 1000
+WALK_DISTANCE = 640  # 出生点（战场宽 800 - 80）到植物攻击线（30 + 50）的距离，像素
+
+DEFAULT_ZOMBIE_TYPES = {
+    "basic": {"speed": 30, "damage": 10, "points": 10},
+    "medium": {"speed": 22, "damage": 15, "points": 25},
+    "strong": {"speed": 15, "damage": 25, "points": 50},
+    "boss": {"speed": 18, "damage": 50, "points": 200, "isMultiPhase": True},
+}
+DEFAULT_SPAWN_INTERVAL = 2000
+SCORE_BUCKET = 5
+
+# 每批对局数：决定单个任务的数组大小（约 批大小 × 每波僵尸数 × 若干 float64）
+CHUNK_GAMES = 20000
+
+
+@dataclass(frozen=True)
+class Typist:
+    """模拟打字者：每局的 WPM 在 wpm 附近按对数正态分布（spread）浮动"""
+    wpm: float
+    error_rate: float = 0.05
+    reaction_ms: float = 300   # 切换目标（读新单词）的反应时间
+    spread: float = 0.15
+
+    @property
+    def label(self) -> str:
+        return f"{self.wpm:g}wpm/{self.error_rate:.0%}"
+
+
+class DefenseRules:
+    """由 defense.json 与防御词库编译出的模拟参数（可 pickle，分发给各进程）"""
+
+    def __init__(self, config: Optional[dict] = None, words: Optional[dict] = None, forgiving: bool = False):
+        config = config or {}
+        self.forgiving = forgiving
+        self.sampler = WaveSampler.from_config(config)
+        difficulty_config = config.get("difficulty") or {}
+        self.spawn = {name: (spec.get("spawnInterval", DEFAULT_SPAWN_INTERVAL), spec.get("speedMultiplier", 1.0))
+                      for name, spec in difficulty_config.items()}
+
+        zombie_types = {**DEFAULT_ZOMBIE_TYPES, **(config.get("zombieTypes") or {})}
+        self.type_names = list(zombie_types)
+        self.speed = np.array([zombie_types[t]["speed"] for t in self.type_names], dtype=np.float64) / 1000
+        self.damage = np.array([zombie_types[t]["damage"] for t in self.type_names], dtype=np.float64)
+        self.points = np.array([zombie_types[t]["points"] for t in self.type_names], dtype=np.int64)
+        self.multi_phase = np.array([bool(zombie_types[t].get("isMultiPhase")) for t in self.type_names])
+
+        # 普通僵尸：各类型可抽到的单词长度（与 WordDraw 相同的候选池，缺失类型退回 basic）
+        index = WordIndex(words or {})
+        self.word_lengths = []
+        for name in self.type_names:
+            pool = index.pool(name if name in index else "basic")
+            lengths = [index.lengths[i] for i in pool] or [4]  # 词库为空时 WordDraw 返回 "test"
+            self.word_lengths.append(np.array(lengths, dtype=np.int64))
+
+        # Boss：各组单词的长度（不足的阶段补 0）
+        combos = config.get("bossWordCombos") or [["boss"]]
+        self.phases = max(len(combo) for combo in combos)
+        self.combo_lengths = np.zeros((len(combos), self.phases), dtype=np.int64)
+        for i, combo in enumerate(combos):
+            self.combo_lengths[i, :len(combo)] = [len(word) for word in combo]
+        self.combo_phases = np.array([len(combo) for combo in combos], dtype=np.int64)
+
+    @classmethod
+    def load(cls, config_path: str = "data/config/defense.json", words_path: str = "data/content/defense_words.json",
+             forgiving: bool = False) -> "DefenseRules":
+        with open(config_path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        with open(words_path, "r", encoding="utf-8") as f:
+            words = json.load(f)
+        return cls(config, words, forgiving)
+
+    def spawn_settings(self, difficulty: str) -> tuple[float, float]:
+        return self.spawn.get(difficulty, (DEFAULT_SPAWN_INTERVAL, 1.0))
+
+    def max_points(self) -> int:
+        """单只僵尸的最高得分（Boss 为各阶段得分之和的上限）"""
+        return int(self.points.max())
+
+    def max_wave_score(self, difficulty: str, wave: int) -> int:
+        return self.sampler.wave_plan(difficulty, wave)[0] * self.max_points()
+
+
+class BalanceResult:
+    """一个 (难度, 打字者) 组合的统计：可合并的计数与得分直方图"""
+
+    def __init__(self, rules: DefenseRules, difficulty: str, typist: Typist):
+        self.difficulty = difficulty
+        self.typist = typist
+        self.games = 0
+        self.victories = 0
+        waves = rules.sampler.total_waves(difficulty)
+        total = sum(rules.max_wave_score(difficulty, w) for w in range(1, waves + 1))
+        self.score = FixedHistogram(0, total, SCORE_BUCKET)
+        self.waves = [{"reached": 0, "cleared": 0, "died": 0, "stalled": 0, "leaks": 0} for _ in range(waves)]
+        self.wave_scores = [FixedHistogram(0, rules.max_wave_score(difficulty, w), SCORE_BUCKET)
+                            for w in range(1, waves + 1)]
+
+    def merge(self, other: "BalanceResult"):
+        self.games += other.games
+        self.victories += other.victories
+        self.score.merge(other.score)
+        for mine, theirs in zip(self.waves, other.waves):
+            for key, value in theirs.items():
+                mine[key] += value
+        for mine, theirs in zip(self.wave_scores, other.wave_scores):
+            mine.merge(theirs)
+
+    def summary(self) -> dict:
+        def distribution(hist: FixedHistogram) -> dict:
+            if not hist.total:
+                return {}
+            return {f"p{int(q * 100)}": round(hist.quantile(q), 1) for q in (0.1, 0.5, 0.9)}
+
+        return {
+            "difficulty": self.difficulty,
+            "typist": asdict(self.typist),
+            "games": self.games,
+            "victory_rate": self.victories / self.games * 100 if self.games else None,
+            "score": distribution(self.score),
+            "waves": [{
+                "wave": i + 1,
+                **wave,
+                "clear_rate": wave["cleared"] / wave["reached"] * 100 if wave["reached"] else None,
+                "score": distribution(hist),
+            } for i, (wave, hist) in enumerate(zip(self.waves, self.wave_scores))],
+        }
+
+
+def _add_histogram(hist: FixedHistogram, values):
+    buckets = np.clip((values - hist.low) // hist.bucket_width, 0, len(hist.counts) - 1).astype(np.int64)
+    counts = np.bincount(buckets, minlength=len(hist.counts))
+    hist.counts = (np.asarray(hist.counts, dtype=np.int64) + counts).tolist()
+    hist.total += len(values)
+
+
+def _distinct_draws(gen, games: int, population: int, k: int):
+    """
+    每局从 [0, population) 不放回抽 k 个（k <= population），顺序随机，形状 (局数, k)。
+    逐列按 Floyd 算法抽取均匀子集再随机排列：O(局数 × k²)，与候选池大小无关
+    """
+    chosen = np.empty((games, k), dtype=np.int64)
+    for i, j in enumerate(range(population - k, population)):
+        t = gen.integers(0, j + 1, size=games)
+        taken = (chosen[:, :i] == t[:, None]).any(axis=1)
+        chosen[:, i] = np.where(taken, j, t)
+    order = np.argsort(gen.random((games, k)), axis=1)
+    return np.take_along_axis(chosen, order, axis=1)
+
+
+def _spawn_wave(rules: DefenseRules, difficulty: str, wave: int, games: int, gen):
+    """抽样一波：出生时间、到达时间、各阶段单词长度、每阶段得分与伤害，形状 (局数, 僵尸数[, 阶段])"""
+    count, table = rules.sampler.wave_plan(difficulty, wave)
+    interval, multiplier = rules.spawn_settings(difficulty)
+    type_ids = np.array([rules.type_names.index(name) if name in rules.type_names else 0 for name in table.outcomes])
+    types = type_ids[table.draw_indices(games * count, random.Random(int(gen.integers(2 ** 63))))]
+    types = types.reshape(games, count)
+
+    gaps = interval + gen.random((games, count)) * SPAWN_JITTER_MS
+    gaps[:, 0] = 0
+    spawn = np.cumsum(gaps, axis=1)
+    speed = rules.speed[types] * multiplier
+    arrival = spawn + WALK_DISTANCE / speed
+
+    lengths = np.zeros((games, count, rules.phases), dtype=np.int64)
+    points = rules.points[types].copy()
+    phases = np.ones((games, count), dtype=np.int64)
+    for type_id, pool in enumerate(rules.word_lengths):
+        if rules.multi_phase[type_id]:
+            continue
+        mask = types == type_id
+        if not mask.any():
+            continue
+        # 同一波内同类型不放回抽取：每局只抽本波该类型僵尸数个不同的候选，第 k 只取第 k 个（抽空后循环）
+        k = np.cumsum(mask, axis=1) - 1
+        drawn = min(int(k.max()) + 1, len(pool))
+        order = _distinct_draws(gen, games, len(pool), drawn)
+        picks = np.take_along_axis(order, k % drawn, axis=1)
+        lengths[:, :, 0] = np.where(mask, pool[picks], lengths[:, :, 0])
+    boss = rules.multi_phase[types]
+    if boss.any():
+        combo = gen.integers(0, len(rules.combo_lengths), size=(games, count))
+        lengths[boss] = rules.combo_lengths[combo[boss]]
+        phases[boss] = rules.combo_phases[combo[boss]]
+        points[boss] //= phases[boss]  # 每阶段得分，与前端的 Math.floor(points / 阶段数) 一致
+    return spawn, speed, arrival, lengths, phases, points, rules.damage[types]
+
+
+def simulate(rules: DefenseRules, difficulty: str, typist: Typist, games: int, seed) -> BalanceResult:
+    """模拟一批对局（单进程内向量化）"""
+    if np is None:
+        raise RuntimeError("平衡模拟需要 NumPy（pip install -e .[perf]）")
+    gen = np.random.default_rng(seed)
+    result = BalanceResult(rules, difficulty, typist)
+    result.games = games
+    key_ms = 12000 / (typist.wpm * np.exp(gen.normal(0, typist.spread, games)))  # 每次按键的毫秒数
+    health = np.full(games, float(PLANT_HEALTH))
+    score = np.zeros(games, dtype=np.int64)
+    alive = np.arange(games)  # 仍在进行的对局
+
+    for wave in range(1, rules.sampler.total_waves(difficulty) + 1):
+        n = len(alive)
+        if not n:
+            break
+        stats = result.waves[wave - 1]
+        stats["reached"] += n
+        spawn, speed, arrival, lengths, phases, points, damage = _spawn_wave(rules, difficulty, wave, n, gen)
+        zombies = spawn.shape[1]
+        phase = np.zeros((n, zombies), dtype=np.int64)
+        killed = np.zeros((n, zombies), dtype=bool)
+        phase_time = np.full((n, zombies, rules.phases), np.inf)
+        t = np.zeros(n)
+        forced = np.full(n, -1)  # Boss 进入下一阶段后强制保持目标
+        key = key_ms[alive]
+        working = np.arange(n)
+
+        while len(working):
+            now = t[working][:, None]
+            candidate = (spawn[working] <= now) & ~killed[working] & (arrival[working] > now)
+            has_target = candidate.any(axis=1)
+
+            # 没有可打的僵尸：跳到下一只出生，没有则本波结束
+            idle = working[~has_target]
+            if len(idle):
+                pending = np.where((spawn[idle] > t[idle][:, None]) & ~killed[idle], spawn[idle], np.inf).min(axis=1)
+                t[idle] = pending
+                forced[idle] = -1
+                working = np.concatenate([working[has_target], idle[np.isfinite(pending)]])
+                if not has_target.any():
+                    continue
+                candidate = candidate[has_target]
+                now = now[has_target]
+            rows = working[:len(candidate)]
+
+            # 最近的僵尸 = 走得最远的（x = 出生点 - 速度 × 已走时间）
+            walked = np.where(candidate, speed[rows] * (now - spawn[rows]), -np.inf)
+            target = walked.argmax(axis=1)
+            keep = forced[rows]
+            keep_ok = keep >= 0
+            keep_ok[keep_ok] = candidate[np.flatnonzero(keep_ok), keep[keep_ok]]
+            target = np.where(keep_ok, keep, target)
+
+            current = phase[rows, target]
+            word = lengths[rows, target, current]
+            errors = gen.negative_binomial(word, 1 - typist.error_rate) if typist.error_rate > 0 else 0
+            done = t[rows] + typist.reaction_ms + (word + errors) * key[rows] + BULLET_FLIGHT_MS
+            hit = done < arrival[rows, target]
+
+            # 打完：记下该阶段的得分时间，Boss 还有阶段时保持目标
+            r, z, p = rows[hit], target[hit], current[hit]
+            phase_time[r, z, p] = done[hit]
+            more = p + 1 < phases[r, z]
+            phase[r[more], z[more]] += 1
+            killed[r[~more], z[~more]] = True
+            forced[r] = np.where(more, z, -1)
+            # 没打完目标就到达植物：进度作废，到达时重新选目标
+            miss = rows[~hit]
+            forced[miss] = -1
+            t[rows] = np.where(hit, done, arrival[rows, target])
+
+        # 漏过的僵尸按到达时间依次造成伤害，血量归零的时刻为失败时刻
+        leaked = ~killed
+        leak_time = np.where(leaked, arrival, np.inf)
+        order = np.argsort(leak_time, axis=1)
+        hits = np.cumsum(np.take_along_axis(np.where(leaked, damage, 0), order, axis=1), axis=1)
+        dead = hits >= health[alive][:, None]
+        died = dead.any(axis=1)
+        death_time = np.where(died, np.take_along_axis(leak_time, order, axis=1)[np.arange(n), dead.argmax(axis=1)],
+                              np.inf)
+        wave_score = (points[:, :, None] * (phase_time < death_time[:, None, None])).sum(axis=(1, 2))
+        score[alive] += wave_score
+        _add_histogram(result.wave_scores[wave - 1], wave_score)
+
+        leaks = leaked.sum(axis=1)
+        stalled = ~died & (leaks > 0) & (not rules.forgiving)
+        cleared = ~died & ~stalled
+        stats["leaks"] += int(leaks.sum())
+        stats["died"] += int(died.sum())
+        stats["stalled"] += int(stalled.sum())
+        stats["cleared"] += int(cleared.sum())
+        health[alive] -= np.where(cleared, hits[:, -1], 0)
+        alive = alive[cleared]
+
+    result.victories = len(alive)
+    _add_histogram(result.score, score)
+    return result
+
+
+def sweep(rules: DefenseRules, difficulties: list[str], typists: list[Typist], games: int,
+          workers: Optional[int] = None, seed: int = 0, chunk: int = CHUNK_GAMES) -> list[BalanceResult]:
+    """每个 (难度, 打字者) 模拟 games 局，按 chunk 分批分发到进程池，返回合并后的结果"""
+    tasks, seeds = [], []
+    for difficulty in difficulties:
+        for typist in typists:
+            for start in range(0, games, chunk):
+                tasks.append((difficulty, typist, min(chunk, games - start)))
+                # 随机源只取决于 (种子, 难度, 打字者, 批序号)，与同时模拟的其他组合无关
+                seeds.append(np.random.SeedSequence([seed, zlib.crc32(f"{difficulty}:{typist}".encode()), start]))
+    merged = {}
+    if workers == 1:
+        parts = (simulate(rules, d, t, g, s) for (d, t, g), s in zip(tasks, seeds))
+        for part in parts:
+            _merge_into(merged, rules, part)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(simulate, rules, d, t, g, s) for (d, t, g), s in zip(tasks, seeds)]
+            for future in futures:
+                _merge_into(merged, rules, future.result())
+    return list(merged.values())
+
+
+def _merge_into(merged: dict, rules: DefenseRules, part: BalanceResult):
+    key = (part.difficulty, part.typist)
+    if key not in merged:
+        merged[key] = BalanceResult(rules, part.difficulty, part.typist)
+    merged[key].merge(part)
+
+
+def _format(results: list[BalanceResult], show_waves: bool) -> str:
+    lines = []
+    for difficulty in dict.fromkeys(r.difficulty for r in results):
+        lines.append(f"\n== {difficulty} ==")
+        lines.append(f"{'打字者':<16}{'胜率':>8}{'得分 p10':>10}{'p50':>8}{'p90':>8}")
+        for result in (r for r in results if r.difficulty == difficulty):
+            s = result.summary()
+            score = s["score"]
+            lines.append(f"{result.typist.label:<16}{s['victory_rate']:>7.1f}%"
+                         f"{score.get('p10', 0):>10.0f}{score.get('p50', 0):>8.0f}{score.get('p90', 0):>8.0f}")
+            if show_waves:
+                for w in s["waves"]:
+                    if not w["reached"]:
+                        break
+                    lines.append(f"    第 {w['wave']:>2} 波  到达 {w['reached']:>9}  过关 {w['clear_rate']:>5.1f}%"
+                                 f"  卡住 {w['stalled']:>8}  失败 {w['died']:>8}  本波得分 p50 {w['score'].get('p50', 0):>6.0f}")
+    return "\n".join(lines)
+
+
+def _floats(text: str) -> list[float]:
+    return [float(v) for v in text.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="植物防御难度平衡模拟")
+    parser.add_argument("--config", default="data/config/defense.json", help="防御模式配置")
+    parser.add_argument("--words", default="data/content/defense_words.json", help="防御词库")
+    parser.add_argument("--difficulty", default=None, help="难度（逗号分隔，默认配置中的全部难度）")
+    parser.add_argument("--wpm", default="20,30,40,60,80", help="打字者 WPM（逗号分隔）")
+    parser.add_argument("--errors", default="0.05", help="错误率（逗号分隔，0~1）")
+    parser.add_argument("--reaction", type=float, default=300, help="切换目标的反应时间（毫秒）")
+    parser.add_argument("--spread", type=float, default=0.15, help="每局 WPM 的对数正态离散度")
+    parser.add_argument("--games", type=int, default=100000, help="每个 难度 × 打字者 的对局数")
+    parser.add_argument("--workers", type=int, default=None, help="进程数（默认 CPU 核数）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--forgiving", action="store_true", help="漏过的僵尸也算本波结束（前端目前会卡住）")
+    parser.add_argument("--waves", action="store_true", help="输出逐波统计")
+    parser.add_argument("--json", help="把完整结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    if np is None:
+        parser.error("平衡模拟需要 NumPy（pip install -e .[perf]）")
+    rules = DefenseRules.load(args.config, args.words, args.forgiving)
+    difficulties = args.difficulty.split(",") if args.difficulty else list(rules.sampler.difficulties)
+    typists = [Typist(wpm, error, args.reaction, args.spread) for wpm in _floats(args.wpm) for error in _floats(args.errors)]
+
+    started = time.perf_counter()
+    results = sweep(rules, difficulties, typists, args.games, args.workers, args.seed)
+    elapsed = time.perf_counter() - started
+    total = args.games * len(difficulties) * len(typists)
+    print(_format(results, args.waves))
+    print(f"\n✅ 模拟 {total} 局，用时 {elapsed:.1f} 秒（{total / elapsed:,.0f} 局/秒，{args.workers or os.cpu_count()} 个进程）")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump([r.summary() for r in results], f, ensure_ascii=False, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,513 @@
+"""
+统计数据存储引擎
+
+可插拔的追加式存储后端：
+- jsonl: 每条记录一行 JSON，追加写入
+- sqlite: SQLite WAL 模式，每次插入一个事务
+
+两种后端的插入成本都是 O(1)，不再随历史记录增长。
+每条记录都有一个单调递增的“位置”（jsonl 为字节偏移，sqlite 为行号），
+索引可以据此记录检查点，重启后只回放检查点之后的数据。
+
+多进程部署时，所有写入都在跨进程锁（jsonl 为 flock，sqlite 为写事务）内进行，
+写入前先追读其他进程写入的新记录；读取前调用 sync() 追读，
+从而各进程的内存索引都按同一顺序看到同一份数据。
+
+存储被压缩（删除已归档的记录）后位置不再有效：每个存储有一个“代号”
+（jsonl 为数据文件的 inode，sqlite 为 user_version），追读时发现代号变化
+或文件变短，就通知各索引清空并从头重建。
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows：只保证单进程内安全
+    fcntl = None
+
+logger = logging.getLogger("typequest.storage")
+
+
+def decode_record(data):
+    """解析一条记录：旧数据中的 NaN / Infinity 读作 null，不影响索引与 JSON 响应"""
+    return json.loads(data, parse_constant=lambda constant: None)
+
+
+class StatsStore:
+    """统计存储后端基类"""
+
+    suffix = ""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.position = 0  # 最近一次写入/读取后的末尾位置
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._reset_listeners = []
+        self._process_lock_owner = None
+        self.generation = 0  # 当前位置所属的存储代号
+        # 本进程的写入计数（在写锁内累加）
+        self.writes = 0
+        self.records_written = 0
+        self.bytes_written = 0
+
+    def add_listener(self, callback):
+        """注册写入回调：每次成功写入后以 (新记录列表, 各记录之后的位置) 调用（在写锁内，保证顺序一致）"""
+        self._listeners.append(callback)
+
+    def add_reset_listener(self, callback):
+        """注册重建回调：存储被其他进程（或本进程）压缩重写后、从头回放之前调用"""
+        self._reset_listeners.append(callback)
+
+    def _notify(self, records: list[dict], positions: list[int]):
+        for callback in self._listeners:
+            callback(records, positions)
+
+    def _read_generation(self) -> int:
+        raise NotImplementedError
+
+    def _replaced(self) -> bool:
+        return self._read_generation() != self.generation
+
+    def _reset(self):
+        """存储已被重写：等进行中的压缩结束后，从位置 0 起重建；调用方需持有 _lock"""
+        with self.process_lock():
+            self.generation = self._read_generation()
+            self.position = 0
+            for callback in self._reset_listeners:
+                callback()
+
+    @contextmanager
+    def process_lock(self):
+        """跨进程互斥锁（锁文件 + flock），同一线程内可重入"""
+        if fcntl is None or self._process_lock_owner == threading.get_ident():
+            yield
+            return
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            self._process_lock_owner = threading.get_ident()
+            yield
+        finally:
+            self._process_lock_owner = None
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _tail(self):
+        """追读 position 之后（其他进程写入）的新记录并通知监听者；调用方需持有 _lock"""
+        if self._replaced():
+            self._reset()
+        if self.end_position() <= self.position:
+            return
+        records, positions = [], []
+        for position, record in self.iter_entries(self.position):
+            records.append(record)
+            positions.append(position)
+        if records:
+            self.position = positions[-1]
+            self._notify(records, positions)
+
+    def sync(self):
+        """让内存索引追上其他进程的写入；没有新数据时只需一次 stat / 主键查询"""
+        with self._lock:
+            self._tail()
+
+    @contextmanager
+    def exclusive(self):
+        """持有本进程写锁与跨进程锁，期间其他写入者等待；进入与退出时各追读一次"""
+        with self._lock, self.process_lock():
+            self._tail()
+            yield
+            self._tail()
+
+    def remove_entries(self, positions: set[int]):
+        """删除指定位置的记录并更换存储代号（用于压缩）；调用方需在 exclusive() 内"""
+        raise NotImplementedError
+
+    def append(self, record: dict) -> dict:
+        self.append_many([record])
+        return record
+
+    def append_many(self, records: list[dict], dedupe=None) -> list[dict]:
+        """
+        批量追加（一次写入 / 一个事务），返回实际写入的记录。
+        dedupe(records) -> 需要写入的子集：在持有跨进程锁并追读其他进程的写入后调用，
+        因此据此做的去重检查与写入是原子的。
+        """
+        raise NotImplementedError
+
+    def iter_entries(self, start: int = 0) -> Iterator[tuple[int, dict]]:
+        """从 start 位置开始遍历，产出 (该记录之后的位置, 记录)"""
+        raise NotImplementedError
+
+    def end_position(self) -> int:
+        raise NotImplementedError
+
+    def size_bytes(self) -> int:
+        """存储文件占用的字节数"""
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def read_spans(self, spans: list[tuple[int, int]]) -> list[dict]:
+        """按 (起始位置, 末尾位置) 批量随机读取记录"""
+        raise NotImplementedError
+
+    def _count_write(self, records: int, size: int):
+        self.writes += 1
+        self.records_written += records
+        self.bytes_written += size
+
+    def iter_records(self) -> Iterator[dict]:
+        for _, record in self.iter_entries():
+            yield record
+
+    def load_all(self) -> list[dict]:
+        return list(self.iter_records())
+
+    def is_empty(self) -> bool:
+        return next(self.iter_entries(), None) is None
+
+    def close(self):
+        pass
+
+
+class JsonlStatsStore(StatsStore):
+    """JSON Lines 追加存储：一次插入 = 一次 O_APPEND 写"""
+
+    suffix = ".jsonl"
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.generation = self._read_generation()
+
+    def _read_generation(self) -> int:
+        try:
+            return os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return 0
+
+    def _replaced(self) -> bool:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return self.position > 0
+        if not self.generation and not self.position:
+            self.generation = st.st_ino  # 文件由其他进程首次创建
+            return False
+        return st.st_ino != self.generation or st.st_size < self.position
+
+    def remove_entries(self, positions: set[int]):
+        tmp_path = f"{self.path}.{os.getpid()}.compact"
+        with open(self.path, "rb") as src, open(tmp_path, "wb") as dst:
+            position = 0
+            for line in src:
+                if not line.endswith(b"\n"):
+                    break
+                position += len(line)
+                if position not in positions:
+                    dst.write(line)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, self.path)
+
+    def append_many(self, records: list[dict], dedupe=None) -> list[dict]:
+        if not records:
+            return records
+        with self._lock, self.process_lock():
+            self._tail()
+            if dedupe is not None:
+                records = dedupe(records)
+                if not records:
+                    return records
+            lines = [
+                (json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+                for r in records
+            ]
+            payload = b"".join(lines)
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                size = os.fstat(fd).st_size
+                if size > self.position:
+                    # 上次写入中途崩溃留下的半行（_tail 已读完全部整行）：截掉，否则新记录会接在它后面
+                    logger.warning("%s 末尾有 %d 字节不完整的记录，已截断", self.path, size - self.position)
+                    os.ftruncate(fd, self.position)
+                os.write(fd, payload)
+                self.position = os.lseek(fd, 0, os.SEEK_CUR)
+                self.generation = os.fstat(fd).st_ino
+            finally:
+                os.close(fd)
+            self._count_write(len(records), len(payload))
+            positions = []
+            position = self.position - len(payload)
+            for line in lines:
+                position += len(line)
+                positions.append(position)
+            self._notify(records, positions)
+        return records
+
+    def iter_entries(self, start: int = 0) -> Iterator[tuple[int, dict]]:
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(start)
+            position = start
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # 尚未写完的半行
+                position += len(line)
+                line = line.strip()
+                if line:
+                    yield position, decode_record(line)
+
+    def end_position(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def read_spans(self, spans: list[tuple[int, int]]) -> list[dict]:
+        if not spans:
+            return []
+        records = []
+        with open(self.path, "rb") as f:
+            for start, end in spans:
+                f.seek(start)
+                records.append(decode_record(f.read(end - start)))
+        return records
+
+
+class SqliteStatsStore(StatsStore):
+    """SQLite 存储：WAL 模式，读写互不阻塞"""
+
+    suffix = ".sqlite3"
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS records (id INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT NOT NULL)"
+        )
+        self.generation = self._read_generation()
+
+    def _read_generation(self) -> int:
+        with self._conn_lock:
+            (version,) = self._conn.execute("PRAGMA user_version").fetchone()
+        return version
+
+    def remove_entries(self, positions: set[int]):
+        with self._conn_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                (version,) = self._conn.execute("PRAGMA user_version").fetchone()
+                self._conn.executemany("DELETE FROM records WHERE id = ?", [(p - 1,) for p in positions])
+                self._conn.execute(f"PRAGMA user_version = {version + 1}")
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def append_many(self, records: list[dict], dedupe=None) -> list[dict]:
+        if not records:
+            return records
+        with self._lock, self._conn_lock:
+            # BEGIN IMMEDIATE 即跨进程写锁；先取出其他进程在本进程上次同步后写入的记录
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                (version,) = self._conn.execute("PRAGMA user_version").fetchone()
+                if version != self.generation:
+                    # 其他进程压缩过：等它写完归档与汇总后从头重建
+                    with self.process_lock():
+                        self.generation = version
+                        self.position = 0
+                        for callback in self._reset_listeners:
+                            callback()
+                missed = self._conn.execute(
+                    "SELECT id, data FROM records WHERE id >= ? ORDER BY id", (self.position,)
+                ).fetchall()
+                if missed:
+                    # 这些记录已由其他进程提交，先通知索引，dedupe 才能看到它们
+                    self.position = missed[-1][0] + 1
+                    self._notify([decode_record(data) for _, data in missed], [row_id + 1 for row_id, _ in missed])
+                if dedupe is not None:
+                    records = dedupe(records)
+                if not records:
+                    self._conn.execute("COMMIT")
+                    return records
+                rows = [(json.dumps(r, ensure_ascii=False),) for r in records]
+                self._conn.executemany("INSERT INTO records (data) VALUES (?)", rows)
+                (last_id,) = self._conn.execute("SELECT max(id) FROM records").fetchone()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._count_write(len(rows), sum(len(data) for data, in rows))
+            # 写事务内自增 id 连续
+            self.position = last_id + 1
+            self._notify(records, list(range(last_id - len(records) + 2, last_id + 2)))
+        return records
+
+    def iter_entries(self, start: int = 0) -> Iterator[tuple[int, dict]]:
+        # 调用方可能已持有 _lock（如 _tail），连接本身另用 _conn_lock 串行化
+        with self._conn_lock:
+            rows = self._conn.execute(
+                "SELECT id, data FROM records WHERE id >= ? ORDER BY id", (start,)
+            ).fetchall()
+        for row_id, data in rows:
+            yield row_id + 1, decode_record(data)
+
+    def end_position(self) -> int:
+        with self._conn_lock:
+            (last_id,) = self._conn.execute("SELECT max(id) FROM records").fetchone()
+        return (last_id or 0) + 1
+
+    def read_spans(self, spans: list[tuple[int, int]]) -> list[dict]:
+        # 位置 = id + 1
+        ids = [end - 1 for _, end in spans]
+        found = {}
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            with self._conn_lock:
+                rows = self._conn.execute(
+                    f"SELECT id, data FROM records WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+            found.update(rows)
+        return [decode_record(found[i]) for i in ids if i in found]
+
+    def size_bytes(self) -> int:
+        # WAL 模式下尚未检查点的数据在 -wal 文件中
+        try:
+            wal = os.path.getsize(self.path + "-wal")
+        except FileNotFoundError:
+            wal = 0
+        return super().size_bytes() + wal
+
+    def close(self):
+        self._conn.close()
+
+
+class StatsTable:
+    """
+    一张统计表：存储 + 挂在其上的内存索引。
+
+    索引需提供 add_many(records, positions)，positions 为各记录之后的存储位置，
+    以及 reset()（存储被压缩重写后清空，随后从头回放）。
+    带检查点的索引另外提供
+    position、generation 属性（已覆盖到的存储位置及其所属的存储代号）与 flush()。
+    打开时按各索引的起点回放一次存储，之后随写入增量更新。
+    """
+
+    def __init__(self, store: StatsStore, indexes: dict):
+        self.store = store
+        self.indexes = indexes
+        self._checkpointed = [index for index in indexes.values() if hasattr(index, "generation")]
+        end = store.end_position()
+        starts = {}
+        for name, index in indexes.items():
+            start = getattr(index, "position", 0)
+            generation = getattr(index, "generation", None)
+            # 检查点比数据还新，或数据在检查点之后被压缩重写过：从头重建
+            if start > end or (generation and generation != store.generation):
+                index.reset()
+                start = 0
+            starts[name] = start
+        pending = {name: ([], []) for name in indexes}
+        position = min(starts.values(), default=end)
+        for position, record in store.iter_entries(position):
+            for name, start in starts.items():
+                if position > start:
+                    pending[name][0].append(record)
+                    pending[name][1].append(position)
+        store.position = max(position, *starts.values()) if starts else position
+        for name, index in indexes.items():
+            index.add_many(*pending[name])
+        self._stamp_generation()
+        store.add_listener(self._on_append)
+        store.add_reset_listener(self._on_reset)
+
+    def _stamp_generation(self):
+        for index in self._checkpointed:
+            index.generation = self.store.generation
+
+    def sync(self):
+        self.store.sync()
+
+    def append_many(self, records: list[dict], prepare=None) -> list[dict]:
+        """
+        批量写入；表上有幂等索引时跳过已写入过的幂等键，返回实际写入的记录。
+        prepare(records) -> 实际写入的记录：与去重一样在存储的写锁内调用，可用于写入与记录配套的附属数据
+        """
+        idempotency = self.indexes.get("idempotency")
+        if prepare is None:
+            return self.store.append_many(records, idempotency.filter_new if idempotency else None)
+
+        def dedupe(batch: list[dict]) -> list[dict]:
+            if idempotency is not None:
+                batch = idempotency.filter_new(batch)
+            return prepare(batch) if batch else batch
+        return self.store.append_many(records, dedupe)
+
+    def _on_append(self, records: list[dict], positions: list[int]):
+        for index in self.indexes.values():
+            index.add_many(records, positions)
+        self._stamp_generation()
+
+    def _on_reset(self):
+        for index in self.indexes.values():
+            index.reset()
+        self._stamp_generation()
+
+    def flush(self):
+        for index in self.indexes.values():
+            flush = getattr(index, "flush", None)
+            if flush is not None:
+                flush()
+
+
+BACKENDS = {
+    "jsonl": JsonlStatsStore,
+    "sqlite": SqliteStatsStore,
+}
+
+
+def migrate_legacy_json(legacy_path: str, store: StatsStore) -> int:
+    """一次性迁移：把旧的 JSON 数组文件导入新存储，完成后重命名为 *.migrated"""
+    if not os.path.exists(legacy_path):
+        return 0
+    with open(legacy_path, "r", encoding="utf-8") as f:
+        records = decode_record(f.read())
+    if not isinstance(records, list):
+        return 0
+    if store.is_empty():
+        store.append_many(records)
+    os.replace(legacy_path, legacy_path + ".migrated")
+    return len(records)
+
+
+def open_stats_store(legacy_path: str, backend: str = "jsonl") -> StatsStore:
+    """
+    打开 legacy_path（如 userdata/game_stats.json）对应的存储。
+    数据文件与旧文件同目录同名，仅扩展名不同；旧数组文件存在时自动迁移。
+    """
+    cls = BACKENDS.get(backend)
+    if cls is None:
+        raise ValueError(f"未知的统计存储后端: {backend}")
+    base, _ = os.path.splitext(legacy_path)
+    store = cls(base + cls.suffix)
+    with store.process_lock():  # 多个进程同时启动时只迁移一次
+        migrate_legacy_json(legacy_path, store)
+    return store
@@ -0,0 +1,208 @@
+"""
+客户端性能遥测
+
+浏览器（js/utils/performance-monitor.js）按会话抽样，把 fps、renderTime、inputLatency、memory、apiResponseTime
+的样本攒成批次上报；每批作为一条记录写入遥测表，由 TelemetryIndex 增量累计为固定分桶直方图：
+
+- 维度：日期 × 指标 × 游戏模式 × 设备类别（形态-浏览器-档位，如 mobile-chrome-low），只为出现过的组合建直方图
+- 样本按 1 / 抽样率 加权，不同抽样率的客户端混合后分位数仍无偏
+- 查询合并时间范围内的直方图后估算分位数，成本与样本数无关
+- 与 AggregatesIndex 一样定期写检查点，重启后只需回放检查点之后的批次
+
+设备类别只取有限的几种取值（未知模式归入 other），直方图数量有上界。
+"""
+
+import json
+import math
+import os
+import re
+import threading
+from typing import Optional
+
+from .analytics import FixedHistogram
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 为可选依赖
+    np = None
+
+# 指标 -> (下界, 上界, 桶宽)；超出上界的样本落入末桶
+METRICS = {
+    "fps": (0, 240, 1),
+    "renderTime": (0, 500, 1),         # 毫秒
+    "inputLatency": (0, 1000, 1),      # 毫秒
+    "apiResponseTime": (0, 10000, 10),  # 毫秒
+    "memory": (0, 4096, 8),            # MB（JS 堆已用）
+}
+
+MODES = ("classic", "words", "racing", "defense")
+QUANTILES = (0.05, 0.5, 0.95)
+
+_FORM_PATTERNS = (("tablet", re.compile(r"iPad|Tablet|Android(?!.*Mobile)", re.I)),
+                  ("mobile", re.compile(r"Mobi|iPhone|iPod|Android", re.I)))
+_BROWSER_PATTERNS = (("edge", re.compile(r"Edg/")), ("firefox", re.compile(r"Firefox/|FxiOS/")),
+                     ("chrome", re.compile(r"Chrome/|CriOS/")), ("safari", re.compile(r"Safari/")))
+
+
+def device_tier(cores: Optional[int], memory_gb: Optional[float]) -> str:
+    """按 navigator.hardwareConcurrency / deviceMemory 分档；都未知时为 unknown"""
+    if cores is None and memory_gb is None:
+        return "unknown"
+    if (cores is not None and cores <= 2) or (memory_gb is not None and memory_gb <= 2):
+        return "low"
+    if (cores is not None and cores >= 8) and (memory_gb is None or memory_gb >= 8):
+        return "high"
+    return "mid"
+
+
+def classify_client(user_agent: str, cores: Optional[int] = None, memory_gb: Optional[float] = None) -> str:
+    """设备类别：形态（desktop / tablet / mobile）- 浏览器 - 档位"""
+    user_agent = user_agent or ""
+    form = next((name for name, pattern in _FORM_PATTERNS if pattern.search(user_agent)), "desktop")
+    browser = next((name for name, pattern in _BROWSER_PATTERNS if pattern.search(user_agent)), "other")
+    return f"{form}-{browser}-{device_tier(cores, memory_gb)}"
+
+
+def normalize_mode(mode: Optional[str]) -> str:
+    return mode if mode in MODES else "other"
+
+
+def _new_histogram(metric: str) -> FixedHistogram:
+    return FixedHistogram(*METRICS[metric])
+
+
+def _add_values(hist: FixedHistogram, values: list[float], weight: int):
+    values = [value for value in values if math.isfinite(value)]
+    if np is not None and len(values) >= 16:
+        buckets = np.clip((np.asarray(values, dtype=np.float64) - hist.low) // hist.bucket_width,
+                          0, len(hist.counts) - 1).astype(np.int64)
+        for bucket, count in zip(*np.unique(buckets, return_counts=True)):
+            hist.counts[bucket] += int(count) * weight
+        hist.total += len(values) * weight
+        return
+    for value in values:
+        hist.add(value, weight)
+
+
+class TelemetryIndex:
+    """挂在遥测表上的分维度直方图，带检查点"""
+
+    def __init__(self, checkpoint_path: Optional[str] = None, checkpoint_every: int = 200):
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.histograms = {}  # (日期, 指标, 模式, 设备类别) -> FixedHistogram
+        self.batches = 0
+        self.position = 0
+        self.generation = None
+        self._dirty = 0
+        self._lock = threading.Lock()
+        self._load_checkpoint()
+
+    def _load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("metrics") != {name: list(spec) for name, spec in METRICS.items()}:
+                return  # 分桶变了，从头回放
+            histograms = {}
+            for entry in data["histograms"]:
+                day, metric, mode, client = entry["key"]
+                hist = _new_histogram(metric)
+                for i, count in entry["counts"].items():
+                    hist.counts[int(i)] = count
+                hist.total = sum(hist.counts)
+                histograms[(day, metric, mode, client)] = hist
+            self.histograms = histograms
+            self.batches = data["batches"]
+            self.position = data["position"]
+            self.generation = data.get("generation")
+        except (ValueError, KeyError, TypeError, IndexError):
+            self.reset()  # 检查点损坏时从头回放
+
+    def reset(self):
+        self.histograms = {}
+        self.batches = 0
+        self.position = 0
+
+    def add_many(self, records: list[dict], positions: list[int]):
+        if not records:
+            return
+        with self._lock:
+            for record in records:
+                day = record["timestamp"][:10]
+                mode, client, weight = record["mode"], record["client"], record.get("weight", 1)
+                for metric, values in record["samples"].items():
+                    if metric not in METRICS or not values:
+                        continue
+                    key = (day, metric, mode, client)
+                    hist = self.histograms.get(key)
+                    if hist is None:
+                        hist = self.histograms[key] = _new_histogram(metric)
+                    _add_values(hist, values, weight)
+            self.batches += len(records)
+            self.position = positions[-1]
+            self._dirty += len(records)
+            due = self._dirty >= self.checkpoint_every
+        if due:
+            self.flush()
+
+    def query(self, metrics: list[str], since: Optional[str] = None, until: Optional[str] = None,
+              mode: Optional[str] = None, client: Optional[str] = None, by: Optional[str] = None) -> dict:
+        """
+        按日期范围（since 含、until 不含，YYYY-MM-DD）、模式、设备类别筛选后合并直方图，
+        返回各指标的样本数与 p5 / p50 / p95；by 为 mode 或 client 时另按该维度分组
+        """
+        merged = {metric: {} for metric in metrics}
+        with self._lock:
+            for (day, metric, hist_mode, hist_client), hist in self.histograms.items():
+                if metric not in merged or (since and day < since) or (until and day >= until):
+                    continue
+                if (mode and hist_mode != mode) or (client and hist_client != client):
+                    continue
+                groups = [None]
+                if by:
+                    groups.append(hist_mode if by == "mode" else hist_client)
+                for group in groups:
+                    target = merged[metric].get(group)
+                    if target is None:
+                        target = merged[metric][group] = _new_histogram(metric)
+                    target.merge(hist)
+        result = {}
+        for metric, groups in merged.items():
+            overall = groups.pop(None, None) or _new_histogram(metric)
+            result[metric] = {"overall": _describe(overall)}
+            if by:
+                result[metric]["groups"] = {group: _describe(hist) for group, hist in sorted(groups.items())}
+        return result
+
+    def flush(self):
+        """把各直方图（稀疏形式）与已覆盖位置原子写入检查点文件"""
+        if not self.checkpoint_path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {
+                "metrics": {name: list(spec) for name, spec in METRICS.items()},
+                "position": self.position,
+                "generation": self.generation,
+                "batches": self.batches,
+                "histograms": [{"key": list(key), "counts": {str(i): c for i, c in enumerate(hist.counts) if c}}
+                               for key, hist in self.histograms.items()],
+            }
+            payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+            self._dirty = 0
+        tmp_path = f"{self.checkpoint_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp_path, self.checkpoint_path)
+
+
+def _describe(hist: FixedHistogram) -> dict:
+    summary = {"samples": hist.total}
+    for q in QUANTILES:
+        value = hist.quantile(q)
+        summary[f"p{round(q * 100)}"] = round(value, 2) if value is not None else None
+    return summary
@@ -0,0 +1,216 @@
+"""
+按键时间线
+
+记录一局游戏的每次按键，供回放与幽灵赛车使用。按键数据格式（版本 1）：
+
+    [版本 1 字节][varint 按键数][每次按键: varint((间隔毫秒 << 1) | 不符)][不符时: varint(字符码)]
+
+- 间隔为与上一次按键的差值（第一次为距开局的时间），常见的 64~8191 毫秒占 2 字节
+- 按目标文本可推算出应按的键，与之相符的按键不存字符码；退格记为字符码 8
+- 文本分段（单词 / 赛车模式）按游戏规则推进：输入长度达到本段长度即进入下一段
+
+60 秒、约 300 次按键的一局约 600~700 字节，同样内容写成逐键 JSON 约 15KB。
+元数据（模式、文本、时长、WPM）作为一条统计记录写入索引存储，
+按键数据追加到同名的 .bin 文件，索引记录其 (偏移, 长度)。
+"""
+
+import os
+import threading
+from array import array
+from typing import Iterator, Optional
+
+from .storage import StatsTable
+
+FORMAT_VERSION = 1
+BACKSPACE = "\b"
+MAX_INTERVAL_MS = 24 * 3600 * 1000  # 单次按键间隔上限，解码后存入 32 位数组
+
+
+def _write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class _Cursor:
+    """按游戏规则推进的输入位置，给出下一次应按的键"""
+
+    __slots__ = ("texts", "segment", "index")
+
+    def __init__(self, texts: list[str]):
+        self.texts = texts
+        self.segment = 0
+        self.index = 0
+
+    def expected(self) -> Optional[str]:
+        if self.segment < len(self.texts):
+            text = self.texts[self.segment]
+            if self.index < len(text):
+                return text[self.index]
+        return None
+
+    def advance(self, key: str):
+        if key == BACKSPACE:
+            self.index = max(self.index - 1, 0)
+            return
+        self.index += 1
+        if self.segment < len(self.texts) and self.index >= len(self.texts[self.segment]):
+            self.segment += 1
+            self.index = 0
+
+
+class Keystrokes:
+    """
+    解码后的时间线（列式）：按键字符、与上一键的间隔（毫秒）、是否按对，
+    以及按键时应按的字符（退格记为 \\b，文本已输完时记为 \\0）
+    """
+
+    __slots__ = ("keys", "intervals", "correct", "expected")
+
+    def __init__(self, keys: str, intervals: array, correct: bytearray, expected: str):
+        self.keys = keys
+        self.intervals = intervals
+        self.correct = correct
+        self.expected = expected
+
+    def __len__(self):
+        return len(self.keys)
+
+    def events(self) -> Iterator[tuple[int, str, bool]]:
+        """产出 (距开局毫秒, 按键, 是否按对)"""
+        elapsed = 0
+        for key, interval, correct in zip(self.keys, self.intervals, self.correct):
+            elapsed += interval
+            yield elapsed, key, bool(correct)
+
+    def summary(self) -> dict:
+        duration = sum(self.intervals)
+        typed = len(self.keys) - self.keys.count(BACKSPACE)
+        hits = sum(self.correct)
+        return {
+            "keystrokes": len(self.keys),
+            "errors": typed - hits,
+            "duration_ms": duration,
+            "wpm": round(hits / 5 / (duration / 60000), 2) if duration else 0.0,
+            "accuracy": round(hits / typed * 100, 2) if typed else 0.0,
+        }
+
+
+def encode_timeline(texts: list[str], keys: str, intervals: list[int]) -> bytes:
+    """编码时间线；按键数与间隔数不一致或间隔超出 [0, MAX_INTERVAL_MS] 时抛出 ValueError"""
+    if len(keys) != len(intervals):
+        raise ValueError("按键数与间隔数不一致")
+    out = bytearray((FORMAT_VERSION,))
+    _write_varint(out, len(keys))
+    cursor = _Cursor(texts)
+    for key, interval in zip(keys, intervals):
+        if interval < 0:
+            raise ValueError("按键间隔不能为负")
+        if interval > MAX_INTERVAL_MS:
+            raise ValueError("按键间隔过长")
+        hit = key != BACKSPACE and key == cursor.expected()
+        _write_varint(out, (interval << 1) | (not hit))
+        if not hit:
+            _write_varint(out, ord(key))
+        cursor.advance(key)
+    return bytes(out)
+
+
+def decode_timeline(blob: bytes, texts: list[str]) -> Keystrokes:
+    if not blob or blob[0] != FORMAT_VERSION:
+        raise ValueError("不支持的时间线格式")
+    count, pos = _read_varint(blob, 1)
+    keys = []
+    expected = []
+    intervals = array("l")
+    correct = bytearray(count)
+    cursor = _Cursor(texts)
+    for i in range(count):
+        value, pos = _read_varint(blob, pos)
+        intervals.append(min(value >> 1, MAX_INTERVAL_MS))  # 加上限之前写入的超长间隔截断
+        target = cursor.expected()
+        if value & 1:
+            code, pos = _read_varint(blob, pos)
+            key = chr(code)
+        else:
+            key = target
+            correct[i] = 1
+        keys.append(key)
+        expected.append(BACKSPACE if key == BACKSPACE else target or "\0")
+        cursor.advance(key)
+    return Keystrokes("".join(keys), intervals, correct, "".join(expected))
+
+
+class TimelineIndex:
+    """时间线 id -> 索引记录在存储中的 (起始位置, 末尾位置)"""
+
+    def __init__(self):
+        self._spans = {}
+        self._last_end = 0
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self._spans = {}
+            self._last_end = 0
+
+    def add_many(self, records: list[dict], positions: list[int]):
+        with self._lock:
+            for record, end in zip(records, positions):
+                start, self._last_end = self._last_end, end
+                self._spans[record.get("id")] = (start, end)
+
+    def span(self, timeline_id: str) -> Optional[tuple[int, int]]:
+        return self._spans.get(timeline_id)
+
+    def __len__(self):
+        return len(self._spans)
+
+
+def blob_path(table: StatsTable) -> str:
+    return os.path.splitext(table.store.path)[0] + ".bin"
+
+
+def append_timeline(table: StatsTable, record: dict, blob: bytes) -> dict:
+    """
+    追加按键数据并写入索引记录：按键数据在存储的写锁内追加（与其他写入同样的加锁顺序），
+    偏移不会与其他进程交错
+    """
+    def write_blob(records: list[dict]) -> list[dict]:
+        fd = os.open(blob_path(table), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            offset = os.fstat(fd).st_size
+            os.write(fd, blob)
+        finally:
+            os.close(fd)
+        return [{**records[0], "offset": offset, "length": len(blob)}]
+
+    return table.append_many([record], prepare=write_blob)[0]
+
+
+def get_timeline(table: StatsTable, timeline_id: str) -> Optional[dict]:
+    span = table.indexes["timelines"].span(timeline_id)
+    if span is None:
+        return None
+    records = table.store.read_spans([span])
+    return records[0] if records else None
+
+
+def read_timeline(table: StatsTable, record: dict) -> bytes:
+    fd = os.open(blob_path(table), os.O_RDONLY)
+    try:
+        return os.pread(fd, record["length"], record["offset"])
+    finally:
+        os.close(fd)
@@ -0,0 +1,182 @@
+"""
+植物防御波次生成
+
+波次规则来自 data/config/defense.json（zombiesPerWave / zombieTypesByWave），
+配置在加载时编译为每个 (难度, 波次) 一张 Walker 别名表，僵尸类型抽样为 O(1)；
+大批量抽样时（压测、机器人、平衡模拟）如安装了 NumPy 则向量化执行。
+
+单词由 WordIndex 按类型不放回抽取，同一波内不重复，并可按长度、字母、难度约束。
+
+单波生成与整场战役批量生成共用同一套逻辑。
+传入种子时，每一波使用由 (种子, 难度, 波次) 派生的独立随机源，
+因此同一种子无论逐波请求、批量请求还是流式请求，结果都完全一致。
+"""
+
+import random
+from functools import lru_cache
+from typing import Iterator, Optional
+
+from .word_index import UNCONSTRAINED, WordDraw, WordIndex, WordQuery
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 为可选依赖
+    np = None
+
+# 单次抽样数量达到该值时改用 NumPy 向量化
+NUMPY_MIN_BATCH = 64
+
+# defense.json 缺失或未配置难度时使用的默认规则（与 defense.json 同构）
+DEFAULT_DIFFICULTY_CONFIG = {
+    "easy": {
+        "waves": 4,
+        "zombiesPerWave": [3, 4, 5, 6],
+        "zombieTypesByWave": [{"basic": 0.7, "medium": 0.3}]
+    },
+    "medium": {
+        "waves": 7,
+        "zombiesPerWave": [4, 5, 6, 7, 8, 9, 10],
+        "zombieTypesByWave": [{"basic": 0.5, "medium": 0.35, "strong": 0.15}]
+    },
+    "hard": {
+        "waves": 10,
+        "zombiesPerWave": [5, 6, 8, 10, 12, 14, 16, 18, 20, 25],
+        "zombieTypesByWave": [{"basic": 0.3, "medium": 0.4, "strong": 0.25, "boss": 0.05}]
+    }
+}
+
+
+class AliasTable:
+    """Walker / Vose 别名表：O(n) 构建，O(1) 抽样"""
+
+    def __init__(self, weights: dict):
+        self._np_tables = None
+        items = [(k, float(w)) for k, w in weights.items() if w and w > 0]
+        if not items:
+            items = [("basic", 1.0)]
+        self.outcomes = [k for k, _ in items]
+        n = len(items)
+        total = sum(w for _, w in items)
+        scaled = [w * n / total for _, w in items]
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, g = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = g
+            scaled[g] -= 1.0 - scaled[s]
+            (small if scaled[g] < 1.0 else large).append(g)
+        # 剩余项仅因浮点误差偏离 1，保持 prob = 1
+
+    def draw(self, rng: random.Random) -> str:
+        r = rng.random() * len(self.outcomes)
+        i = int(r)
+        return self.outcomes[i] if r - i < self.prob[i] else self.outcomes[self.alias[i]]
+
+    def draw_indices(self, count: int, rng: random.Random):
+        """向量化抽样，返回结果下标数组（需要 NumPy）"""
+        if self._np_tables is None:
+            self._np_tables = (np.array(self.prob), np.array(self.alias))
+        prob, alias = self._np_tables
+        gen = np.random.default_rng(rng.getrandbits(64))
+        idx = gen.integers(0, len(self.outcomes), size=count)
+        return np.where(gen.random(count) < prob[idx], idx, alias[idx])
+
+    def sample(self, count: int, rng: random.Random) -> list[str]:
+        if np is not None and count >= NUMPY_MIN_BATCH:
+            outcomes = self.outcomes
+            return [outcomes[i] for i in self.draw_indices(count, rng).tolist()]
+        return [self.draw(rng) for _ in range(count)]
+
+
+class WaveSampler:
+    """由 defense.json 编译出的各难度各波次抽样表"""
+
+    def __init__(self, difficulty_config: dict):
+        self.difficulties = {}
+        for name, spec in difficulty_config.items():
+            counts = list(spec.get("zombiesPerWave") or [])
+            if not counts:
+                continue
+            type_weights = spec.get("zombieTypesByWave") or [{"basic": 1}]
+            waves = spec.get("waves") or len(counts)
+            tables = [
+                AliasTable(type_weights[min(i, len(type_weights) - 1)])
+                for i in range(waves)
+            ]
+            self.difficulties[name] = {"waves": waves, "zombies": counts, "tables": tables}
+        if not self.difficulties:
+            self.difficulties = default_sampler().difficulties
+
+    @classmethod
+    def from_config(cls, config: dict) -> "WaveSampler":
+        difficulty_config = (config or {}).get("difficulty")
+        if not difficulty_config:
+            return default_sampler()
+        return cls(difficulty_config)
+
+    def _spec(self, difficulty: str) -> dict:
+        spec = self.difficulties.get(difficulty)
+        if spec is None:
+            spec = self.difficulties.get("easy") or next(iter(self.difficulties.values()))
+        return spec
+
+    def total_waves(self, difficulty: str) -> int:
+        return self._spec(difficulty)["waves"]
+
+    def wave_plan(self, difficulty: str, wave: int) -> tuple[int, AliasTable]:
+        """返回 (僵尸数, 类型别名表)；超出配置的波次沿用最后一波"""
+        spec = self._spec(difficulty)
+        wave_index = max(0, wave - 1)
+        zombies = spec["zombies"][min(wave_index, len(spec["zombies"]) - 1)]
+        table = spec["tables"][min(wave_index, len(spec["tables"]) - 1)]
+        return zombies, table
+
+    def sample_types_batch(self, difficulty: str, wave: int, waves: int, rng: random.Random) -> list[list[str]]:
+        """一次为同一波次抽样 waves 组僵尸类型（压测、机器人、模拟器用）"""
+        zombies, table = self.wave_plan(difficulty, wave)
+        flat = table.sample(zombies * waves, rng)
+        return [flat[i * zombies:(i + 1) * zombies] for i in range(waves)]
+
+
+@lru_cache(maxsize=None)
+def default_sampler() -> WaveSampler:
+    return WaveSampler(DEFAULT_DIFFICULTY_CONFIG)
+
+
+def new_seed() -> int:
+    return random.randrange(2 ** 31)
+
+
+def wave_rng(seed: Optional[int], difficulty: str, wave: int) -> random.Random:
+    """为某一波创建随机源；未指定种子时使用系统随机"""
+    if seed is None:
+        return random.Random()
+    return random.Random(f"{seed}:{difficulty}:{wave}")
+
+
+def generate_wave(words: WordIndex, sampler: WaveSampler, difficulty: str, wave: int,
+                  rng: random.Random, query: WordQuery = UNCONSTRAINED) -> dict:
+    """生成单波僵尸，返回 /api/defense/wave 的 data 部分"""
+    zombie_count, table = sampler.wave_plan(difficulty, wave)
+    draw = WordDraw(words, rng, query)
+
+    zombies = []
+    for i, zombie_type in enumerate(table.sample(zombie_count, rng)):
+        zombies.append({"type": zombie_type, "word": draw.draw(zombie_type), "id": i + 1})
+
+    return {
+        "wave": wave,
+        "difficulty": difficulty,
+        "zombie_count": zombie_count,
+        "zombies": zombies
+    }
+
+
+def generate_campaign(words: WordIndex, sampler: WaveSampler, difficulty: str, seed: int,
+                      query: WordQuery = UNCONSTRAINED) -> Iterator[dict]:
+    """按顺序逐波生成整场战役"""
+    for wave in range(1, sampler.total_waves(difficulty) + 1):
+        yield generate_wave(words, sampler, difficulty, wave, wave_rng(seed, difficulty, wave), query)
@@ -0,0 +1,216 @@
+"""
+植物防御单词索引
+
+defense_words.json 加载时预先计算每个单词的特征：
+- 长度
+- 字母集合（26 位掩码）
+- 左右手交替率（QWERTY 布局）
+- 二元组稀有度（基于全部词库的二元组频率）
+并综合为 0~1 的按键难度，按 (长度, 难度档) 分桶存放为紧凑数组。
+
+每一波通过 WordDraw 不放回抽词：每个候选池对应一个“虚拟洗牌”游标，
+单次抽取 O(1)，不需要复制或打乱整个池子，词库扩大到十万级也不受影响。
+"""
+
+import math
+import random
+import threading
+from array import array
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+LEFT_HAND = frozenset("qwertasdfgzxcvb")
+RIGHT_HAND = frozenset("yuiophjklnm")
+
+# 难度分档数
+DIFFICULTY_LEVELS = 4
+
+# 带约束的候选池缓存上限
+POOL_CACHE_SIZE = 256
+
+
+def letter_mask(text: str) -> int:
+    mask = 0
+    for ch in text.lower():
+        if "a" <= ch <= "z":
+            mask |= 1 << (ord(ch) - 97)
+    return mask
+
+
+def hand_alternation(word: str) -> float:
+    """相邻字母换手的比例；无法判断时视为 1（最容易）"""
+    hands = [0 if ch in LEFT_HAND else 1 for ch in word.lower() if ch in LEFT_HAND or ch in RIGHT_HAND]
+    if len(hands) < 2:
+        return 1.0
+    switches = sum(1 for a, b in zip(hands, hands[1:]) if a != b)
+    return switches / (len(hands) - 1)
+
+
+@dataclass(frozen=True)
+class WordQuery:
+    """抽词约束，均为可选"""
+    min_length: Optional[int] = None
+    max_length: Optional[int] = None
+    avoid_letters: str = ""
+    max_difficulty: Optional[float] = None
+
+    @property
+    def is_empty(self) -> bool:
+        return self == UNCONSTRAINED
+
+    @property
+    def avoid_mask(self) -> int:
+        return letter_mask(self.avoid_letters)
+
+    def accepts_bucket(self, length: int, level: int) -> bool:
+        if self.min_length is not None and length < self.min_length:
+            return False
+        if self.max_length is not None and length > self.max_length:
+            return False
+        if self.max_difficulty is not None and level > self.max_difficulty * DIFFICULTY_LEVELS:
+            return False
+        return True
+
+
+UNCONSTRAINED = WordQuery()
+
+
+class WordIndex:
+    """按类型（basic / medium / strong / boss）组织的单词特征索引"""
+
+    def __init__(self, tiers: dict):
+        self.words = []
+        self.lengths = array("H")
+        self.masks = array("L")
+        self.difficulty = array("f")
+        self._tier_ids = {}
+        self._buckets = {}
+        self._pools = OrderedDict()
+        self._pools_lock = threading.Lock()
+
+        for tier, tier_words in (tiers or {}).items():
+            if not isinstance(tier_words, list):
+                continue
+            start = len(self.words)
+            self.words.extend(str(w) for w in tier_words)
+            self._tier_ids[tier] = array("L", range(start, len(self.words)))
+
+        bigrams = Counter()
+        for word in self.words:
+            lower = word.lower()
+            bigrams.update(lower[i:i + 2] for i in range(len(lower) - 1))
+        total = sum(bigrams.values())
+        max_info = math.log(total) if total > 1 else 1.0
+
+        for word_id, word in enumerate(self.words):
+            lower = word.lower()
+            pairs = [lower[i:i + 2] for i in range(len(lower) - 1)]
+            rarity = (
+                sum(math.log(total / bigrams[p]) for p in pairs) / (len(pairs) * max_info)
+                if pairs else 0.0
+            )
+            score = 0.5 * rarity + 0.5 * (1.0 - hand_alternation(lower))
+            self.lengths.append(min(len(word), 0xFFFF))
+            self.masks.append(letter_mask(lower))
+            self.difficulty.append(score)
+
+        for tier, ids in self._tier_ids.items():
+            buckets = {}
+            for word_id in ids:
+                level = min(int(self.difficulty[word_id] * DIFFICULTY_LEVELS), DIFFICULTY_LEVELS - 1)
+                buckets.setdefault((self.lengths[word_id], level), array("L")).append(word_id)
+            self._buckets[tier] = buckets
+
+    def __contains__(self, tier: str) -> bool:
+        return tier in self._tier_ids
+
+    def pool(self, tier: str, query: WordQuery = UNCONSTRAINED) -> array:
+        """某类型下满足约束的单词 id 数组（带约束的结果按约束缓存）"""
+        ids = self._tier_ids.get(tier)
+        if ids is None or query.is_empty:
+            return ids if ids is not None else array("L")
+        key = (tier, query)
+        with self._pools_lock:
+            pool = self._pools.get(key)
+            if pool is not None:
+                self._pools.move_to_end(key)
+                return pool
+
+        avoid = query.avoid_mask
+        max_difficulty = query.max_difficulty
+        pool = array("L")
+        for (length, level), bucket in self._buckets[tier].items():
+            if not query.accepts_bucket(length, level):
+                continue
+            if not avoid and max_difficulty is None:
+                pool.extend(bucket)
+                continue
+            masks, difficulty = self.masks, self.difficulty
+            pool.extend(
+                i for i in bucket
+                if not masks[i] & avoid and (max_difficulty is None or difficulty[i] <= max_difficulty)
+            )
+        with self._pools_lock:
+            self._pools[key] = pool
+            if len(self._pools) > POOL_CACHE_SIZE:
+                self._pools.popitem(last=False)
+        return pool
+
+
+class _ShuffleCursor:
+    """对 id 数组做惰性 Fisher-Yates：只记录被交换过的位置，单次抽取 O(1)"""
+
+    __slots__ = ("pool", "remaining", "swaps")
+
+    def __init__(self, pool: array):
+        self.pool = pool
+        self.remaining = len(pool)
+        self.swaps = {}
+
+    def next(self, rng: random.Random) -> int:
+        if self.remaining == 0:
+            # 池子抽空后开始新一轮（此后才会出现重复）
+            self.remaining = len(self.pool)
+            self.swaps.clear()
+        j = rng.randrange(self.remaining)
+        last = self.remaining - 1
+        picked = self.swaps.get(j, j)
+        self.swaps[j] = self.swaps.pop(last, last)
+        self.remaining = last
+        return self.pool[picked]
+
+
+class WordDraw:
+    """一波之内的不放回抽词会话"""
+
+    def __init__(self, index: WordIndex, rng: random.Random, query: WordQuery = UNCONSTRAINED):
+        self.index = index
+        self.rng = rng
+        self.query = query
+        self._cursors = {}
+        self._drawn = set()
+
+    def _cursor(self, tier: str) -> Optional[_ShuffleCursor]:
+        cursor = self._cursors.get(tier)
+        if cursor is None:
+            pool = self.index.pool(tier, self.query)
+            if not pool:
+                # 约束过严时放宽为该类型的全部单词
+                pool = self.index.pool(tier)
+            if not pool:
+                return None
+            cursor = self._cursors[tier] = _ShuffleCursor(pool)
+        return cursor
+
+    def draw(self, tier: str, fallback_tier: str = "basic") -> str:
+        cursor = self._cursor(tier if tier in self.index else fallback_tier)
+        if cursor is None:
+            return "test"
+        # 同一单词可能出现在多个类型中，跨类型也尽量不重复
+        for _ in range(3):
+            word = self.index.words[cursor.next(self.rng)]
+            if word not in self._drawn:
+                break
+        self._drawn.add(word)
+        return word
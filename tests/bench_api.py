@@ -0,0 +1,305 @@
+"""
+后端 API 压测与延迟基准
+
+在进程内（httpx ASGITransport）或本地 uvicorn 实例上，
+按不同历史数据规模（默认 1k / 100k / 1M 条）并发请求全部 /api/* 路由，
+输出每个路由的 RPS 与 p50 / p95 / p99 延迟，可保存为 JSON 基线，
+并在与基线相比退化超过阈值时以非零状态退出。
+
+用法:
+    python tests/bench_api.py                          # 进程内，1k 条历史
+    python tests/bench_api.py --sizes 1k,100k,1m       # 多种历史规模
+    python tests/bench_api.py --target uvicorn         # 每个规模启动一个本地 uvicorn
+    python tests/bench_api.py --url http://127.0.0.1:8000   # 压测已在运行的服务（不生成历史数据）
+    python tests/bench_api.py --save                   # 写入基线
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+DEFAULT_BASELINE = PROJECT_ROOT / "tests" / "bench_baseline.json"
+
+GAME_MODES = ("classic", "words", "sentences", "racing")
+DIFFICULTIES = ("easy", "medium", "hard")
+
+GAME_STATS = {"wpm": 52.5, "accuracy": 96.0, "time_taken": 60, "errors": 2, "mode": "classic"}
+DEFENSE_STATS = {
+    "score": 1200, "wave": 3, "total_waves": 4, "zombies_killed": 14, "plant_health": 60,
+    "difficulty": "easy", "victory": True, "play_time": 95.0
+}
+
+# (名称, 方法, 路径, 请求体工厂, 适用的最大历史规模)
+ROUTES = [
+    ("config", "GET", "/api/config", None, None),
+    ("texts", "GET", "/api/texts", None, None),
+    ("words", "GET", "/api/words", None, None),
+    ("defense_words", "GET", "/api/defense/words", None, None),
+    ("defense_config", "GET", "/api/defense/config", None, None),
+    ("racing_config", "GET", "/api/racing/config", None, None),
+    ("defense_wave", "POST", "/api/defense/wave",
+     lambda i: {"difficulty": DIFFICULTIES[i % 3], "wave": i % 4 + 1}, None),
+    ("defense_campaign", "POST", "/api/defense/campaign",
+     lambda i: {"difficulty": DIFFICULTIES[i % 3], "seed": i}, None),
+    ("defense_campaign_stream", "POST", "/api/defense/campaign/stream",
+     lambda i: {"difficulty": DIFFICULTIES[i % 3], "seed": i}, None),
+    ("stats_post", "POST", "/api/stats", lambda i: GAME_STATS, None),
+    ("defense_stats_post", "POST", "/api/defense/stats", lambda i: DEFENSE_STATS, None),
+    ("stats_batch", "POST", "/api/stats/batch",
+     lambda i: [{**GAME_STATS, "idempotency_key": f"bench-{i}-{j}-{random.random()}"} for j in range(50)], None),
+    ("defense_stats_batch", "POST", "/api/defense/stats/batch", lambda i: [DEFENSE_STATS] * 50, None),
+    ("stats_full", "GET", "/api/stats", None, 100_000),
+    ("stats_page", "GET", "/api/stats?limit=100&order=desc", None, None),
+    ("stats_range", "GET", "/api/stats?since=2024-06-01&until=2024-06-02&mode=words&limit=100", None, None),
+    ("stats_stream", "GET", "/api/stats/stream?limit=1000", None, None),
+    ("defense_stats_page", "GET", "/api/defense/stats?limit=100", None, None),
+    ("leaderboard", "GET", "/api/leaderboard", None, None),
+    ("leaderboard_mode", "GET", "/api/leaderboard?mode=words&limit=100", None, None),
+    ("defense_leaderboard", "GET", "/api/defense/leaderboard?difficulty=hard", None, None),
+    ("analytics", "GET", "/api/analytics?percentiles=true", None, None),
+    ("analytics_range", "GET", "/api/analytics?since=2024-06-01&until=2024-06-15&percentiles=true", None, None),
+    ("leaderboard_range", "GET", "/api/leaderboard?since=2024-06-01&until=2024-06-02&mode=words", None, None),
+    ("admin_content", "GET", "/api/admin/content", None, None),
+]
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    for suffix, factor in (("m", 1_000_000), ("k", 1_000)):
+        if text.endswith(suffix):
+            return int(float(text[:-1]) * factor)
+    return int(text)
+
+
+def size_label(size: int) -> str:
+    if size >= 1_000_000 and size % 1_000_000 == 0:
+        return f"{size // 1_000_000}m"
+    if size >= 1_000 and size % 1_000 == 0:
+        return f"{size // 1_000}k"
+    return str(size)
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def seed_history(workdir: Path, size: int):
+    """在 workdir 下生成内容数据和 size 条游戏 / 植物防御历史（直接写 JSONL，不经过接口）"""
+    shutil.copytree(PROJECT_ROOT / "data", workdir / "data")
+    userdata = workdir / "userdata"
+    userdata.mkdir()
+    rng = random.Random(size)
+    start = datetime(2024, 1, 1)
+    step = timedelta(days=365) / max(size, 1)
+    with open(userdata / "game_stats.jsonl", "w", encoding="utf-8") as f:
+        for i in range(size):
+            f.write(json.dumps({
+                "wpm": round(rng.uniform(10, 150), 1), "accuracy": round(rng.uniform(70, 100), 1),
+                "time_taken": rng.randint(30, 300), "errors": rng.randint(0, 30),
+                "mode": GAME_MODES[i % len(GAME_MODES)], "timestamp": (start + step * i).isoformat()
+            }, separators=(",", ":")) + "\n")
+    with open(userdata / "defense_stats.jsonl", "w", encoding="utf-8") as f:
+        for i in range(size):
+            f.write(json.dumps({
+                "score": rng.randint(0, 5000), "wave": rng.randint(1, 10), "total_waves": 10,
+                "zombies_killed": rng.randint(0, 120), "plant_health": rng.randint(0, 100),
+                "difficulty": DIFFICULTIES[i % 3], "victory": rng.random() < 0.4,
+                "play_time": round(rng.uniform(30, 600), 1), "timestamp": (start + step * i).isoformat()
+            }, separators=(",", ":")) + "\n")
+
+
+class Target:
+    """被压测的服务：进程内 ASGI 应用或本地 uvicorn 子进程"""
+
+    def __init__(self, kind: str, workdir: Path = None, url: str = None):
+        self.kind = kind
+        self.workdir = workdir
+        self.url = url
+        self.process = None
+        self._cwd = None
+
+    def __enter__(self):
+        if self.kind == "inprocess":
+            # 统计表按绝对路径缓存，每个规模使用独立目录即可得到全新的索引
+            self._cwd = os.getcwd()
+            os.chdir(self.workdir)
+        elif self.kind == "uvicorn":
+            with socket.socket() as s:
+                s.bind(("127.0.0.1", 0))
+                port = s.getsockname()[1]
+            self.url = f"http://127.0.0.1:{port}"
+            self.process = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", str(PROJECT_ROOT),
+                 "--port", str(port), "--log-level", "warning"],
+                cwd=self.workdir
+            )
+        return self
+
+    def __exit__(self, *exc):
+        if self._cwd:
+            os.chdir(self._cwd)
+        if self.process:
+            self.process.terminate()
+            self.process.wait()
+
+    def client(self, concurrency: int) -> httpx.AsyncClient:
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        if self.kind == "inprocess":
+            from main import app
+            return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=600)
+        return httpx.AsyncClient(base_url=self.url, limits=limits, timeout=600)
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get("/api/config")).status_code == 200:
+                return
+        except httpx.TransportError:
+            if time.monotonic() > deadline:
+                raise
+        await asyncio.sleep(0.2)
+
+
+async def bench_route(client: httpx.AsyncClient, method: str, path: str, body, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            payload = body(i) if body else None
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=payload)
+                await response.aread()
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+async def bench_size(target: Target, size: int, requests: int, concurrency: int, only: set) -> dict:
+    results = {}
+    async with target.client(concurrency) as client:
+        started = time.perf_counter()
+        await wait_ready(client)
+        # 首次访问统计接口会构建排行榜 / 聚合 / 历史索引，单独计时
+        await client.get("/api/leaderboard")
+        await client.get("/api/defense/leaderboard")
+        results["_warmup"] = {"seconds": round(time.perf_counter() - started, 3)}
+        print(f"   索引构建 {results['_warmup']['seconds']:.2f}s")
+        for name, method, path, body, max_history in ROUTES:
+            if only and name not in only:
+                continue
+            if max_history is not None and size > max_history:
+                continue
+            result = await bench_route(client, method, path, body, requests, concurrency)
+            results[name] = result
+            print(f"   {name:<24} {result['rps']:>9.1f} rps  p50 {result['p50_ms']:>8.2f}ms  "
+                  f"p95 {result['p95_ms']:>8.2f}ms  p99 {result['p99_ms']:>8.2f}ms"
+                  + (f"  ❌ {result['errors']} 错误" if result["errors"] else ""))
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """与基线比较：p95 变慢或 RPS 下降超过阈值即视为退化"""
+    regressions = []
+    for label, routes in results.items():
+        for name, result in routes.items():
+            base = baseline.get(label, {}).get(name)
+            if not base or name.startswith("_"):
+                continue
+            if result["p95_ms"] > base["p95_ms"] * (1 + threshold):
+                regressions.append(f"{label}/{name}: p95 {base['p95_ms']}ms -> {result['p95_ms']}ms")
+            if result["rps"] < base["rps"] * (1 - threshold):
+                regressions.append(f"{label}/{name}: rps {base['rps']} -> {result['rps']}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="TypeQuest API 压测")
+    parser.add_argument("--target", choices=["inprocess", "uvicorn"], default="inprocess")
+    parser.add_argument("--url", help="压测已在运行的服务（不生成历史数据）")
+    parser.add_argument("--sizes", default="1k", help="历史规模，逗号分隔，如 1k,100k,1m")
+    parser.add_argument("--requests", type=int, default=200, help="每个路由的请求数")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--routes", default="", help="只压测指定路由（逗号分隔的名称）")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    parser.add_argument("--save", action="store_true", help="把本次结果写入基线")
+    parser.add_argument("--threshold", type=float, default=0.25, help="允许的退化比例")
+    args = parser.parse_args()
+
+    only = {name for name in args.routes.split(",") if name}
+    results = {}
+    if args.url:
+        print(f"🏁 压测 {args.url}")
+        results["external"] = asyncio.run(
+            bench_size(Target("external", url=args.url), 0, args.requests, args.concurrency, only)
+        )
+    else:
+        for size in (parse_size(s) for s in args.sizes.split(",")):
+            label = size_label(size)
+            workdir = Path(tempfile.mkdtemp(prefix=f"typequest-bench-{label}-"))
+            try:
+                print(f"🏁 历史规模 {label}（{args.target}）")
+                seed_history(workdir, size)
+                with Target(args.target, workdir) as target:
+                    results[label] = asyncio.run(bench_size(target, size, args.requests, args.concurrency, only))
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    failed = any(r.get("errors") for routes in results.values() for r in routes.values())
+    baseline_path = Path(args.baseline)
+    if args.save:
+        saved = json.loads(baseline_path.read_text(encoding="utf-8")) if baseline_path.exists() else {}
+        saved.update(results)
+        baseline_path.write_text(json.dumps(saved, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+        print(f"💾 基线已保存: {baseline_path}")
+    elif baseline_path.exists():
+        regressions = compare(results, json.loads(baseline_path.read_text(encoding="utf-8")), args.threshold)
+        for line in regressions:
+            print(f"❌ 性能退化 {line}")
+        failed = failed or bool(regressions)
+        if not regressions:
+            print("✅ 未发现超过阈值的性能退化")
+
+    print("❌ 压测失败" if failed else "🎉 压测完成")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
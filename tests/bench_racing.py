@@ -0,0 +1,246 @@
+"""
+多人竞速容量基准
+
+估算单个事件循环（单核）能承载的「房间 × 玩家」规模：
+所有玩家按固定间隔上报进度，服务器按 tick 广播位置差异，统计
+tick 是否跟得上（超时次数、事件循环延迟）、CPU 占用以及推送的消息量。
+
+- 进程内（默认）：直接驱动 RaceEngine，连接换成只计数的空套接字，
+  包含上报解析、tick 计算、序列化与逐连接投递，不含 WebSocket 帧编码与系统调用
+- --url：对已在运行的实例建立真实 WebSocket 连接（需要 websockets，uvicorn[standard] 已包含），
+  服务端 tick 耗时从 /metrics 读取。实例的 multiplayer.maxPlayers 需等于 --players，房间满员才会开赛
+
+用法:
+    python tests/bench_racing.py                             # 200 房间 × 8 人，20 Hz，10 秒
+    python tests/bench_racing.py --rooms 500 --players 4
+    python tests/bench_racing.py --find                      # 房间数逐步翻倍，直到 tick 跟不上
+    python tests/bench_racing.py --url ws://127.0.0.1:8000 --rooms 50
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import sys
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from server.live import Subscriber
+from server.racing import RaceEngine
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+BENCH_TEXT = "x" * 20_000  # 足够长，基准期间没有人完赛
+
+
+class CountingSocket:
+    """只统计发送量的套接字"""
+
+    def __init__(self, counters: dict):
+        self.counters = counters
+
+    async def send_text(self, payload: str):
+        self.counters["messages"] += 1
+        self.counters["bytes"] += len(payload)
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def _measure_lag(interval: float, until: float, lags: list[float]):
+    loop = asyncio.get_running_loop()
+    while loop.time() < until:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(loop.time() - expected, 0.0))
+
+
+async def run_inprocess(rooms: int, players: int, tick_rate: int, seconds: float, send_interval: float) -> dict:
+    engine = RaceEngine(tick_rate=tick_rate, capacity=players, countdown=0, time_limit=seconds * 10)
+    counters = {"messages": 0, "bytes": 0, "reports": 0}
+    members = []
+    senders = []
+    for r in range(rooms):
+        room = engine.room(f"bench-{r}", BENCH_TEXT)
+        for p in range(players):
+            subscriber = Subscriber(CountingSocket(counters))
+            members.append([room, room.join(f"p{p}", subscriber), 0])
+            senders.append(asyncio.create_task(subscriber.run()))
+    engine.ensure_running()
+    while any(room.state != "running" for room in engine.rooms.values()):
+        await asyncio.sleep(1 / tick_rate)
+
+    async def drive(until: float):
+        # 每个 tick 处理一部分玩家，使每人每 send_interval 上报一次；解析与服务端接收路径一致
+        loop = asyncio.get_running_loop()
+        batches = max(1, round(send_interval * tick_rate))
+        step = 0
+        while loop.time() < until:
+            for member in members[step % batches::batches]:
+                member[2] += 1
+                data = json.loads('{"p": %d}' % member[2])
+                member[0].report(member[1], int(data["p"]), int(data.get("e", 0)))
+                counters["reports"] += 1
+            step += 1
+            await asyncio.sleep(1 / tick_rate)
+
+    loop = asyncio.get_running_loop()
+    lags = []
+    counters.update(messages=0, bytes=0)  # 不计入加入时的快照
+    ticks, overruns, busy = engine.ticks, engine.overruns, engine.busy_seconds
+    started, cpu_started = loop.time(), time.process_time()
+    until = started + seconds
+    await asyncio.gather(drive(until), _measure_lag(1 / tick_rate, until, lags))
+    wall = loop.time() - started
+    cpu = time.process_time() - cpu_started
+
+    for task in senders:
+        task.cancel()
+    engine.rooms.clear()
+    return {
+        "rooms": rooms,
+        "players": rooms * players,
+        "tick_rate": tick_rate,
+        "ticks": engine.ticks - ticks,
+        "expected_ticks": int(wall * tick_rate),
+        "overruns": engine.overruns - overruns,
+        "tick_busy": (engine.busy_seconds - busy) / wall,
+        "cpu": cpu / wall,
+        "lag_p50_ms": percentile(lags, 0.5) * 1000,
+        "lag_p99_ms": percentile(lags, 0.99) * 1000,
+        "messages_per_s": counters["messages"] / wall,
+        "mb_per_s": counters["bytes"] / wall / 1e6,
+        "reports_per_s": counters["reports"] / wall,
+    }
+
+
+def _metric(text: str, name: str) -> float:
+    match = re.search(rf"^{name} (\S+)$", text, re.M)
+    return float(match.group(1)) if match else 0.0
+
+
+async def run_remote(url: str, rooms: int, players: int, seconds: float, send_interval: float) -> dict:
+    import httpx
+
+    if websockets is None:
+        raise SystemExit("--url 需要 websockets（pip install websockets）")
+    http_url = re.sub(r"^ws", "http", url.rstrip("/"))
+    counters = {"messages": 0, "bytes": 0, "reports": 0}
+    prefix = f"bench-{int(time.time())}"
+    connections = []
+    for r in range(rooms):
+        for p in range(players):
+            ws = await websockets.connect(f"{url.rstrip('/')}/api/racing/rooms/{prefix}-{r}/ws?name=p{p}", max_queue=None)
+            connections.append(ws)
+
+    running = [asyncio.Event() for _ in connections]
+
+    async def receive(ws, started: asyncio.Event):
+        async for message in ws:
+            counters["messages"] += 1
+            counters["bytes"] += len(message)
+            if not started.is_set() and '"state":"running"' in message:
+                started.set()
+
+    async def send(ws, until: float):
+        loop = asyncio.get_running_loop()
+        progress = 0
+        await asyncio.sleep(send_interval * (id(ws) % 97) / 97)  # 错开上报
+        while loop.time() < until:
+            progress += 5
+            await ws.send('{"p": %d}' % progress)
+            counters["reports"] += 1
+            await asyncio.sleep(send_interval)
+
+    async with httpx.AsyncClient() as client:
+        loop = asyncio.get_running_loop()
+        receivers = [asyncio.create_task(receive(ws, event)) for ws, event in zip(connections, running)]
+        # 满员后还有倒计时，等所有房间开赛再计时
+        await asyncio.gather(*(event.wait() for event in running))
+        counters.update(messages=0, bytes=0)
+        before = (await client.get(f"{http_url}/metrics")).text
+        started = loop.time()
+        await asyncio.gather(*(send(ws, started + seconds) for ws in connections))
+        wall = loop.time() - started
+        after = (await client.get(f"{http_url}/metrics")).text
+
+    for ws in connections:
+        await ws.close()
+    for task in receivers:
+        task.cancel()
+    busy = _metric(after, "typequest_race_tick_busy_seconds_total") - _metric(before, "typequest_race_tick_busy_seconds_total")
+    return {
+        "rooms": rooms,
+        "players": rooms * players,
+        "ticks": int(_metric(after, "typequest_race_ticks_total") - _metric(before, "typequest_race_ticks_total")),
+        "overruns": int(_metric(after, "typequest_race_tick_overruns_total") - _metric(before, "typequest_race_tick_overruns_total")),
+        "tick_busy": busy / wall,
+        "messages_per_s": counters["messages"] / wall,
+        "mb_per_s": counters["bytes"] / wall / 1e6,
+        "reports_per_s": counters["reports"] / wall,
+    }
+
+
+def healthy(result: dict) -> bool:
+    """tick 跟得上：超时不超过 1%，事件循环延迟低于一个 tick 间隔"""
+    interval_ms = 1000 / result["tick_rate"]
+    return result["overruns"] <= 0.01 * max(result["expected_ticks"], 1) and result["lag_p99_ms"] < interval_ms
+
+
+def print_result(result: dict):
+    line = (f"{result['rooms']:>6} 房间 × {result['players'] // result['rooms']} 人 = {result['players']:>6} 玩家  "
+            f"tick {result['ticks']}/{result.get('expected_ticks', '-')}  超时 {result['overruns']}  "
+            f"tick 耗时占比 {result['tick_busy']:.1%}")
+    if "cpu" in result:
+        line += f"  CPU {result['cpu']:.1%}  循环延迟 p50/p99 {result['lag_p50_ms']:.1f}/{result['lag_p99_ms']:.1f} ms"
+    line += f"  推送 {result['messages_per_s']:.0f} 条/秒 ({result['mb_per_s']:.2f} MB/s)  上报 {result['reports_per_s']:.0f} 条/秒"
+    print(line)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="TypeQuest 多人竞速容量基准")
+    parser.add_argument("--rooms", type=int, default=200)
+    parser.add_argument("--players", type=int, default=8, help="每个房间的玩家数")
+    parser.add_argument("--tick-rate", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--send-interval", type=float, default=0.1, help="每个玩家上报进度的间隔（秒）")
+    parser.add_argument("--find", action="store_true", help="房间数逐步翻倍，找出单核可承载的规模")
+    parser.add_argument("--url", help="压测已在运行的实例，如 ws://127.0.0.1:8000")
+    args = parser.parse_args()
+
+    if args.url:
+        print_result(asyncio.run(run_remote(args.url, args.rooms, args.players, args.seconds, args.send_interval)))
+        return 0
+
+    rooms = args.rooms
+    capacity = None
+    while True:
+        result = asyncio.run(run_inprocess(rooms, args.players, args.tick_rate, args.seconds, args.send_interval))
+        print_result(result)
+        if not args.find:
+            break
+        if not healthy(result):
+            break
+        capacity = result
+        rooms *= 2
+    if args.find:
+        if capacity is None:
+            print(f"❌ {args.rooms} 个房间时 tick 已跟不上，请减小 --rooms")
+            return 1
+        print(f"📈 单核可承载约 {capacity['rooms']} 房间 × {args.players} 人"
+              f"（{capacity['players']} 名玩家，{args.tick_rate} Hz，每 {args.send_interval}s 上报一次）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
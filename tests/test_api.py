@@ -15,6 +15,16 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from fastapi.testclient import TestClient
 from main import app
+from server.analytics import AggregatesIndex
+from server.storage import SqliteStatsStore, StatsTable, open_stats_store
+from server.waves import AliasTable
+from server.word_index import WordDraw, WordIndex, WordQuery
+
+def _append_worker(path, worker):
+    store = open_stats_store(path)
+    for i in range(50):
+        store.append({"score": worker * 100 + i})
+
 
 class TestAPI:
     def __init__(self):
@@ -49,6 +59,20 @@ class TestAPI:
         }
         with open("data/content/defense_words.json", "w", encoding="utf-8") as f:
             json.dump(test_defense_words, f)
+
+        # 旧版 JSON 数组格式的统计文件，用于验证迁移
+        os.makedirs("userdata", exist_ok=True)
+        legacy_stats = [{
+            "wpm": 30.0, "accuracy": 90.0, "time_taken": 60, "errors": 5,
+            "mode": "classic", "timestamp": "2024-01-01T00:00:00"
+        }]
+        with open("userdata/game_stats.json", "w", encoding="utf-8") as f:
+            json.dump(legacy_stats, f)
+
+        # 管理接口需要令牌（测试客户端不是本机地址）
+        import main
+        main.ADMIN_TOKEN = "test-admin-token"
+        self.client.headers["X-Admin-Token"] = main.ADMIN_TOKEN
         
         print("✅ 测试环境设置完成")
     
@@ -113,6 +137,57 @@ class TestAPI:
         assert "gameplay" in data["data"]
         print("✅ 赛车模式配置测试通过")
     
+    def test_content_cache(self):
+        """测试内容缓存命中与文件变更失效"""
+        self.client.get("/api/words")
+        before = self.client.get("/api/admin/content").json()["data"]
+        assert self.client.get("/api/words").json()["data"] == ["hello", "world", "python", "test"]
+        after = self.client.get("/api/admin/content").json()["data"]
+        assert after["hits"] == before["hits"] + 1
+
+        with open("data/content/words.json", "w", encoding="utf-8") as f:
+            json.dump(["hello", "world", "python", "test", "cache"], f)
+        assert self.client.get("/api/words").json()["data"][-1] == "cache"
+
+        response = self.client.post("/api/admin/content/reload")
+        assert response.status_code == 200 and response.json()["data"]["dropped"] > 0
+
+        # 管理接口：令牌错误拒绝；未配置令牌时只允许本机访问
+        import main
+        from fastapi import HTTPException
+        from starlette.requests import Request
+        assert self.client.get("/api/admin/content", headers={"X-Admin-Token": "wrong"}).status_code == 403
+        token, main.ADMIN_TOKEN = main.ADMIN_TOKEN, None
+        try:
+            assert self.client.get("/api/admin/content").status_code == 403
+            for host, allowed in (("127.0.0.1", True), ("::1", True), ("203.0.113.5", False), ("testclient", False)):
+                request = Request({"type": "http", "client": (host, 50000), "headers": []})
+                try:
+                    main.require_admin(request, None)
+                    assert allowed, host
+                except HTTPException as e:
+                    assert not allowed and e.status_code == 403, host
+        finally:
+            main.ADMIN_TOKEN = token
+        print("✅ 内容缓存测试通过")
+
+    def test_conditional_get(self):
+        """测试 ETag 条件请求与预压缩响应"""
+        response = self.client.get("/api/texts")
+        etag = response.headers["etag"]
+        assert response.headers["cache-control"] == "no-cache"
+        cached = self.client.get("/api/texts", headers={"If-None-Match": etag})
+        assert cached.status_code == 304 and cached.content == b""
+
+        with open("data/content/texts.json", "w", encoding="utf-8") as f:
+            json.dump(["The quick brown fox jumps over the lazy dog."] * 50, f)
+        changed = self.client.get("/api/texts", headers={"If-None-Match": etag, "Accept-Encoding": "gzip"})
+        assert changed.status_code == 200
+        assert changed.headers["content-encoding"] == "gzip"
+        assert changed.headers["etag"] != etag
+        assert len(changed.json()["data"]) == 50
+        print("✅ 条件请求与压缩测试通过")
+
     def test_defense_wave_generation(self):
         """测试植物防御波次生成"""
         wave_config = {
@@ -127,6 +202,118 @@ class TestAPI:
         assert len(data["data"]["zombies"]) > 0
         print("✅ 植物防御波次生成测试通过")
     
+    def test_wave_sampler(self):
+        """测试别名表抽样与 defense.json 波次配置"""
+        import random
+        table = AliasTable({"basic": 0.6, "medium": 0.3, "strong": 0.1, "boss": 0})
+        draws = table.sample(20000, random.Random(7))
+        assert "boss" not in draws
+        assert abs(draws.count("basic") / 20000 - 0.6) < 0.02
+        assert abs(draws.count("strong") / 20000 - 0.1) < 0.02
+
+        os.makedirs("data/config", exist_ok=True)
+        config = {
+            "difficulty": {
+                "easy": {
+                    "waves": 2,
+                    "zombiesPerWave": [2, 7],
+                    "zombieTypesByWave": [{"basic": 1, "boss": 0}, {"basic": 0, "boss": 1}]
+                }
+            },
+            "zombieTypes": {},
+            "bossWordCombos": []
+        }
+        with open("data/config/defense.json", "w", encoding="utf-8") as f:
+            json.dump(config, f)
+        wave = self.client.post("/api/defense/wave", json={"difficulty": "easy", "wave": 2}).json()["data"]
+        assert wave["zombie_count"] == 7
+        assert {z["type"] for z in wave["zombies"]} == {"boss"}
+        campaign = self.client.post("/api/defense/campaign", json={"difficulty": "easy"}).json()["data"]
+        assert campaign["total_waves"] == 2
+        os.remove("data/config/defense.json")
+        print("✅ 波次抽样测试通过")
+
+    def test_word_index(self):
+        """测试单词索引的不放回抽取与约束"""
+        import random
+        words = [f"{a}{b}{c}" for a in "abcdef" for b in "ghijkl" for c in "mnopqr"]
+        index = WordIndex({"basic": words, "boss": ["extraordinary"]})
+        draw = WordDraw(index, random.Random(1))
+        drawn = [draw.draw("basic") for _ in range(len(words))]
+        assert sorted(drawn) == sorted(words)
+
+        query = WordQuery(avoid_letters="ab", max_length=3)
+        draw = WordDraw(index, random.Random(2), query)
+        assert all(not set(draw.draw("basic")) & {"a", "b"} for _ in range(50))
+        # 约束无解时放宽为该类型的全部单词
+        assert WordDraw(index, random.Random(3), query).draw("boss") == "extraordinary"
+
+        wave = self.client.post("/api/defense/wave", json={
+            "difficulty": "easy", "wave": 1, "avoid_letters": "c", "max_word_length": 5
+        }).json()["data"]
+        assert all("c" not in z["word"] for z in wave["zombies"] if z["type"] == "basic")
+        print("✅ 单词索引测试通过")
+
+    def test_defense_campaign(self):
+        """测试整场战役批量与流式生成"""
+        campaign = self.client.post("/api/defense/campaign", json={"difficulty": "easy", "seed": 42}).json()["data"]
+        assert campaign["seed"] == 42
+        assert campaign["total_waves"] == len(campaign["waves"]) == 4
+        again = self.client.post("/api/defense/campaign", json={"difficulty": "easy", "seed": 42}).json()["data"]
+        assert again["waves"] == campaign["waves"]
+
+        single = self.client.post("/api/defense/wave", json={"difficulty": "easy", "wave": 2, "seed": 42}).json()["data"]
+        assert single["zombies"] == campaign["waves"][1]["zombies"]
+
+        response = self.client.post("/api/defense/campaign/stream", json={"difficulty": "easy", "seed": 42})
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert lines[0] == {"difficulty": "easy", "seed": 42, "total_waves": 4}
+        assert lines[1:] == campaign["waves"]
+        print("✅ 战役批量生成测试通过")
+
+    def test_defense_simulator(self):
+        """测试植物防御平衡模拟：规则不变量、打字速度单调性、结果与进程数和分批无关"""
+        from server.simulator import DefenseRules, Typist, sweep
+
+        with open(Path(__file__).parent.parent / "data/config/defense.json", "r", encoding="utf-8") as f:
+            config = json.load(f)
+        with open("data/content/defense_words.json", "r", encoding="utf-8") as f:
+            words = json.load(f)
+        rules = DefenseRules(config, words)
+        typists = [Typist(5), Typist(30), Typist(60), Typist(250, 0.0, reaction_ms=100)]
+        results = {(r.difficulty, r.typist.wpm): r.summary()
+                   for r in sweep(rules, ["easy", "medium"], typists, 400, workers=1, chunk=150)}
+        for summary in results.values():
+            waves = summary["waves"]
+            assert waves[0]["reached"] == summary["games"] == 400
+            for wave, following in zip(waves, waves[1:]):
+                assert wave["cleared"] + wave["died"] + wave["stalled"] == wave["reached"]
+                assert following["reached"] == wave["cleared"]
+            assert waves[-1]["cleared"] / summary["games"] * 100 == summary["victory_rate"]
+        assert results[("easy", 5)]["victory_rate"] == 0 and results[("easy", 250)]["victory_rate"] == 100
+        for difficulty in ("easy", "medium"):
+            rates = [results[(difficulty, t.wpm)]["victory_rate"] for t in typists]
+            assert rates == sorted(rates)
+
+        # 分批方式与进程数不影响结果；宽松规则（漏过不卡住）胜率不低于前端规则
+        again = sweep(rules, ["medium"], typists[1:3], 400, workers=2, chunk=150)
+        assert [r.summary() for r in again] == [results[("medium", t.wpm)] for t in typists[1:3]]
+        forgiving = sweep(DefenseRules(config, words, forgiving=True), ["medium"], typists[1:2], 400, workers=1, chunk=150)
+
+        # 不放回抽取只生成 局数 × k 的矩阵：每局互不相同，整体均匀
+        import numpy as np
+        from server.simulator import _distinct_draws
+        drawn = _distinct_draws(np.random.default_rng(1), 20000, 100_000, 8)
+        assert drawn.shape == (20000, 8) and all(len(set(row)) == 8 for row in drawn[:500].tolist())
+        assert drawn.min() >= 0 and drawn.max() < 100_000 and abs(drawn.mean() - 50_000) < 1000
+        small = _distinct_draws(np.random.default_rng(2), 30000, 3, 3)
+        assert (np.sort(small, axis=1) == [0, 1, 2]).all()
+        first = np.bincount(small[:, 0], minlength=3)
+        assert all(9000 < c < 11000 for c in first)  # 顺序也是均匀的
+        assert forgiving[0].summary()["victory_rate"] >= results[("medium", 30)]["victory_rate"]
+        print("✅ 防御平衡模拟测试通过")
+
     def test_save_game_stats(self):
         """测试保存游戏统计"""
         stats = {
@@ -160,6 +347,55 @@ class TestAPI:
         assert data["status"] == "success"
         print("✅ 保存植物防御统计测试通过")
     
+    def test_concurrent_stats_writes(self):
+        """测试并发提交被合并写入且不阻塞事件循环"""
+        import asyncio
+        import httpx
+        from main import get_stats_table, get_stats_writer
+
+        async def submit_all():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                stats = {"wpm": 50.0, "accuracy": 97.0, "time_taken": 30, "errors": 1, "mode": "words"}
+                responses = await asyncio.gather(*[client.post("/api/stats", json=stats) for _ in range(40)])
+                return [r.status_code for r in responses]
+
+        before = len(self.client.get("/api/stats").json()["data"])
+        writer = get_stats_writer(get_stats_table("userdata/game_stats.json"))
+        flushes = writer.flushes
+        assert asyncio.run(submit_all()) == [200] * 40
+        assert len(self.client.get("/api/stats").json()["data"]) == before + 40
+        assert writer.flushes - flushes < 40
+        print("✅ 并发写入合并测试通过")
+
+    def test_stats_batch(self):
+        """测试批量上报：逐条结果、幂等键去重与重试"""
+        item = {"wpm": 55.0, "accuracy": 96.0, "time_taken": 45, "errors": 2, "mode": "words"}
+        batch = [
+            {**item, "idempotency_key": "kiosk-1"},
+            {**item, "idempotency_key": "kiosk-1"},
+            {"accuracy": 96.0, "mode": "words"},
+            {**item, "timestamp": "2025-06-01T12:00:00"},
+        ]
+        before = len(self.client.get("/api/stats").json()["data"])
+        data = self.client.post("/api/stats/batch", json=batch).json()["data"]
+        assert [r["status"] for r in data["results"]] == ["created", "duplicate", "invalid", "created"]
+        assert (data["created"], data["duplicate"], data["invalid"]) == (2, 1, 1)
+        assert data["results"][2]["errors"][0]["loc"] == ["wpm"]
+        # 重试同一批：带幂等键的记录不会重复写入
+        retry = self.client.post("/api/stats/batch", json=batch[:2]).json()["data"]
+        assert retry["created"] == 0 and retry["duplicate"] == 2
+        records = self.client.get("/api/stats").json()["data"]
+        assert len(records) == before + 2
+        assert records[-1]["timestamp"] == "2025-06-01T12:00:00"
+        assert "idempotency_key" not in records[-1]
+        defense = {"score": 900, "wave": 2, "total_waves": 4, "zombies_killed": 9, "plant_health": 50,
+                   "difficulty": "easy", "victory": False, "play_time": 60.0, "idempotency_key": "bot-1"}
+        data = self.client.post("/api/defense/stats/batch", json=[defense, defense]).json()["data"]
+        assert data["created"] == 1 and data["duplicate"] == 1
+        assert self.client.post("/api/stats/batch", json=[item] * 1001).status_code == 422
+        print("✅ 批量上报测试通过")
+
     def test_get_stats(self):
         """测试获取统计数据"""
         response = self.client.get("/api/stats")
@@ -169,6 +405,182 @@ class TestAPI:
         assert isinstance(data["data"], list)
         print("✅ 获取统计数据测试通过")
     
+    def test_stats_migration(self):
+        """测试旧版统计文件迁移到追加式存储"""
+        assert os.path.exists("userdata/game_stats.jsonl")
+        assert os.path.exists("userdata/game_stats.json.migrated")
+        assert not os.path.exists("userdata/game_stats.json")
+        data = self.client.get("/api/stats").json()["data"]
+        assert data[0]["timestamp"] == "2024-01-01T00:00:00"
+        assert data[-1]["wpm"] == 45.5
+        print("✅ 统计数据迁移测试通过")
+
+    def test_stats_history_query(self):
+        """测试统计历史的游标分页、时间筛选、字段投影与流式输出"""
+        full = self.client.get("/api/stats").json()
+        assert full["next_cursor"] is None
+        pages, cursor = [], None
+        while True:
+            params = {"limit": 1, **({"cursor": cursor} if cursor else {})}
+            page = self.client.get("/api/stats", params=params).json()
+            pages.extend(page["data"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        assert pages == full["data"]
+        recent = self.client.get("/api/stats", params={"since": "2025-01-01"}).json()["data"]
+        assert [r["wpm"] for r in recent] == [45.5]
+        old = self.client.get("/api/stats", params={"until": "2025-01-01", "fields": "wpm,timestamp"}).json()["data"]
+        assert old == [{"wpm": 30.0, "timestamp": "2024-01-01T00:00:00"}]
+        latest = self.client.get("/api/stats", params={"order": "desc", "limit": 1}).json()["data"]
+        assert latest[0]["wpm"] == 45.5
+        assert self.client.get("/api/stats", params={"mode": "words"}).json()["data"] == []
+        assert self.client.get("/api/stats", params={"cursor": "!!"}).status_code == 400
+        response = self.client.get("/api/stats/stream", params={"mode": "classic"})
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        assert lines == full["data"]
+        # 时间戳乱序写入时仍按时间排序
+        from server.history import HistoryIndex
+        index = HistoryIndex("mode")
+        index.add_many([{"timestamp": "b", "mode": "x"}, {"timestamp": "a", "mode": "y"}], [10, 20])
+        assert index.select()[0] == [(10, 20), (0, 10)]
+        assert index.select(group="x", since="b")[0] == [(0, 10)]
+        print("✅ 统计历史查询测试通过")
+
+    def test_columnar_stats(self):
+        """测试列式统计索引：与历史索引结果一致、向量化聚合与排序、内存占用"""
+        import random
+        import tracemalloc
+        from server import columnar
+        from server.columnar import ColumnarIndex
+        from server.history import HistoryIndex
+
+        rng = random.Random(7)
+        records = [{"wpm": rng.randint(100, 1200) / 10, "accuracy": rng.randint(600, 1000) / 10, "time_taken": 60,
+                    "errors": rng.randint(0, 9), "mode": rng.choice(["classic", "words", None]),
+                    "timestamp": f"2024-06-{rng.randint(1, 9):02d}T{rng.randint(0, 23):02d}:00:00"}
+                   for _ in range(3000)]
+        positions = list(range(10, 10 * len(records) + 1, 10))
+        history = HistoryIndex("mode")
+        history.add_many(records, positions)
+        # 小批逐条插入与大批整体重排得到同样的顺序
+        incremental, bulk = ColumnarIndex("game", "mode"), ColumnarIndex("game", "mode")
+        for i in range(0, 600, 7):
+            incremental.add_many(records[i:min(i + 7, 600)], positions[i:min(i + 7, 600)])
+        bulk.add_many(records[:600], positions[:600])
+        incremental.add_many(records[600:], positions[600:])
+        bulk.add_many(records[600:], positions[600:])
+        for index in (incremental, bulk):
+            for kwargs in ({}, {"group": "words"}, {"since": "2024-06-03", "until": "2024-06-05T12:00:00"},
+                           {"group": "classic", "limit": 50, "descending": True}):
+                assert index.select(**kwargs) == history.select(**kwargs)
+            spans, cursor = index.select(group="words", limit=100)
+            assert index.select(group="words", cursor=cursor, limit=100) == history.select(group="words", cursor=cursor, limit=100)
+        assert bulk.select(group="racing") == ([], None)
+        # 数值列为 float64：与原始记录的值完全一致
+        assert bulk.columns["wpm"].tolist() == [r["wpm"] for r in records]
+
+        def expected(selected):
+            wpm = [r["wpm"] for r in selected]
+            ranked = sorted(range(len(records)), key=lambda i: (-records[i]["wpm"], i))
+            return sum(wpm) / len(wpm), [positions[i] for i in ranked if records[i] in selected][:5]
+
+        window = [r for r in records if "2024-06-03" <= r["timestamp"] < "2024-06-06" and r["mode"] == "words"]
+        avg_wpm, top_ends = expected(window)
+        vectorized = bulk.aggregate("words", "2024-06-03", "2024-06-06")
+        numpy_module, columnar.np = columnar.np, None
+        try:
+            looped = bulk.aggregate("words", "2024-06-03", "2024-06-06")
+            looped_top = bulk.top("wpm", 5, group="words", since="2024-06-03", until="2024-06-06")
+        finally:
+            columnar.np = numpy_module
+        assert vectorized.count == looped.count == len(window)
+        assert vectorized.mode_counts == looped.mode_counts == {"words": len(window)}
+        assert vectorized.wpm_histogram.counts == looped.wpm_histogram.counts
+        for result in (vectorized, looped):
+            assert abs(result.summary()["avg_wpm"] - avg_wpm) < 1e-3
+        top = bulk.top("wpm", 5, group="words", since="2024-06-03", until="2024-06-06")
+        assert [end for _, end in top] == [end for _, end in looped_top] == top_ends
+        assert bulk.aggregate(since="2030-01-01").count == 0
+        assert bulk.aggregate(group=None).mode_counts["unknown"] == sum(1 for r in records if r["mode"] is None)
+
+        # 内存：列式至少比 dict + 历史索引元组小 10 倍
+        lines = [json.dumps(r) for r in records]
+        tracemalloc.start()
+        parsed = [json.loads(line) for line in lines]
+        HistoryIndex("mode").add_many(parsed, positions)
+        dict_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        assert bulk.memory_bytes() * 10 < dict_bytes
+
+        # 接口：限定时间范围的分析与排行榜走列式索引
+        recent = self.client.get("/api/analytics", params={"since": "2025-01-01", "percentiles": "true"}).json()["data"]
+        assert recent["traditional_games"] == 1 and recent["average_performance"]["traditional"]["avg_wpm"] == 45.5
+        assert 45.5 <= recent["percentiles"]["wpm"]["p50"] < 46  # 分位数按 0.5 宽的分桶估算
+        old = self.client.get("/api/analytics", params={"until": "2025-01-01"}).json()["data"]
+        assert old["traditional_games"] == 1 and old["mode_distribution"] == {"classic": 1}
+        board = self.client.get("/api/leaderboard", params={"since": "2025-01-01"}).json()["data"]
+        assert [r["wpm"] for r in board] == [45.5]
+        assert self.client.get("/api/leaderboard", params={"until": "2025-01-01", "mode": "words"}).json()["data"] == []
+        assert self.client.get("/api/analytics", params={"since": "yesterday"}).status_code == 400
+        assert self.client.get("/api/stats", params={"until": "not-a-date"}).status_code == 400
+        print("✅ 列式统计索引测试通过")
+
+    def test_sqlite_backend(self):
+        """测试 SQLite 存储后端"""
+        store = open_stats_store(os.path.abspath("userdata/sqlite_stats.json"), "sqlite")
+        assert isinstance(store, SqliteStatsStore)
+        store.append({"score": 1})
+        store.append_many([{"score": 2}, {"score": 3}])
+        assert [r["score"] for r in store.load_all()] == [1, 2, 3]
+        assert [r["score"] for r in store.read_spans([(3, 4), (1, 2)])] == [3, 1]
+        assert store.append_many([{"score": 4}, {"score": 5}], dedupe=lambda rs: rs[1:]) == [{"score": 5}]
+        assert store.append_many([{"score": 6}], dedupe=lambda rs: []) == []
+        assert [r["score"] for r in store.load_all()] == [1, 2, 3, 5]
+        store.close()
+        print("✅ SQLite 存储后端测试通过")
+
+    def test_multi_worker_store(self):
+        """测试多进程并发写入与跨 worker 索引同步"""
+        import multiprocessing
+        from server.leaderboard import LeaderboardIndex
+        path = os.path.abspath("userdata/worker_stats.json")
+        # 两个 StatsTable 模拟两个 worker 各自的内存索引
+        table_a = StatsTable(open_stats_store(path), {"leaderboard": LeaderboardIndex("score")})
+        table_b = StatsTable(open_stats_store(path), {"leaderboard": LeaderboardIndex("score")})
+        table_a.store.append({"score": 10})
+        table_b.store.append({"score": 20})  # 写入前先追读 worker A 的记录
+        assert [r["score"] for r in table_b.indexes["leaderboard"].top()] == [20, 10]
+        table_a.sync()
+        assert [r["score"] for r in table_a.indexes["leaderboard"].top()] == [20, 10]
+
+        processes = [
+            multiprocessing.get_context("fork").Process(target=_append_worker, args=(path, n))
+            for n in range(4)
+        ]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        records = open_stats_store(path).load_all()
+        assert len(records) == 2 + 4 * 50
+        table_a.sync()
+        assert len(table_a.indexes["leaderboard"].top(limit=100)) == 100
+
+        # 写入中途崩溃留下的半行：下次写入前截掉，新记录不会与它粘成一行
+        path = os.path.abspath("userdata/torn_stats.json")
+        store = open_stats_store(path)
+        store.append({"score": 1})
+        with open(store.path, "ab") as f:
+            f.write(b'{"score": 2')
+        table = StatsTable(open_stats_store(path), {"leaderboard": LeaderboardIndex("score")})
+        table.store.append({"score": 3})
+        assert [r["score"] for r in open_stats_store(path).load_all()] == [1, 3]
+        reopened = StatsTable(open_stats_store(path), {"leaderboard": LeaderboardIndex("score")})
+        assert [r["score"] for r in reopened.indexes["leaderboard"].top()] == [3, 1]
+        print("✅ 多进程存储测试通过")
+
     def test_get_leaderboard(self):
         """测试获取排行榜"""
         response = self.client.get("/api/leaderboard")
@@ -178,6 +590,434 @@ class TestAPI:
         assert isinstance(data["data"], list)
         print("✅ 获取排行榜测试通过")
     
+    def test_leaderboard_filters(self):
+        """测试排行榜分页与分组"""
+        for wpm, mode in [(80.0, "words"), (60.0, "words"), (70.0, "classic")]:
+            stats = {"wpm": wpm, "accuracy": 99.0, "time_taken": 60, "errors": 0, "mode": mode}
+            assert self.client.post("/api/stats", json=stats).status_code == 200
+
+        top = self.client.get("/api/leaderboard?limit=2").json()["data"]
+        assert [s["wpm"] for s in top] == [80.0, 70.0]
+        second = self.client.get("/api/leaderboard?limit=1&offset=1").json()["data"]
+        assert second[0]["wpm"] == 70.0
+        # 只维护前 LEADERBOARD_CAPACITY 名，超出的分页明确报错
+        from main import LEADERBOARD_CAPACITY
+        assert self.client.get(f"/api/leaderboard?limit=10&offset={LEADERBOARD_CAPACITY - 10}").status_code == 200
+        assert self.client.get(f"/api/leaderboard?limit=10&offset={LEADERBOARD_CAPACITY - 9}").status_code == 400
+        assert self.client.get(f"/api/defense/leaderboard?offset={LEADERBOARD_CAPACITY}").status_code == 400
+        words = self.client.get("/api/leaderboard?mode=words").json()["data"]
+        assert [s["wpm"] for s in words] == [80.0, 60.0]
+
+        easy = self.client.get("/api/defense/leaderboard?difficulty=easy").json()["data"]
+        assert all(s["difficulty"] == "easy" for s in easy) and len(easy) > 0
+        assert self.client.get("/api/defense/leaderboard?difficulty=hard").json()["data"] == []
+        print("✅ 排行榜分页与分组测试通过")
+
+    def test_player_profiles(self):
+        """测试玩家索引：按玩家的历史分页、个人最佳与基于树状数组的名次"""
+        import random
+        from server.players import PlayerIndex, RankTree, personal_bests
+
+        games = [("p-alice", 50, "classic"), ("p-bob", 70, "classic"), ("p-alice", 65, "words"),
+                 ("p-carol", 65, "classic"), ("p-alice", 40, "classic"), ("p-bob", 60, "words")]
+        for player, wpm, mode in games:
+            stats = {"wpm": wpm, "accuracy": 95.0, "time_taken": 60, "errors": 1, "mode": mode, "player_id": player}
+            assert self.client.post("/api/stats", json=stats).status_code == 200
+        batch = [{"wpm": 80, "accuracy": 99.0, "time_taken": 60, "errors": 0, "mode": "racing", "player_id": "p-dave"},
+                 {"wpm": 30, "accuracy": 90.0, "time_taken": 60, "errors": 3, "mode": "racing", "player_id": ""}]
+        results = self.client.post("/api/stats/batch", json=batch).json()["data"]["results"]
+        assert [r["status"] for r in results] == ["created", "invalid"]
+
+        alice = self.client.get("/api/players/p-alice").json()["data"]
+        assert alice["defense"] is None and alice["game"]["best"]["wpm"] == 65
+        # 全局：dave 80 > bob 70 > alice 65 = carol 65（并列第 3）
+        assert alice["game"]["rank"] == 3 and alice["game"]["players"] == 4
+        assert self.client.get("/api/players/p-carol").json()["data"]["game"]["rank"] == 3
+        groups = alice["game"]["groups"]
+        assert list(groups) == ["classic", "words"]
+        assert groups["classic"]["best"]["wpm"] == 50 and groups["classic"]["rank"] == 3 and groups["classic"]["players"] == 3
+        assert groups["words"]["rank"] == 1 and groups["words"]["players"] == 2
+        assert self.client.get("/api/players/nobody").status_code == 404
+
+        # 个人历史：按玩家（可再按模式）分页，不含其他玩家
+        page = self.client.get("/api/stats?player_id=p-alice&limit=2").json()
+        assert [r["wpm"] for r in page["data"]] == [50, 65] and page["next_cursor"]
+        rest = self.client.get(f"/api/stats?player_id=p-alice&limit=2&cursor={page['next_cursor']}").json()
+        assert [r["wpm"] for r in rest["data"]] == [40] and rest["next_cursor"] is None
+        latest = self.client.get("/api/stats?player_id=p-alice&mode=classic&order=desc").json()["data"]
+        assert [r["wpm"] for r in latest] == [40, 50]
+        assert self.client.get("/api/stats?player_id=nobody").json()["data"] == []
+        anonymous = self.client.get("/api/stats?limit=1").json()["data"][0]
+        assert "player_id" not in anonymous
+
+        defense = {"score": 900, "wave": 3, "total_waves": 5, "zombies_killed": 20, "plant_health": 50,
+                   "difficulty": "hard", "victory": False, "play_time": 120.0, "player_id": "p-alice"}
+        assert self.client.post("/api/defense/stats", json=defense).status_code == 200
+        alice = self.client.get("/api/players/p-alice").json()["data"]
+        assert alice["defense"]["best"]["score"] == 900 and alice["defense"]["rank"] == 1
+        assert list(alice["defense"]["groups"]) == ["hard"]
+
+        # 树状数组名次与排序结果一致（含扩容、更新最佳与超出上限的分数）
+        rng = random.Random(7)
+        tree, bests = RankTree(0.5, 5000, size=4), {}
+        for _ in range(2000):
+            player, score = rng.randrange(300), rng.choice([rng.uniform(0, 200), rng.uniform(0, 8000)])
+            if score > bests.get(player, -1):
+                if player in bests:
+                    tree.add(bests[player], -1)
+                tree.add(score)
+                bests[player] = score
+        slot = lambda score: min(round(score / 0.5), 10000)
+        for player, score in bests.items():
+            assert tree.count_above(score) == sum(slot(other) > slot(score) for other in bests.values())
+        assert tree.total == len(bests)
+
+        # 种子（归档中的个人最佳）先于热数据计入，同分时先到者保持为最佳
+        archived = [{"wpm": 90, "mode": "classic", "player_id": "x"}, {"wpm": 95, "mode": "words", "player_id": "x"},
+                    {"wpm": 90, "mode": "classic", "player_id": "x"}, {"wpm": 10, "mode": "classic"}]
+        seed = personal_bests(archived, "wpm", "mode")
+        assert seed == archived[:2] and seed[0] is archived[0]
+        index = PlayerIndex("wpm", "mode", 0.01, 1000, seed=lambda: seed)
+        index.add_many([{"wpm": 92, "mode": "classic", "player_id": "x", "timestamp": "2026-01-01"}], [10])
+        profile = index.profile("x")
+        assert profile["best"]["wpm"] == 95 and profile["groups"]["classic"]["best"]["wpm"] == 92
+        assert index.select("x", group="classic") == ([(0, 10)], None) and len(index) == 1
+        print("✅ 玩家索引测试通过")
+
+    def test_live_leaderboard(self):
+        """测试排行榜实时推送：快照 + 差异，未进榜的提交不推送，慢消费者合并为快照"""
+        from server.live import LiveMessage, Subscriber, diff_inserts
+
+        def post(wpm):
+            stats = {"wpm": wpm, "accuracy": 99.0, "time_taken": 60, "errors": 0, "mode": "classic"}
+            assert self.client.post("/api/stats", json=stats).status_code == 200
+
+        with self.client.websocket_connect("/api/leaderboard/live?limit=2&mode=classic") as ws:
+            snapshot = ws.receive_json()
+            assert snapshot["type"] == "snapshot"
+            entries = snapshot["entries"]
+            assert entries == self.client.get("/api/leaderboard?limit=2&mode=classic").json()["data"]
+
+            post(500.0)
+            diff = ws.receive_json()
+            assert diff["type"] == "diff" and diff["version"] == snapshot["version"] + 1
+            assert [(i["rank"], i["entry"]["wpm"]) for i in diff["inserts"]] == [(0, 500.0)]
+            entries.insert(0, diff["inserts"][0]["entry"])
+            post(1.0)  # 未进入前 2 名，不推送
+            post(400.0)
+            diff = ws.receive_json()
+            assert diff["version"] == snapshot["version"] + 2
+            assert [(i["rank"], i["entry"]["wpm"]) for i in diff["inserts"]] == [(1, 400.0)]
+            entries.insert(1, diff["inserts"][0]["entry"])
+            assert [e["wpm"] for e in entries[:diff["size"]]] == [500.0, 400.0]
+
+        a, b, c = {"wpm": 3}, {"wpm": 2}, {"wpm": 1}
+        assert diff_inserts([a, c], [a, b]) == [(1, b)]
+        assert diff_inserts([a, b], [c]) is None
+
+        subscriber = Subscriber(websocket=None)
+        subscriber.offer(LiveMessage(0, {"entries": [a]}, None))
+        subscriber.offer(LiveMessage(1, {"entries": [a, b]}, '{"type": "diff"}'))
+        assert json.loads(subscriber.pending) == {"type": "snapshot", "version": 1, "entries": [a, b]}
+        print("✅ 排行榜实时推送测试通过")
+
+    def test_keystroke_timelines(self):
+        """测试按键时间线：紧凑编码、往返一致、最佳幽灵与回放"""
+        from server.timeline import decode_timeline, encode_timeline
+
+        texts = ["the quick brown fox jumps over the lazy dog " * 3, "practice makes perfect " * 3]
+        keys, intervals = [], []
+        for i, ch in enumerate("".join(texts)):
+            if i == 10:
+                keys += ["x", "\b"]  # 一次按错后退格
+                intervals += [150, 90]
+            keys.append(ch)
+            intervals.append(120 + (i * 37) % 140)
+        timeline = {"mode": "classic", "texts": texts, "keys": "".join(keys), "intervals": intervals}
+
+        response = self.client.post("/api/timelines", json=timeline)
+        assert response.status_code == 200
+        saved = response.json()["data"]
+        assert saved["keystrokes"] == len(keys) and saved["errors"] == 1
+        assert saved["duration_ms"] == sum(intervals)
+        # 约一分钟、两百多次按键：几百字节，而逐键 JSON 有十几 KB
+        per_key_json = json.dumps([{"key": k, "time": t, "correct": True} for k, t in zip(keys, intervals)])
+        assert saved["bytes"] < 700 and len(per_key_json) > 20 * saved["bytes"]
+
+        detail = self.client.get(f"/api/timelines/{saved['id']}").json()["data"]
+        assert detail["keys"] == timeline["keys"] and detail["intervals"] == intervals
+        assert detail["correct"][10:12] == [0, 0] and sum(detail["correct"]) == len(keys) - 2
+
+        blob = self.client.get(f"/api/timelines/{saved['id']}?format=binary").content
+        assert len(blob) == saved["bytes"]
+        assert blob == encode_timeline(texts, timeline["keys"], intervals)
+        assert decode_timeline(blob, texts).keys == timeline["keys"]
+
+        slower = {**timeline, "intervals": [i * 2 for i in intervals]}
+        assert self.client.post("/api/timelines", json=slower).status_code == 200
+        best = self.client.get("/api/timelines/best?mode=classic").json()["data"]
+        assert best["id"] == saved["id"] and "offset" not in best
+        assert self.client.get("/api/timelines/best?mode=racing").status_code == 404
+
+        replay = self.client.get(f"/api/timelines/{saved['id']}/replay?paced=false")
+        lines = [json.loads(line) for line in replay.text.splitlines()]
+        assert lines[0]["id"] == saved["id"] and len(lines) == len(keys) + 1
+        assert lines[-1][0] == sum(intervals) and lines[12] == [sum(intervals[:12]), "\b", 0]
+
+        bad = {**timeline, "intervals": intervals[:-1]}
+        assert self.client.post("/api/timelines", json=bad).status_code == 400
+        for interval in (10**20, -1):
+            bad = {**timeline, "keys": "ab", "intervals": [interval, 5]}
+            assert self.client.post("/api/timelines", json=bad).status_code == 422
+        try:
+            encode_timeline(["ab"], "ab", [10**20, 5])
+            assert False, "超长间隔应被拒绝"
+        except ValueError:
+            pass
+        from server.timeline import MAX_INTERVAL_MS, _write_varint
+        legacy = bytearray((1,))
+        for value in (2, 10**20 << 1, 5 << 1):
+            _write_varint(legacy, value)
+        assert list(decode_timeline(bytes(legacy), ["ab"]).intervals) == [MAX_INTERVAL_MS, 5]
+        assert self.client.get("/api/timelines/missing").status_code == 404
+
+        # 并发写入与独占（压缩）同时进行：加锁顺序一致，不会死锁，各条按键数据的偏移互不交错
+        import threading
+        from main import get_stats_table
+        from server.timeline import append_timeline, read_timeline
+        table = get_stats_table("userdata/timelines.json")
+        written = []
+
+        def writer(worker):
+            for i in range(20):
+                blob = encode_timeline(["ab"], "ab", [worker * 100 + i, 1])
+                written.append((append_timeline(table, {"id": f"w{worker}-{i}", "texts": ["ab"]}, blob), blob))
+
+        def compactor():
+            for _ in range(50):
+                with table.store.exclusive():
+                    pass
+
+        threads = [threading.Thread(target=writer, args=(w,)) for w in range(4)] + [threading.Thread(target=compactor)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=30)
+        assert not any(thread.is_alive() for thread in threads) and len(written) == 80
+        assert all(read_timeline(table, record) == blob for record, blob in written)
+        print("✅ 按键时间线测试通过")
+
+    def test_key_heatmap(self):
+        """测试按键热力图：逐键 / 二元组的次数、错误率与延迟，全体与按玩家"""
+        from server import heatmap as heatmap_module
+        from server.heatmap import KEYS, Heatmap, HeatmapIndex, PlayerHeatmap
+        from server.timeline import decode_timeline, encode_timeline
+
+        # a b x(应为 a) 退格 a b；最后一次间隔超过上限，不计入延迟
+        timeline = {"mode": "classic", "player_id": "heat-1", "texts": ["abab"],
+                    "keys": "abx\bab", "intervals": [500, 100, 150, 80, 120, 2500]}
+        assert self.client.post("/api/timelines", json=timeline).status_code == 200
+
+        data = self.client.get("/api/analytics/heatmap?player_id=heat-1").json()["data"]
+        a, b = KEYS.index("a"), KEYS.index("b")
+        assert data["timelines"] == 1 and data["keys"][a] == "a" and len(data["keys"]) == len(KEYS) + 1
+        assert data["count"][a] == 3 and data["error_rate"][a] == 33.33 and data["avg_latency_ms"][a] == 120.0
+        assert data["count"][b] == 2 and data["error_rate"][b] == 0.0 and data["avg_latency_ms"][b] == 100.0
+        assert data["count"][KEYS.index("z")] == 0 and data["error_rate"][KEYS.index("z")] is None
+
+        pairs = self.client.get("/api/analytics/heatmap?player_id=heat-1&kind=bigrams").json()["data"]
+        assert pairs["count"][a][b] == 2 and pairs["avg_latency_ms"][a][b] == 100.0
+        assert pairs["count"][b][a] == 1 and pairs["error_rate"][b][a] == 100.0 and pairs["avg_latency_ms"][b][a] is None
+
+        overall = self.client.get("/api/analytics/heatmap").json()["data"]
+        assert overall["player_id"] is None and overall["timelines"] >= 1
+        assert overall["count"][a] >= 3
+        assert self.client.get("/api/analytics/heatmap?player_id=nobody").status_code == 404
+        assert self.client.get("/api/analytics/heatmap?kind=trigrams").status_code == 422
+
+        # NumPy 向量化与逐键累加结果一致（大写折叠、未知字符归入「其他」）
+        texts = ["Hello, World! é", "typing practice"]
+        keys = "Hello, Wx\borld! é" + "typinq\bg practice"
+        blob = encode_timeline(texts, keys, [(i * 53) % 400 + 40 for i in range(len(keys))])
+        keystrokes = decode_timeline(blob, texts)
+        vectorized, looped = Heatmap(), Heatmap()
+        vectorized.add(keystrokes)
+        numpy_module, heatmap_module.np = heatmap_module.np, None
+        try:
+            looped.add(keystrokes)
+            assert looped.keys() == vectorized.keys() and looped.bigrams() == vectorized.bigrams()
+        finally:
+            heatmap_module.np = numpy_module
+        assert vectorized.keys()["count"][len(KEYS)] == 1 and vectorized.keys()["count"][KEYS.index("h")] == 1
+        # 玩家的稀疏计数与稠密矩阵结果一致
+        sparse = PlayerHeatmap()
+        sparse.add(keystrokes)
+        assert sparse.keys() == vectorized.keys() and sparse.bigrams() == vectorized.bigrams()
+        assert len(sparse.cells) < 100
+
+        # 检查点：重新打开后无需回放即可得到同样的矩阵
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "timelines")
+            with open(path + ".bin", "wb") as f:
+                f.write(blob)
+            record = {"texts": texts, "offset": 0, "length": len(blob), "player_id": "p"}
+            index = HeatmapIndex(path + ".bin", path + ".heatmap.bin")
+            index.add_many([record], [42])
+            index.flush()
+            reopened = HeatmapIndex(path + ".bin", path + ".heatmap.bin")
+            assert reopened.position == 42 and reopened.get("p").timelines == 1
+            assert reopened.get().bigrams() == vectorized.bigrams()
+            assert reopened.get("p").bigrams() == vectorized.bigrams()
+
+            # 内存中只留最近用到的玩家，被换出的玩家写入各自的检查点，按需载入
+            index = HeatmapIndex(path + ".bin", path + ".heatmap.bin", max_players=2)
+            players = [dict(record, player_id=f"p{i}") for i in range(5)]
+            index.add_many(players, [43 + i for i in range(5)])
+            assert list(index.players) == ["p3", "p4"] and len(os.listdir(path + ".heatmap.players")) == 4
+            assert index.get("p0").timelines == 1 and "p0" in index.players
+            assert index.get("p").timelines == 1 and index.get("nobody") is None
+            # 检查点只重写有变化的玩家；回放时跳过玩家检查点中已计入的时间线
+            index.flush()
+            stamp = os.stat(index._player_path("p")).st_mtime_ns
+            index.add_many([dict(record, player_id="p1")], [50])
+            index.flush()
+            assert os.stat(index._player_path("p")).st_mtime_ns == stamp
+            replayed = HeatmapIndex(path + ".bin", path + ".heatmap.bin")
+            replayed.position = 0
+            replayed.add_many([dict(record, player_id="p1")] * 2, [44, 50])
+            assert replayed.get("p1").timelines == 2
+            replayed.reset()
+            assert not os.path.exists(path + ".heatmap.players") and replayed.get("p1") is None
+        print("✅ 按键热力图测试通过")
+
+    def test_client_telemetry(self):
+        """测试客户端性能遥测：抽样加权、按模式 / 设备类别分组的分位数与检查点"""
+        from datetime import date
+        from server.telemetry import TelemetryIndex, classify_client
+
+        low_end = "Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Mobile Safari/537.36"
+        desktop = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+        assert classify_client(low_end, 2, 1) == "mobile-chrome-low"
+        assert classify_client(desktop, 16, 8) == "desktop-chrome-high"
+        assert classify_client("", None, None) == "desktop-other-unknown"
+
+        # 低端手机 10% 抽样（每个样本代表 10 个），桌面全量上报
+        batch = {"mode": "defense", "sample_rate": 0.1, "cores": 2, "memory": 1,
+                 "samples": {"fps": [20, 24, 28], "inputLatency": [80], "unknown": [1]}}
+        response = self.client.post("/api/telemetry", json=batch, headers={"User-Agent": low_end})
+        assert response.status_code == 200 and response.json()["data"]["sample_rate"] > 0
+        batch = {"mode": "classic", "sample_rate": 1, "cores": 16, "memory": 8,
+                 "samples": {"fps": [60] * 30, "inputLatency": [8] * 30}}
+        assert self.client.post("/api/telemetry", json=batch, headers={"User-Agent": desktop}).status_code == 200
+
+        data = self.client.get("/api/analytics/performance?by=client").json()["data"]
+        fps = data["fps"]
+        assert fps["overall"]["samples"] == 60 and 20 <= fps["overall"]["p5"] < 21
+        assert 28 <= fps["overall"]["p50"] <= 29 and 60 <= fps["overall"]["p95"] < 61
+        assert fps["groups"]["mobile-chrome-low"]["samples"] == 30 and fps["groups"]["desktop-chrome-high"]["p50"] >= 60
+        assert data["inputLatency"]["overall"]["samples"] == 40
+
+        by_mode = self.client.get("/api/analytics/performance?metrics=fps&mode=defense&by=mode").json()["data"]
+        assert list(by_mode) == ["fps"] and list(by_mode["fps"]["groups"]) == ["defense"]
+        assert by_mode["fps"]["overall"]["samples"] == 30
+        later = self.client.get(f"/api/analytics/performance?since={date.today().replace(year=date.today().year + 1)}")
+        assert later.json()["data"]["fps"]["overall"] == {"samples": 0, "p5": None, "p50": None, "p95": None}
+
+        assert self.client.get("/api/analytics/performance?metrics=fps,gpu").status_code == 400
+        assert self.client.get("/api/analytics/performance?by=browser").status_code == 422
+        assert self.client.post("/api/telemetry", json={**batch, "sample_rate": 0}).status_code == 422
+        # 上报的抽样比例低于服务器下发的比例时按下发比例计权，单批无法压垮分布
+        import main
+        tiny = {"mode": "classic", "sample_rate": 1e-9, "samples": {"fps": [5]}}
+        assert self.client.post("/api/telemetry", json=tiny, headers={"User-Agent": desktop}).status_code == 200
+        fps = self.client.get("/api/analytics/performance?metrics=fps").json()["data"]["fps"]["overall"]
+        assert fps["samples"] == 60 + round(1 / main.TELEMETRY_SAMPLE_RATE) and fps["p50"] >= 28
+        assert "telemetry" in self.client.get("/api/config").json()["data"]
+
+        # 检查点：重新打开后无需回放即可得到同样的直方图
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "telemetry.histograms.json")
+            record = {"timestamp": "2026-01-02T03:04:05", "mode": "words", "client": "desktop-firefox-mid",
+                      "weight": 2, "samples": {"fps": list(range(30, 90)), "memory": [120.5]}}
+            index = TelemetryIndex(path)
+            index.add_many([record], [7])
+            index.flush()
+            reopened = TelemetryIndex(path)
+            assert reopened.position == 7 and reopened.batches == 1
+            assert reopened.query(["fps", "memory"]) == index.query(["fps", "memory"])
+            assert reopened.query(["fps"])["fps"]["overall"]["samples"] == 120
+            assert reopened.query(["fps"], until="2026-01-02")["fps"]["overall"]["samples"] == 0
+        print("✅ 客户端性能遥测测试通过")
+
+    def test_race_rooms(self):
+        """测试多人竞速房间：满员开赛、tick 差异广播、名次与分片"""
+        from server.racing import shard_for
+
+        os.makedirs("data/config", exist_ok=True)
+        with open("data/config/racing.json", "w", encoding="utf-8") as f:
+            json.dump({"multiplayer": {"tickRate": 50, "maxPlayers": 2, "countdown": 0.1, "timeLimit": 30}}, f)
+
+        def apply(view, message):
+            if message["type"] == "snapshot":
+                view.update(message)
+                view["progress"] = {p["slot"]: p["progress"] for p in message["players"]}
+                view["ranks"] = {p["slot"]: p["rank"] for p in message["players"] if p["rank"]}
+            elif message["type"] == "tick":
+                view["progress"].update(dict(message["d"]))
+                view["ranks"].update({slot: rank for slot, rank, _ in message.get("f", [])})
+
+        def until(ws, view, predicate):
+            while not predicate(view):
+                apply(view, ws.receive_json())
+
+        with TestClient(app) as client:
+            with client.websocket_connect("/api/racing/rooms/r1/ws?name=A") as a, \
+                 client.websocket_connect("/api/racing/rooms/r1/ws?name=B") as b:
+                # 两个连接的加入顺序不确定，按各自收到的槽位区分
+                slot_a, slot_b = a.receive_json()["slot"], b.receive_json()["slot"]
+                assert {slot_a, slot_b} == {0, 1}
+                view_a, view_b = {}, {}
+                until(a, view_a, lambda v: v.get("state") == "running")
+                until(b, view_b, lambda v: v.get("state") == "running")
+                assert view_a["text"] == view_b["text"] and view_a["tick_rate"] == 50
+                text = view_a["text"]
+
+                # 满员后再加入会被拒绝
+                with client.websocket_connect("/api/racing/rooms/r1/ws?name=C") as c:
+                    assert c.receive_json() == {"type": "error", "message": "比赛已开始"}
+
+                a.send_json({"p": 3})
+                until(b, view_b, lambda v: v["progress"].get(slot_a) == 3)
+                a.send_json({"p": len(text), "e": 1})
+                b.send_json({"p": len(text) + 10})  # 超出文本长度按完成处理
+                until(a, view_a, lambda v: v.get("state") == "finished")
+                assert sorted(view_a["ranks"].values()) == [1, 2]
+                assert view_a["progress"] == {slot_a: len(text), slot_b: len(text)}
+
+            rooms = client.get("/api/racing/rooms").json()["data"]
+            assert rooms == [] or rooms[0]["state"] == "finished"
+
+        located = self.client.get("/api/racing/rooms/r1").json()["data"]
+        assert located == {"room": "r1", "shard": 0, "url": "/api/racing/rooms/r1/ws"}
+
+        # 多 worker 且未配置分片：同一房间的玩家可能落到不同进程，拒绝比赛
+        import main
+        from starlette.websockets import WebSocketDisconnect
+        workers, main.SERVER_WORKERS = main.SERVER_WORKERS, 4
+        try:
+            assert self.client.get("/api/racing/rooms/r2").status_code == 503
+            with self.client.websocket_connect("/api/racing/rooms/r2/ws?name=A") as ws:
+                try:
+                    ws.receive_json()
+                    assert False, "多 worker 实例不应承载比赛"
+                except WebSocketDisconnect as e:
+                    assert e.code == 1013
+        finally:
+            main.SERVER_WORKERS = workers
+        assert shard_for("r1", 4) == shard_for("r1", 4) and 0 <= shard_for("r1", 4) < 4
+        assert len({shard_for(f"room-{i}", 4) for i in range(100)}) == 4
+        print("✅ 多人竞速房间测试通过")
+
     def test_get_analytics(self):
         """测试获取分析数据"""
         response = self.client.get("/api/analytics")
@@ -187,6 +1027,379 @@ class TestAPI:
         assert "total_games" in data["data"]
         print("✅ 获取分析数据测试通过")
     
+    def test_analytics_aggregates(self):
+        """测试运行聚合与检查点恢复"""
+        records = self.client.get("/api/stats").json()["data"]
+        data = self.client.get("/api/analytics?percentiles=true").json()["data"]
+        assert data["traditional_games"] == len(records)
+        avg_wpm = sum(r["wpm"] for r in records) / len(records)
+        assert abs(data["average_performance"]["traditional"]["avg_wpm"] - avg_wpm) < 1e-9
+        wpm = data["percentiles"]["wpm"]
+        assert wpm["p50"] <= wpm["p90"] <= wpm["p99"]
+
+        # 检查点落盘后，新的索引只回放检查点之后的记录
+        from main import get_stats_table
+        table = get_stats_table("userdata/game_stats.json")
+        table.flush()
+        table.store.append({"wpm": 10.0, "accuracy": 50.0, "mode": "words"})
+        index = AggregatesIndex("game", "userdata/game_stats.analytics.json")
+        assert index.aggregates.count == len(records)
+        StatsTable(open_stats_store(os.path.abspath("userdata/game_stats.json")), {"aggregates": index})
+        assert index.aggregates.count == len(records) + 1
+        print("✅ 运行聚合测试通过")
+
+    def test_non_finite_stats(self):
+        """测试 NaN / Infinity：上报时拒绝，已落盘的旧数据读作 null，不影响建索引与查询"""
+        from server.analytics import FixedHistogram
+        from server.columnar import ColumnarIndex
+        from server.leaderboard import LeaderboardIndex
+        from server.players import PlayerIndex
+
+        headers = {"Content-Type": "application/json"}
+        game = {"wpm": float("nan"), "accuracy": 90.0, "time_taken": 60, "errors": 0, "mode": "classic"}
+        response = self.client.post("/api/stats", content=json.dumps(game), headers=headers)
+        assert response.status_code == 422 and "input" not in response.json()["detail"][0]
+        defense = {"score": 10, "wave": 1, "total_waves": 5, "zombies_killed": 1, "plant_health": 90,
+                   "difficulty": "easy", "victory": False, "play_time": float("inf")}
+        assert self.client.post("/api/defense/stats", content=json.dumps(defense), headers=headers).status_code == 422
+        batch = self.client.post("/api/stats/batch", content=json.dumps([{**game, "wpm": float("-inf")}]), headers=headers)
+        assert batch.json()["data"]["invalid"] == 1
+        telemetry = {"sample_rate": 1, "samples": {"fps": [60, float("nan")]}}
+        assert self.client.post("/api/telemetry", content=json.dumps(telemetry), headers=headers).status_code == 422
+
+        histogram = FixedHistogram(0, 10, 1)
+        histogram.add(float("nan"))
+        histogram.add(float("inf"))
+        assert histogram.total == 0
+
+        # 手工写入的非有限值：重新打开时各索引照常建立，记录中读作 null
+        path = os.path.abspath("userdata/non_finite.json")
+        store = open_stats_store(path)
+        store.append({"wpm": 40.0, "accuracy": 90.0, "mode": "classic", "player_id": "n", "timestamp": "2026-01-01T00:00:00"})
+        with open(store.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"wpm": float("nan"), "accuracy": float("inf"), "mode": "classic",
+                                "player_id": "n", "timestamp": "2026-01-02T00:00:00"}) + "\n")
+        indexes = {
+            "leaderboard": LeaderboardIndex("wpm", "mode"),
+            "players": PlayerIndex("wpm", "mode", 0.01, 1000),
+            "history": ColumnarIndex("game", "mode"),
+            "aggregates": AggregatesIndex("game"),
+        }
+        table = StatsTable(open_stats_store(path), indexes)
+        aggregates = indexes["aggregates"].aggregates
+        assert aggregates.count == 2 and aggregates.summary() == {"avg_wpm": 20.0, "avg_accuracy": 45.0}
+        assert indexes["history"].aggregate().summary() == aggregates.summary()
+        assert [r["wpm"] for r in indexes["leaderboard"].top()] == [40.0, None]
+        assert indexes["players"].profile("n")["best"]["wpm"] == 40.0
+        assert [r["wpm"] for r in table.store.load_all()] == [40.0, None]
+
+        # 超出 int32 列范围的整数：上报时拒绝；旧数据中的超大值截断后照常建索引
+        huge = {"score": 3_000_000_000, "wave": 1, "total_waves": 5, "zombies_killed": 1, "plant_health": 90,
+                "difficulty": "easy", "victory": False, "play_time": 30.0}
+        assert self.client.post("/api/defense/stats", json=huge).status_code == 422
+        assert self.client.post("/api/stats", json={**game, "wpm": 40.0, "time_taken": 10**12}).status_code == 422
+        assert self.client.post("/api/stats", json={**game, "wpm": 40.0, "errors": -1}).status_code == 422
+        columns = ColumnarIndex("defense", "difficulty")
+        columns.add_many([{**huge, "wave": -10**20, "timestamp": "2026-01-01T00:00:00"}], [10])
+        assert columns.columns["score"].tolist() == [2**31 - 1] and columns.columns["wave"].tolist() == [-2**31]
+        assert len(columns.ends) == len(columns.timestamps) == 1
+        print("✅ 非有限数值测试通过")
+
+    def test_stats_compaction(self):
+        """测试保留期压缩：归档段、逐日汇总、压缩前后分析与排行榜一致、其他进程检测重写与中断恢复"""
+        from server.columnar import ColumnarIndex
+        from server.compaction import Archive, Rollups, compact
+        from server.leaderboard import LeaderboardIndex
+
+        def open_table(path, backend="jsonl"):
+            rollups = Rollups(os.path.abspath(f"userdata/archive/{name}.rollups.json"),
+                              Archive(os.path.abspath("userdata/archive"), name), "game", "wpm", "mode", capacity=3)
+            return StatsTable(open_stats_store(path, backend), {
+                "rollups": rollups,
+                "leaderboard": LeaderboardIndex("wpm", "mode", capacity=3, seed=rollups.leaders),
+                "history": ColumnarIndex("game", "mode"),
+                "aggregates": AggregatesIndex("game"),
+            })
+
+        records = [{"wpm": float(10 + i % 17), "accuracy": 90.0, "mode": ["classic", "words"][i % 2],
+                    "timestamp": f"2024-03-{1 + i // 10:02d}T{i % 10:02d}:30:00"} for i in range(100)]
+        for backend in ("jsonl", "sqlite"):
+            name = f"compact_{backend}"
+            path = os.path.abspath(f"userdata/{name}.json")
+            table, other = open_table(path, backend), None
+            table.append_many(records)
+            other = open_table(path, backend)  # 模拟另一个 worker
+            before = table.indexes["aggregates"].aggregates.to_dict()
+            board = table.indexes["leaderboard"].top(3, group="words")
+
+            entry = compact(table, table.indexes["rollups"].archive, "2024-03-06T00:00:00")
+            assert entry["records"] == 50 and entry["last"] == "2024-03-05T09:30:00"
+            assert oct(os.stat(os.path.join("userdata/archive", entry["file"])).st_mode & 0o777) == "0o444"
+            assert [r["timestamp"][:10] for r in table.store.load_all()][0] == "2024-03-06"
+            assert compact(table, table.indexes["rollups"].archive, "2024-03-06T00:00:00") is None
+            for t in (table, other):
+                t.sync()
+                rollups = t.indexes["rollups"]
+                merged = AggregatesIndex("game").aggregates
+                merged.merge(t.indexes["aggregates"].aggregates)
+                merged.merge(rollups.totals())
+                assert merged.to_dict() == before
+                assert t.indexes["aggregates"].aggregates.count == 50 and len(t.indexes["history"]) == 50
+                assert t.indexes["leaderboard"].top(3, group="words") == board
+                # 范围聚合：归档部分按整天计入
+                assert rollups.aggregate("2024-03-02", "2024-03-04").count == 20
+                assert rollups.aggregate(until="2024-03-02T12:00:00", group="words").count == 10
+            assert list(Archive(os.path.abspath("userdata/archive"), name).read_segment(entry)) == records[:50]
+
+            # 汇总文件丢失时从归档段重算
+            os.remove(f"userdata/archive/{name}.rollups.json")
+            assert open_table(path, backend).indexes["rollups"].totals().to_dict() == rollups.totals().to_dict()
+
+        # 中断恢复：段已写出但未登记——热数据未删除则丢弃该段，已删除则补登记
+        name = "compact_recover"
+        path = os.path.abspath(f"userdata/{name}.json")
+        table = open_table(path)
+        table.append_many(records)
+        archive = table.indexes["rollups"].archive
+        orphan = archive.write_segment(records[:10], "2024-03-02T00:00:00")
+        assert compact(table, archive, "2024-03-02T00:00:00")["records"] == 10
+        assert [entry["id"] for entry in archive.segments()] == [orphan["id"]]  # 孤儿段被丢弃后序号复用
+        orphan = archive.write_segment(records[10:20], "2024-03-03T00:00:00")
+        table.store.remove_entries({position for position, r in table.store.iter_entries() if r in records[10:20]})
+        assert compact(table, archive, "2024-03-03T00:00:00") is None
+        assert [entry["id"] for entry in archive.segments()] == [1, 2]
+        assert table.indexes["rollups"].totals().count == 20
+
+        # 扫描与写段期间不持有存储的写锁：追读与写入照常进行
+        import threading
+        name = "compact_concurrent"
+        path = os.path.abspath(f"userdata/{name}.json")
+        table = open_table(path)
+        table.append_many(records)
+        archive = table.indexes["rollups"].archive
+        writing, release = threading.Event(), threading.Event()
+        write_segment = archive.write_segment
+
+        def slow_write_segment(*args):
+            writing.set()
+            release.wait(10)
+            return write_segment(*args)
+
+        archive.write_segment = slow_write_segment
+        compactor = threading.Thread(target=compact, args=(table, archive, "2024-03-03T00:00:00"))
+        compactor.start()
+        assert writing.wait(10)
+        late = {**records[-1], "timestamp": "2024-03-09T00:00:00"}
+        try:
+            import time
+            started = time.monotonic()
+            table.sync()
+            assert table.append_many([late]) == [late]
+            assert time.monotonic() - started < 5  # 不等压缩写完段
+        finally:
+            release.set()
+            compactor.join(10)
+        assert not compactor.is_alive() and archive.segments()[0]["records"] == 20
+        assert table.indexes["aggregates"].aggregates.count == len(records) - 20 + 1
+
+        # 接口：压缩全局统计表后分析结果与排行榜不变，/api/stats 只返回热数据
+        analytics = self.client.get("/api/analytics", params={"percentiles": "true"}).json()["data"]
+        leaderboard = self.client.get("/api/leaderboard", params={"limit": 100}).json()["data"]
+        ranged = self.client.get("/api/leaderboard", params={"until": "2025-01-01"}).json()["data"]
+        profile = self.client.get("/api/players/p-alice").json()["data"]
+        result = self.client.post("/api/admin/compaction", params={"days": 1}).json()["data"]
+        assert result["segments"]["game_stats"]["records"] > 0
+        assert self.client.get("/api/analytics", params={"percentiles": "true"}).json()["data"] == analytics
+        # 归档记录视为先于热数据提交：同分时可能与压缩前的先后不同，名次分数与上榜记录不变
+        after = self.client.get("/api/leaderboard", params={"limit": 100}).json()["data"]
+        assert [r["wpm"] for r in after] == [r["wpm"] for r in leaderboard]
+        assert sorted(map(json.dumps, after)) == sorted(map(json.dumps, leaderboard))
+        assert self.client.get("/api/leaderboard", params={"until": "2025-01-01"}).json()["data"] == ranged
+        assert self.client.get("/api/players/p-alice").json()["data"] == profile
+        stats = self.client.get("/api/stats").json()["data"]
+        assert all(not r.get("timestamp") or r["timestamp"] >= result["cutoff"] for r in stats)
+        archive = self.client.get("/api/admin/archive").json()["data"]["tables"]["game_stats"]
+        assert archive["archived_records"] == result["segments"]["game_stats"]["records"]
+        assert self.client.post("/api/admin/compaction").status_code == 400
+
+        # 后台压缩出错时记录带堆栈的日志，下一轮重试
+        import asyncio
+        import logging
+        import main
+
+        class Capture(logging.Handler):
+            def __init__(self):
+                super().__init__()
+                self.records = []
+
+            def emit(self, record):
+                self.records.append(record)
+
+        def failing(days):
+            raise OSError("磁盘已满")
+
+        async def run_once():
+            task = asyncio.create_task(main.compaction_loop())
+            await asyncio.sleep(0.2)
+            task.cancel()
+
+        capture = Capture()
+        logging.getLogger("typequest").addHandler(capture)
+        compact_stats, main.compact_stats = main.compact_stats, failing
+        try:
+            asyncio.run(run_once())
+        finally:
+            main.compact_stats = compact_stats
+            logging.getLogger("typequest").removeHandler(capture)
+        assert len(capture.records) == 1 and capture.records[0].levelno == logging.ERROR
+        assert capture.records[0].exc_info[0] is OSError
+        print("✅ 统计数据压缩测试通过")
+
+    def test_metrics(self):
+        """测试 /metrics 指标输出"""
+        self.client.get("/api/leaderboard")
+        self.client.get("/api/leaderboard?mode=classic")
+        self.client.post("/api/stats", json={"wpm": 40.0, "accuracy": 90.0, "time_taken": 60, "errors": 4, "mode": "classic"})
+        response = self.client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        text = response.text
+        # 路由标签使用路由模板，查询参数不产生新的标签
+        assert 'typequest_http_requests_total{method="GET",route="/api/leaderboard",status="200"}' in text
+        assert 'typequest_http_request_duration_seconds_bucket{method="GET",route="/api/leaderboard",le="+Inf"}' in text
+        assert 'typequest_http_response_size_bytes_count{method="POST",route="/api/stats"}' in text
+        assert 'typequest_stats_saves_total{table="game_stats",result="success"}' in text
+        assert "typequest_json_loads_total" in text
+        sizes = [line for line in text.splitlines() if line.startswith('typequest_stats_file_size_bytes{table="game_stats"}')]
+        assert int(sizes[0].split()[-1]) == os.path.getsize("userdata/game_stats.jsonl")
+        # 同一指标族的样本连续输出
+        names = [line.split()[2] for line in text.splitlines() if line.startswith("# TYPE")]
+        assert len(names) == len(set(names))
+        print("✅ 指标输出测试通过")
+
+    def test_profiling(self):
+        """测试按需请求剖析与结果下载"""
+        import asyncio
+        import pstats
+        from server.profiling import CPROFILE_PER_THREAD, ProfileSession
+
+        # cprofile 规则下经 run_io 的接口照常返回（3.12 起改用 sampling）
+        rule = {"route": "/api/analytics", "rate": 1.0, "mode": "cprofile"}
+        assert self.client.post("/api/admin/profiling", json=rule).status_code == 200
+        assert self.client.get("/api/analytics").status_code == 200
+        self.client.get("/api/leaderboard")  # 未开启的路由不剖析
+        rule = {"route": "/api/leaderboard", "rate": 1.0, "mode": "sampling", "interval_ms": 0.1}
+        self.client.post("/api/admin/profiling", json=rule)
+        self.client.get("/api/leaderboard")
+        profiles = self.client.get("/api/admin/profiling").json()["data"]["profiles"]
+        cprofile_mode = "cprofile" if CPROFILE_PER_THREAD else "sampling"
+        assert [(p["route"], p["mode"]) for p in profiles] == [
+            ("/api/leaderboard", "sampling"), ("/api/analytics", cprofile_mode)]
+        if not CPROFILE_PER_THREAD:
+            self.client.delete("/api/admin/profiling")
+            print("✅ 请求剖析测试通过（cprofile 已改用 sampling）")
+            return
+
+        sampled, profiled = profiles[0]["id"], profiles[1]["id"]
+        response = self.client.get(f"/api/admin/profiling/{profiled}", params={"format": "pstats"})
+        with open("analytics.prof", "wb") as f:
+            f.write(response.content)
+        functions = {name for _, _, name in pstats.Stats("analytics.prof").stats}
+        # 事件循环上的处理函数与 run_io 线程中的工作都被计入
+        assert "get_game_analytics" in functions and "get_stats_table" in functions
+        text = self.client.get(f"/api/admin/profiling/{profiled}", params={"format": "text"}).text
+        assert "cumulative" in text
+        collapsed = self.client.get(f"/api/admin/profiling/{sampled}", params={"format": "collapsed"})
+        assert collapsed.status_code == 200
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in collapsed.text.splitlines())
+        assert self.client.get(f"/api/admin/profiling/{sampled}", params={"format": "pstats"}).status_code == 400
+        assert self.client.get("/api/admin/profiling/9999").status_code == 404
+
+        self.client.delete("/api/admin/profiling")
+        self.client.get("/api/analytics")
+        state = self.client.get("/api/admin/profiling").json()["data"]
+        assert state["rules"] == {} and len(state["profiles"]) == 2
+
+        # 事件循环上并发的其他协程不计入被剖析的请求
+        def profiled_work():
+            return sum(range(1000))
+
+        def other_work():
+            return sum(range(1000))
+
+        async def request(work):
+            for _ in range(20):
+                work()
+                await asyncio.sleep(0)
+
+        async def run_both():
+            session = ProfileSession("cprofile", 0.001)
+            session.start()
+            await asyncio.gather(session.run(request(profiled_work)), request(other_work))
+            session.stop()
+            return session.result()
+
+        functions = {name for _, _, name in asyncio.run(run_both()).stats}
+        assert "profiled_work" in functions and "other_work" not in functions
+        print("✅ 请求剖析测试通过")
+
+    def test_static_assets(self):
+        """测试带指纹的静态资源：白名单、immutable 缓存、预压缩与构建产物"""
+        import gzip
+        import re
+        from server.assets import AssetBundle
+        response = self.client.get("/")
+        assert response.status_code == 200
+        assert response.headers["cache-control"] == "no-cache"
+        scripts = re.findall(r'<script src="(/js/[^"]+)"', response.text)
+        assert scripts and all(re.search(r"\.[0-9a-f]{12}\.js$", src) for src in scripts)
+        script = self.client.get(scripts[0], headers={"Accept-Encoding": "gzip"})
+        assert script.headers["cache-control"] == "public, max-age=31536000, immutable"
+        assert script.headers["content-type"].startswith("application/javascript")
+        plain = self.client.get(scripts[0], headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in plain.headers
+        assert script.content == plain.content  # httpx 已自动解压
+        etag = plain.headers["etag"]
+        assert self.client.get(scripts[0], headers={"If-None-Match": etag}).status_code == 304
+        # 原始路径仍可访问，但需要重新验证
+        assert self.client.get("/js/utils.js").headers["cache-control"] == "no-cache"
+        for path in ("/main.py", "/uv.lock", "/pyproject.toml", "/userdata/game_stats.jsonl", "/tests/test_api.py"):
+            assert self.client.get(path).status_code == 404, path
+
+        root = str(Path(__file__).parent.parent)
+        bundle = AssetBundle.build(root, bundle=True, minify=True)
+        index = bundle.get("").rendered.body.decode("utf-8")
+        local_scripts = re.findall(r'<script src="(/[^"]+)"', index)
+        assert len(local_scripts) == 1 and "/js/bundle." in local_scripts[0]
+        bundled = bundle.get(local_scripts[0][1:])
+        assert bundled.immutable and gzip.decompress(bundled.rendered.encoded("gzip")) == bundled.rendered.body
+        bundle.write("dist")
+        loaded = AssetBundle.load("dist", root)
+        assert not loaded.is_stale()
+        assert loaded.get(local_scripts[0][1:]).rendered.body == bundled.rendered.body
+        assert "gzip" in loaded.get(local_scripts[0][1:]).rendered.encodings
+
+        # 源码变化检查：每个间隔最多 stat 一次目录树；只有 css/、js/、assets/ 下的路径跳过检查
+        from server import assets
+        server = assets.AssetServer(root, "dist", check_interval=60)
+        server.lookup("")
+        checks = []
+        is_stale = assets.AssetBundle.is_stale
+        assets.AssetBundle.is_stale = lambda bundle: checks.append(1) or False
+        try:
+            for path in ("", "index.html", "favicon.ico", "api/unknown", "jsfoo/x", "js/utils.js"):
+                server.lookup(path)
+            assert checks == []
+            server._checked_at = 0.0
+            server.lookup("js/utils.js")
+            assert checks == []
+            server.lookup("jsfoo/x")
+            server.lookup("")
+            assert checks == [1]
+        finally:
+            assets.AssetBundle.is_stale = is_stale
+        print("✅ 静态资源测试通过")
+
     def run_all_tests(self):
         """运行所有测试"""
         print("🧪 开始运行后端 API 测试...")
@@ -200,12 +1413,38 @@ class TestAPI:
             self.test_get_defense_words()
             self.test_defense_config()
             self.test_racing_config()
+            self.test_content_cache()
+            self.test_conditional_get()
             self.test_defense_wave_generation()
+            self.test_wave_sampler()
+            self.test_word_index()
+            self.test_defense_campaign()
+            self.test_defense_simulator()
             self.test_save_game_stats()
             self.test_save_defense_stats()
             self.test_get_stats()
+            self.test_stats_migration()
+            self.test_stats_history_query()
+            self.test_columnar_stats()
+            self.test_sqlite_backend()
+            self.test_multi_worker_store()
             self.test_get_leaderboard()
+            self.test_leaderboard_filters()
+            self.test_player_profiles()
+            self.test_live_leaderboard()
+            self.test_concurrent_stats_writes()
+            self.test_stats_batch()
+            self.test_keystroke_timelines()
+            self.test_key_heatmap()
+            self.test_client_telemetry()
+            self.test_race_rooms()
             self.test_get_analytics()
+            self.test_analytics_aggregates()
+            self.test_non_finite_stats()
+            self.test_stats_compaction()
+            self.test_metrics()
+            self.test_profiling()
+            self.test_static_assets()
             
             print("🎉 所有后端 API 测试通过！")
             return True